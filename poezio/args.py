@@ -1,7 +1,6 @@
 """
 Module related to the argument parsing
 """
-import pkg_resources
 import stat
 import sys
 from argparse import ArgumentParser, SUPPRESS, Namespace
@@ -38,6 +37,16 @@ def parse_args(CONFIG_PATH: Path):
         type=Path,
         help="The config file you want to use",
         metavar="CONFIG_FILE")
+    parser.add_argument(
+        "--profile-startup",
+        dest="profile_startup",
+        nargs='?',
+        const=xdg.CACHE_HOME / 'startup_profile.txt',
+        type=Path,
+        help="Measure the time spent importing the modules and starting "
+        "poezio, and write the results into a file (by default "
+        "$XDG_CACHE_HOME/poezio/startup_profile.txt)",
+        metavar="PROFILE_FILE")
     parser.add_argument(
         '-v',
         '--version',
@@ -67,6 +76,7 @@ def run_cmdline_args() -> Tuple[Namespace, bool]:
             sys.stderr.write(
                 'Poezio was unable to create the config directory: %s\n' % e)
             sys.exit(1)
+        import pkg_resources
         default = Path(__file__).parent / '..' / 'data' / 'default_config.cfg'
         other = Path(
             pkg_resources.resource_filename('poezio', 'default_config.cfg'))
@@ -53,6 +53,7 @@ DEFAULT_CONFIG: ConfigDict = {
         'default_nick': '',
         'default_muc_service': '',
         'device_id': '',
+        'disco_cache_ttl': 3600.0,
         'nick_color_aliases': True,
         'display_activity_notifications': False,
         'display_gaming_notifications': False,
@@ -77,6 +78,7 @@ DEFAULT_CONFIG: ConfigDict = {
         'force_encryption': True,
         'go_to_previous_tab_on_alt_number': False,
         'group_corrections': True,
+        'group_join_part': False,
         'hide_exit_join': -1,
         'hide_status_change': 120,
         'hide_user_list': False,
@@ -90,14 +92,20 @@ DEFAULT_CONFIG: ConfigDict = {
         'keyfile': '',
         'lang': 'en',
         'lazy_resize': True,
+        'log_backend': 'text',
         'log_dir': '',
         'log_errors': True,
+        'log_flush_interval': 0.0,
+        'log_flush_size': 65536,
+        'log_fsync': False,
         'mam_sync': True,
+        'mam_sync_concurrency': 4,
         'mam_sync_limit': 2000,
         'max_lines_in_memory': 2048,
         'max_messages_in_memory': 2048,
         'max_nick_length': 25,
         'muc_history_length': 50,
+        'muc_presence_batch_delay': 0.0,
         'notify_messages': True,
         'open_all_bookmarks': False,
         'password': '',
@@ -106,6 +114,7 @@ DEFAULT_CONFIG: ConfigDict = {
         'plugins_dir': '',
         'popup_time': 4,
         'private_auto_response': '',
+        'redraw_interval': 0.02,
         'remote_fifo_path': './',
         'request_message_receipts': True,
         'rooms': '',
@@ -148,7 +157,11 @@ DEFAULT_CONFIG: ConfigDict = {
         'vertical_tab_list_size': 20,
         'vertical_tab_list_sort': 'desc',
         'whitespace_interval': 300,
-        'words': ''
+        'words': '',
+        'xml_capture': False,
+        'xml_capture_file': '',
+        'xml_capture_size': 64,
+        'xml_highlight_thread': False,
     },
     'bindings': {
         'M-i': '^I'
@@ -173,20 +186,38 @@ class Config:
 
     configparser: PoezioConfigParser
     file_name: Path
-    default: ConfigDict
     default_section: str = 'Poezio'
 
     def __init__(self, file_name: Path, default: Optional[ConfigDict] = None) -> None:
+        # (option, tab JID, fallback, fallback_server, default) -> value
+        self._tabname_cache: Dict[Tuple[Any, ...], Any] = {}
         self.configparser = PoezioConfigParser()
         # make the options case sensitive
         self.file_name = file_name
         self.read_file()
         self.default = default or {}
 
+    @property
+    def default(self) -> ConfigDict:
+        return self._default
+
+    @default.setter
+    def default(self, default: ConfigDict) -> None:
+        self._default = default
+        self.invalidate_cache()
+
+    def invalidate_cache(self) -> None:
+        """
+        Forget the values resolved by get_by_tabname, must be called
+        each time the configuration is modified.
+        """
+        self._tabname_cache.clear()
+
     def optionxform(self, value):
         return str(value)
 
     def read_file(self):
+        self.invalidate_cache()
         self.configparser.read(str(self.file_name), encoding='utf-8')
         # Check config integrity and fix it if it’s wrong
         # only when the object is the main config
@@ -246,9 +277,11 @@ class Config:
         return self.configparser.has_section(*args, **kwargs)
 
     def add_section(self, *args, **kwargs):
+        self.invalidate_cache()
         return self.configparser.add_section(*args, **kwargs)
 
     def remove_section(self, *args, **kwargs):
+        self.invalidate_cache()
         return self.configparser.remove_section(*args, **kwargs)
 
     def get_by_tabname(self,
@@ -262,13 +295,33 @@ class Config:
         a section named `tabname`, if the option is not present
         in the section, we search for the global option if fallback is
         True. And we return `default` as a fallback as a last resort.
+
+        The resolved values (already converted to the type of the default
+        value) are cached until the configuration changes, since this is
+        called for every message or presence.
         """
+        try:
+            key = (option, str(tabname), fallback, fallback_server, default)
+            return self._tabname_cache[key]
+        except KeyError:
+            pass
+        except TypeError:  # unhashable default value
+            return self._get_by_tabname(option, tabname, fallback,
+                                        fallback_server, default)
+        value = self._get_by_tabname(option, tabname, fallback,
+                                     fallback_server, default)
+        self._tabname_cache[key] = value
+        return value
+
+    def _get_by_tabname(self, option, tabname: JID, fallback: bool,
+                        fallback_server: bool, default):
         if self.default and (not default) and fallback:
             default = self.default.get(self.default_section, {}).get(option, '')
-        if tabname in self.sections():
-            if option in self.options(tabname):
+        section = str(tabname)
+        if self.has_section(section):
+            if self.has_option(section, option):
                 # We go the tab-specific option
-                return self.get(option, default, tabname.full)
+                return self.get(option, default, section)
         if fallback_server:
             return self.get_by_servname(tabname, option, default, fallback)
         if fallback:
@@ -286,7 +339,7 @@ class Config:
             server = ''
         if server:
             server = '@' + server
-            if server in self.sections() and option in self.options(server):
+            if self.has_section(server) and self.has_option(server, option):
                 return self.get(option, default, server)
         if fallback:
             return self.get(option, default)
@@ -511,6 +564,7 @@ class Config:
                         ' Current value is %s.' % (option, current or "empty"),
                         'Warning')
         value = str(value)
+        self.invalidate_cache()
         if self.has_section(section):
             self.configparser.set(section, option, value)
         else:
@@ -529,6 +583,7 @@ class Config:
         """
         if section == USE_DEFAULT_SECTION:
             section = self.default_section
+        self.invalidate_cache()
         if self.has_section(section):
             self.configparser.remove_option(section, option)
         if not self.remove_in_file(section, option):
@@ -541,6 +596,7 @@ class Config:
         """
         if section == USE_DEFAULT_SECTION:
             section = self.default_section
+        self.invalidate_cache()
         if self.has_section(section):
             self.configparser.set(section, option, str(value))
         else:
@@ -554,6 +610,7 @@ class Config:
         """
         if section == USE_DEFAULT_SECTION:
             section = self.default_section
+        self.invalidate_cache()
         try:
             self.configparser.set(section, option, str(value))
         except NoSectionError:
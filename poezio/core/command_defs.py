@@ -436,6 +436,19 @@ def get_commands(commands: CommandCore, completions: CompletionCore, plugin_mana
             "usage": "<jid>",
             "shortdesc": "List available ad-hoc commands on the given jid",
         },
+        {
+            "name": "search",
+            "func": commands.search,
+            "usage": "[in:<jid>|in:all] [nick:<nick>] [after:<date>] "
+            "[before:<date>] <words>",
+            "desc": "Search the messages containing all the given words in "
+            "the logs of the current conversation, of another JID (in:<jid>) "
+            "or of all of them (in:all, the default outside of a "
+            "conversation). The results can be restricted to the messages "
+            "of a nick, or to the ones sent after or before a date "
+            "(YYYY-MM-DD or YYYY-MM-DDTHH:MM).",
+            "shortdesc": "Search the logs.",
+        },
         {
             "name": "reload",
             "func": commands.reload,
@@ -3,6 +3,8 @@ Global commands which are to be linked to the Core class
 """
 
 import asyncio
+from datetime import datetime
+from time import monotonic
 from urllib.parse import unquote
 from xml.etree import ElementTree as ET
 from typing import List, Optional, Tuple
@@ -20,11 +22,13 @@ from poezio.bookmarks import Bookmark
 from poezio.config import config, DEFAULT_CONFIG
 from poezio.contact import Contact, Resource
 from poezio.decorators import deny_anonymous
+from poezio.logger import logger, WORD_RE
 from poezio.plugin import PluginConfig
 from poezio.roster import roster
 from poezio.theming import dump_tuple, get_theme
 from poezio.decorators import command_args_parser
 from poezio.core.structs import Command, POSSIBLE_SHOW
+from poezio.ui.types import InfoMessage, Message
 
 
 log = logging.getLogger(__name__)
@@ -1358,6 +1362,94 @@ class CommandCore:
                  if show else 'available', nick, self.core.custom_version))
         self.core.information(info, 'Info')
 
+    @command_args_parser.raw
+    async def search(self, args):
+        """
+        /search [in:<jid>|in:all] [nick:<nick>] [after:<date>] [before:<date>] <words>
+        """
+        words = []
+        scope = nick = after = before = None
+        for arg in args.split():
+            option, sep, value = arg.partition(':')
+            if not sep or not value or option not in ('in', 'nick', 'after',
+                                                      'before'):
+                words.append(arg)
+            elif option == 'in':
+                scope = value
+            elif option == 'nick':
+                nick = value
+            else:
+                try:
+                    date = datetime.fromisoformat(value)
+                except ValueError:
+                    return self.core.information(
+                        'Invalid date: %s' % value, 'Error')
+                if option == 'after':
+                    after = date
+                else:
+                    before = date
+        if not words:
+            return self.help('search')
+        tab = self.core.tabs.current_tab
+        if scope is None:
+            scope = tab.log_name if isinstance(tab, tabs.ChatTab) else 'all'
+
+        lines = []
+        if scope == 'all':
+            last_report = monotonic()
+
+            def progress(done: int, total: int) -> None:
+                nonlocal last_report
+                if done < total and monotonic() - last_report >= 1:
+                    last_report = monotonic()
+                    self.core.information(
+                        'Searching the logs: %d/%d files' % (done, total),
+                        'Info')
+
+            results = await logger.search_all(
+                words, nick, after, before, progress=progress)
+            for jid, msg in results:
+                lines.append((msg['time'], '%s: %s> %s' % (
+                    jid, msg.get('nickname', ''), msg['txt'])))
+        elif isinstance(tab, tabs.ChatTab) and scope == tab.log_name and \
+                not config.get_by_tabname('use_log', tab.jid):
+            # Nothing on disk, look in the messages still in memory
+            needle = set(WORD_RE.findall(' '.join(words).lower()))
+            for msg in reversed(tab._text_buffer.messages):
+                if not isinstance(msg, Message) or \
+                        not needle <= set(WORD_RE.findall(msg.txt.lower())):
+                    continue
+                if nick is not None and \
+                        (msg.nickname or '').lower() != nick.lower():
+                    continue
+                time = common.to_utc(msg.time)
+                if (after is not None and time < common.to_utc(after)) or \
+                        (before is not None and time >= common.to_utc(before)):
+                    continue
+                lines.append((msg.time, '%s> %s' % (msg.nickname, msg.txt)))
+        else:
+            for msg in logger.search(scope, words, nick, after, before):
+                lines.append((msg['time'], '%s> %s' % (
+                    msg.get('nickname', ''), msg['txt'])))
+
+        if not isinstance(tab, tabs.ChatTab):
+            text = '\n'.join(
+                '%s %s' % (time.strftime('%Y-%m-%d %H:%M'), line)
+                for time, line in reversed(lines))
+            return self.core.information(
+                'Search results:\n%s' % text if text else 'No result found.',
+                'Info')
+        text_buffer = tab._text_buffer
+        text_buffer.add_message(InfoMessage('Search results:'))
+        for time, line in reversed(lines):
+            text_buffer.add_message(InfoMessage(
+                '%s %s' % (time.strftime('%Y-%m-%d'), line), time=time))
+        text_buffer.add_message(InfoMessage(
+            'End of search results (%d found)' % len(lines)))
+        tab.text_win.pos = 0
+        self.core.refresh_window()
+        return None
+
     @command_args_parser.ignored
     def reload(self):
         """
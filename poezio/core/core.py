@@ -17,6 +17,7 @@ import shutil
 import time
 from collections import defaultdict
 from typing import (
+    AbstractSet,
     Any,
     Callable,
     Dict,
@@ -59,12 +60,15 @@ from poezio.config import config
 from poezio.contact import Contact, Resource
 from poezio.daemon import Executor
 from poezio.fifo import Fifo
+from poezio.log_loader import MAMSyncScheduler
 from poezio.logger import logger
 from poezio.plugin_manager import PluginManager
 from poezio.roster import roster
 from poezio.size_manager import SizeManager
+from poezio.startup_profile import profiler
 from poezio.user import User
 from poezio.text_buffer import TextBuffer
+from poezio.ui.render import line_cache
 from poezio.timed_events import DelayedEvent
 from poezio import keyboard, xdg
 
@@ -73,6 +77,9 @@ from poezio.core.tabs import Tabs
 from poezio.core.commands import CommandCore
 from poezio.core.command_defs import get_commands
 from poezio.core.handlers import HandlerCore
+from poezio.core.disco import DiscoCache
+from poezio.core.redraw import RedrawScheduler, TAB, TAB_WIN, INPUT, INFO_WIN
+from poezio.core.xml_highlight import XMLHighlighter
 from poezio.core.structs import (
     Command,
     Status,
@@ -171,6 +178,10 @@ class Core:
         self.events.add_event_handler('tab_change', self.on_tab_change)
 
         self.tabs = Tabs(self.events, GapTab())
+        self.redraw = RedrawScheduler(self)
+        self.disco = DiscoCache(self)
+        self.mam_sync = MAMSyncScheduler(self)
+        self.xml_highlighter = XMLHighlighter()
         self.previous_tab_nb = 0
 
         self.own_nick: str = (
@@ -289,6 +300,7 @@ class Core:
             ('connected', self.handler.on_connected),
             ('connection_failed', self.handler.on_failed_connection),
             ('disconnected', self.handler.on_disconnected),
+            ('entity_caps', self.handler.on_entity_caps),
             ('reconnect_delay', self.handler.on_reconnect_delay),
             ('failed_all_auth', self.handler.on_failed_all_auth),
             ('got_offline', self.handler.on_got_offline),
@@ -482,6 +494,7 @@ class Core:
         Called when the theme option is changed
         """
         error_msg = theming.reload_theme()
+        line_cache.clear()
         if error_msg:
             self.information(error_msg, 'Warning')
         self.refresh_window()
@@ -510,6 +523,7 @@ class Core:
         # reload the theme
         log.debug("Reloading the theme…")
         theming.reload_theme()
+        line_cache.clear()
         log.debug("Theme reloaded.")
         # reload the config from the disk
         log.debug("Reloading the config…")
@@ -565,11 +579,13 @@ class Core:
         """
         plugins = config.getstr('plugins_autoload')
         if ':' in plugins:
-            for plugin in plugins.split(':'):
-                self.plugin_manager.load(plugin, unload_first=False)
+            plugins_list = plugins.split(':')
         else:
-            for plugin in plugins.split():
-                self.plugin_manager.load(plugin, unload_first=False)
+            plugins_list = plugins.split()
+        with profiler.phase('plugin autoload'):
+            for plugin in plugins_list:
+                with profiler.phase('plugin %s' % plugin):
+                    self.plugin_manager.load(plugin, unload_first=False)
         self.plugins_autoloaded = True
 
     def start(self):
@@ -606,6 +622,13 @@ class Core:
 
     def exit(self, event=None):
         log.debug("exit(%s)", event)
+        log.debug("Redraw statistics: %s", self.redraw.stats())
+        log.debug("Disco cache statistics: %s", self.disco.stats())
+        log.debug("XML highlighting statistics: %s",
+                  self.xml_highlighter.stats())
+        self.redraw.cancel()
+        profiler.write_report()
+        logger.flush()
         asyncio.get_event_loop().stop()
 
     def on_exception(self, typ, value, trace):
@@ -674,7 +697,8 @@ class Core:
                     self.do_command(replace_line_breaks(char), False)
             else:
                 self.do_command(''.join(char_list), True)
-        self.doupdate()
+        # Draw right away, including what was waiting for the next frame
+        self.redraw.flush()
 
     def loop_exception_handler(self, loop, context) -> None:
         """Do not log unhandled iq errors and timeouts"""
@@ -939,17 +963,13 @@ class Core:
         or a mediated one if it does not.
         TODO: allow passwords
         """
-        features = set()
+        features: AbstractSet[str] = set()
 
         # force mediated: act as if the other entity does not
         # support direct invites
         if not force_mediated:
             try:
-                iq = await self.xmpp.plugin['xep_0030'].get_info(
-                    jid=jid,
-                    timeout=5,
-                )
-                features = iq['disco_info'].get_features()
+                features = await self.disco.get_features(jid, timeout=5)
             except (IqError, IqTimeout):
                 pass
         supports_direct = 'jabber:x:conference' in features
@@ -1442,8 +1462,8 @@ class Core:
 ####################### Curses and ui-related stuff ###########################
 
     def doupdate(self) -> None:
-        "Do a curses update"
-        curses.doupdate()
+        "Schedule a curses update"
+        self.redraw.request()
 
     def information(self, msg: str, typ: str = '') -> bool:
         """
@@ -1476,8 +1496,7 @@ class Core:
             self._pop_information_win_up(nb_lines, popup_time)
         else:
             if self.information_win_size != 0:
-                self.information_win.refresh()
-                self.tabs.current_tab.refresh_input()
+                self.redraw.request(INFO_WIN, INPUT)
         return True
 
     def _init_curses(self, stdscr) -> None:
@@ -1492,7 +1511,8 @@ class Core:
         stdscr.keypad(1)
         curses.start_color()
         curses.use_default_colors()
-        theming.reload_theme()
+        with profiler.phase('theme load'):
+            theming.reload_theme()
         curses.ungetch(" ")  # H4X: without this, the screen is
         stdscr.getkey()  # erased on the first "getkey()"
 
@@ -1508,29 +1528,21 @@ class Core:
 
     def refresh_window(self) -> None:
         """
-        Refresh everything
+        Refresh everything (on the next frame)
         """
-        nocursor = curses.curs_set(0)
-        self.tabs.current_tab.state = 'current'
-        self.tabs.current_tab.refresh()
-        self.doupdate()
-        curses.curs_set(nocursor)
+        self.redraw.request(TAB)
 
     def refresh_tab_win(self) -> None:
         """
-        Refresh the window containing the tab list
+        Refresh the window containing the tab list (on the next frame)
         """
-        self.tabs.current_tab.refresh_tab_win()
-        self.refresh_input()
-        self.doupdate()
+        self.redraw.request(TAB_WIN, INPUT)
 
     def refresh_input(self) -> None:
         """
-        Refresh the input if it exists
+        Refresh the input if it exists (on the next frame)
         """
-        if self.tabs.current_tab.input:
-            self.tabs.current_tab.input.refresh()
-        self.doupdate()
+        self.redraw.request(INPUT)
 
     def scroll_page_down(self):
         """
@@ -1822,7 +1834,9 @@ class Core:
 
         if not self.xmpp.anon and config.getbool('use_remote_bookmarks'):
             try:
-                await self.bookmarks.get_remote(self.xmpp, self.information)
+                with profiler.phase('remote bookmarks fetch'):
+                    await self.bookmarks.get_remote(self.xmpp,
+                                                    self.information)
             except IqError as error:
                 type_ = error.iq['error']['type']
                 condition = error.iq['error']['condition']
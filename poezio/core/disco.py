@@ -0,0 +1,128 @@
+"""
+Module defining the DiscoCache, which keeps the disco#info results of the
+entities for a while, so that the features of a server or a room are not
+queried again each time they are needed (each MAM page, each join…).
+
+The results are forgotten after ``disco_cache_ttl`` seconds, on
+reconnection, and when an entity advertises new capabilities.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from dataclasses import dataclass
+from time import monotonic
+from typing import Dict, FrozenSet, Optional, Tuple, Union, TYPE_CHECKING
+
+from slixmpp import JID
+
+from poezio.config import config
+
+if TYPE_CHECKING:
+    from poezio.core.core import Core
+
+log = logging.getLogger(__name__)
+
+__all__ = [
+    'CachedDiscoInfo',
+    'DiscoCache',
+]
+
+
+@dataclass(frozen=True)
+class CachedDiscoInfo:
+    """The disco#info result of an entity"""
+    features: FrozenSet[str]
+    # (category, type, lang, name) tuples
+    identities: FrozenSet[Tuple[str, str, Optional[str], Optional[str]]]
+
+
+class DiscoCache:
+    """
+    Cache of the disco#info results, by JID. Concurrent requests for the
+    same JID share a single query.
+
+    The errors are not cached, the caller gets the IqError or IqTimeout.
+    """
+    core: Core
+    # number of results found in the cache (or in a pending query), and of
+    # queries actually sent
+    hits: int
+    misses: int
+
+    def __init__(self, core: Core) -> None:
+        self.core = core
+        # JID -> (expiration time, result)
+        self._entries: Dict[str, Tuple[float, CachedDiscoInfo]] = {}
+        # JID -> query in progress
+        self._pending: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get_info(self, jid: Union[str, JID],
+                       timeout: Optional[int] = None) -> CachedDiscoInfo:
+        """Get the disco#info result of an entity"""
+        key = str(jid)
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > monotonic():
+                self.hits += 1
+                return entry[1]
+            del self._entries[key]
+        task = self._pending.get(key)
+        if task is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            task = self._pending[key] = asyncio.ensure_future(
+                self._query(key, timeout))
+            # Do not complain about an error nobody waited for
+            task.add_done_callback(
+                lambda task: task.cancelled() or task.exception())
+        return await asyncio.shield(task)
+
+    async def get_features(self, jid: Union[str, JID],
+                           timeout: Optional[int] = None) -> FrozenSet[str]:
+        """Get the features of an entity"""
+        return (await self.get_info(jid, timeout)).features
+
+    async def has_feature(self, jid: Union[str, JID], feature: str,
+                          timeout: Optional[int] = None) -> bool:
+        """Check if an entity advertises a feature"""
+        return feature in await self.get_features(jid, timeout)
+
+    def invalidate(self, jid: Union[None, str, JID] = None) -> None:
+        """Forget about an entity, or about all of them"""
+        if jid is None:
+            self._entries.clear()
+            self._pending.clear()
+            return
+        key = str(jid)
+        self._entries.pop(key, None)
+        self._pending.pop(key, None)
+
+    def stats(self) -> str:
+        """A summary of the cache statistics, for debugging purposes."""
+        return '%d hits, %d misses, %d entities cached' % (
+            self.hits, self.misses, len(self._entries))
+
+    async def _query(self, key: str,
+                     timeout: Optional[int]) -> CachedDiscoInfo:
+        task = asyncio.current_task()
+        try:
+            iq = await self.core.xmpp.plugin['xep_0030'].get_info(
+                jid=JID(key), timeout=timeout)
+        finally:
+            # The result of a query started before an invalidation is
+            # returned, but not kept
+            valid = self._pending.get(key) is task
+            if valid:
+                del self._pending[key]
+        info = CachedDiscoInfo(
+            frozenset(iq['disco_info'].get_features()),
+            frozenset(iq['disco_info'].get_identities()),
+        )
+        ttl = config.getfloat('disco_cache_ttl')
+        if ttl > 0 and valid:
+            self._entries[key] = (monotonic() + ttl, info)
+        return info
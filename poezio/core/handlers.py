@@ -19,8 +19,7 @@ import pyasn1.codec.der.decoder
 import pyasn1.codec.der.encoder
 import pyasn1_modules.rfc2459
 from slixmpp import InvalidJID, JID, Message, Iq, Presence
-from slixmpp.xmlstream.stanzabase import StanzaBase, ElementBase
-from xml.etree import ElementTree as ET
+from slixmpp.xmlstream.stanzabase import StanzaBase
 
 from poezio import tabs
 from poezio import xhtml
@@ -31,26 +30,16 @@ from poezio.core.structs import Status
 from poezio.contact import Resource
 from poezio.logger import logger
 from poezio.roster import roster
+from poezio.startup_profile import profiler
 from poezio.text_buffer import AckError
 from poezio.theming import dump_tuple, get_theme
 from poezio.ui.types import (
-    XMLLog,
     InfoMessage,
     PersistentInfoMessage,
 )
 
 from poezio.core.commands import dumb_callback
 
-try:
-    from pygments import highlight
-    from pygments.lexers import get_lexer_by_name
-    from pygments.formatters import HtmlFormatter
-    LEXER = get_lexer_by_name('xml')
-    FORMATTER = HtmlFormatter(noclasses=True)
-    PYGMENTS = True
-except ImportError:
-    PYGMENTS = False
-
 log = logging.getLogger(__name__)
 
 CERT_WARNING_TEXT = """
@@ -83,10 +72,17 @@ class HandlerCore:
         """
         Enable carbons & blocking on session start if wanted and possible
         """
-        iq = await self.core.xmpp.plugin['xep_0030'].get_info(
-            jid=self.core.xmpp.boundjid.domain
+        try:
+            await self._session_start_features()
+        finally:
+            # The startup ends with the fetch of the remote bookmarks
+            profiler.finish(lambda path: self.core.information(
+                'Startup profile written to %s' % path, 'Info'))
+
+    async def _session_start_features(self):
+        features = await self.core.disco.get_features(
+            self.core.xmpp.boundjid.domain
         )
-        features = iq['disco_info']['features']
 
         rostertab = self.core.tabs.by_name_and_class(
             'Roster', tabs.RosterInfoTab)
@@ -98,6 +94,12 @@ class HandlerCore:
             self.core.xmpp.plugin['xep_0280'].enable()
         await self.core.check_bookmark_storage(features)
 
+    def on_entity_caps(self, presence: Presence) -> None:
+        """
+        An entity advertised new capabilities, forget its old ones
+        """
+        self.core.disco.invalidate(presence['from'])
+
     def find_identities(self, _):
         asyncio.create_task(
             self.core.xmpp['xep_0030'].get_info_from_domain(),
@@ -486,6 +488,8 @@ class HandlerCore:
             muc.leave_groupchat(
                 self.core.xmpp, room_from, self.core.own_nick, msg='')
             return
+        # Apply the presences received before this message first
+        tab.process_presence_queue()
         valid_message = await tab.handle_message(message)
         if valid_message and 'message' in config.getstr('beep_on').split():
             if (not config.get_by_tabname('disable_beep', room_from)
@@ -509,6 +513,10 @@ class HandlerCore:
             return
 
         room_from = jid.bare
+        muc_tab = self.core.tabs.by_name_and_class(room_from, tabs.MucTab)
+        if muc_tab is not None:
+            # Apply the presences received before this message first
+            muc_tab.process_presence_queue()
         use_xhtml = config.get_by_tabname(
             'enable_xhtml_im',
             jid.bare
@@ -965,6 +973,8 @@ class HandlerCore:
         Called when we are connected and authenticated
         """
         self.core.connection_time = time.time()
+        profiler.end_phase('connection')
+        self.core.disco.invalidate()
         if not self.core.plugins_autoloaded:  # Do not reload plugins on reconnection
             self.core.autoload_plugins()
         self.core.information("Authentication success.", 'Info')
@@ -972,7 +982,9 @@ class HandlerCore:
                               'Info')
         if not self.core.xmpp.anon:
             # request the roster
-            self.core.xmpp.get_roster()
+            profiler.start_phase('roster fetch')
+            self.core.xmpp.get_roster().add_done_callback(
+                lambda _: profiler.end_phase('roster fetch'))
             roster.update_contact_groups(self.core.xmpp.boundjid.bare)
             # send initial presence
             if config.getbool('send_initial_presence'):
@@ -1084,6 +1096,7 @@ class HandlerCore:
         time = message['delay']['stamp']
         if subject is None or not tab:
             return
+        tab.process_presence_queue()
         if subject != tab.topic:
             # Do not display the message if the subject did not change or if we
             # receive an empty topic when joining the room.
@@ -1180,57 +1193,14 @@ class HandlerCore:
         We are sending a new stanza, write it in the xml buffer if needed.
         """
         if self.core.xml_tab:
-            stanza_str = str(stanza)
-            if PYGMENTS:
-                xhtml_text = highlight(stanza_str, LEXER, FORMATTER)
-                poezio_colored = xhtml.xhtml_to_poezio_colors(
-                    xhtml_text, force=True).rstrip('\x19o').strip()
-            else:
-                poezio_colored = stanza_str
-            self.core.xml_buffer.add_message(
-                XMLLog(txt=poezio_colored, incoming=False),
-            )
-            try:
-                if self.core.xml_tab.match_stanza(
-                        ElementBase(ET.fromstring(stanza_str))):
-                    self.core.xml_tab.filtered_buffer.add_message(
-                        XMLLog(txt=poezio_colored, incoming=False),
-                    )
-            except:
-                # Most of the time what gets logged is whitespace pings. Skip.
-                # And also skip tab updates.
-                if stanza_str.strip() == '':
-                    return None
-                log.debug('', exc_info=True)
-
-            if isinstance(self.core.tabs.current_tab, tabs.XMLTab):
-                self.core.tabs.current_tab.refresh()
-                self.core.doupdate()
+            self.core.xml_tab.add_stanza(stanza, incoming=False)
 
     def incoming_stanza(self, stanza: StanzaBase):
         """
         We are receiving a new stanza, write it in the xml buffer if needed.
         """
         if self.core.xml_tab:
-            if PYGMENTS:
-                xhtml_text = highlight(str(stanza), LEXER, FORMATTER)
-                poezio_colored = xhtml.xhtml_to_poezio_colors(
-                    xhtml_text, force=True).rstrip('\x19o').strip()
-            else:
-                poezio_colored = str(stanza)
-            self.core.xml_buffer.add_message(
-                XMLLog(txt=poezio_colored, incoming=True),
-            )
-            try:
-                if self.core.xml_tab.match_stanza(stanza):
-                    self.core.xml_tab.filtered_buffer.add_message(
-                        XMLLog(txt=poezio_colored, incoming=True),
-                    )
-            except:
-                log.debug('', exc_info=True)
-            if isinstance(self.core.tabs.current_tab, tabs.XMLTab):
-                self.core.tabs.current_tab.refresh()
-                self.core.doupdate()
+            self.core.xml_tab.add_stanza(stanza, incoming=True)
 
     def ssl_invalid_chain(self, tb):
         self.core.information('The certificate sent by the server is invalid.',
@@ -0,0 +1,137 @@
+"""
+Module defining the RedrawScheduler, which coalesces the screen refreshes
+requested by the handlers into frames.
+
+Handlers mark the parts of the screen they changed as dirty, and the
+scheduler redraws them at most once per ``redraw_interval`` seconds, using
+the asyncio loop. The keyboard input path flushes immediately, so that the
+echo of the keys is never delayed.
+"""
+from __future__ import annotations
+
+import asyncio
+import curses
+import logging
+from time import monotonic
+from typing import Optional, Set, TYPE_CHECKING
+
+from poezio.config import config
+
+if TYPE_CHECKING:
+    from poezio.core.core import Core
+
+log = logging.getLogger(__name__)
+
+__all__ = [
+    'RedrawScheduler',
+    'TAB',
+    'TAB_WIN',
+    'INPUT',
+    'INFO_WIN',
+]
+
+# The regions of the screen that can be marked as dirty
+TAB = 'tab'
+TAB_WIN = 'tab_win'
+INPUT = 'input'
+INFO_WIN = 'info_win'
+
+
+class RedrawScheduler:
+    """
+    Keep track of the dirty regions of the screen and redraw them in a
+    single frame.
+    """
+    core: Core
+    dirty: Set[str]
+    # number of redraw requests, and of frames actually drawn
+    request_count: int
+    redraw_count: int
+    # time spent drawing the frames, in seconds
+    last_frame_time: float
+    max_frame_time: float
+    total_frame_time: float
+
+    def __init__(self, core: Core) -> None:
+        self.core = core
+        self.dirty = set()
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._last_frame = 0.0
+        self.request_count = 0
+        self.redraw_count = 0
+        self.last_frame_time = 0.0
+        self.max_frame_time = 0.0
+        self.total_frame_time = 0.0
+
+    def request(self, *regions: str) -> None:
+        """
+        Mark some regions as dirty and schedule a frame. Without any
+        region, only the physical update of the screen is scheduled.
+        """
+        self.request_count += 1
+        self.dirty.update(regions)
+        if self._handle is not None:
+            return
+        interval = config.getfloat('redraw_interval')
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is None or interval <= 0:
+            self.flush()
+            return
+        delay = max(0.0, self._last_frame + interval - monotonic())
+        self._handle = loop.call_later(delay, self.flush)
+
+    def flush(self) -> None:
+        """
+        Redraw the dirty regions now, and update the screen.
+        """
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        dirty, self.dirty = self.dirty, set()
+        start = monotonic()
+        core = self.core
+        tab = core.tabs.current_tab
+        if TAB in dirty:
+            nocursor = curses.curs_set(0)
+            tab.state = 'current'
+            tab.refresh()
+            curses.doupdate()
+            curses.curs_set(nocursor)
+        else:
+            if INFO_WIN in dirty and core.information_win_size != 0:
+                core.information_win.refresh()
+            if TAB_WIN in dirty:
+                tab.refresh_tab_win()
+            if dirty and tab.input:
+                tab.input.refresh()
+            curses.doupdate()
+        end = monotonic()
+        self._last_frame = end
+        self.redraw_count += 1
+        self.last_frame_time = end - start
+        self.total_frame_time += self.last_frame_time
+        self.max_frame_time = max(self.max_frame_time, self.last_frame_time)
+
+    def cancel(self) -> None:
+        """
+        Forget about the pending frame, if any.
+        """
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        self.dirty.clear()
+
+    def stats(self) -> str:
+        """
+        A summary of the redraw statistics, for debugging purposes.
+        """
+        average = 0.0
+        if self.redraw_count:
+            average = self.total_frame_time / self.redraw_count
+        return ('%d redraws for %d requests, %.2fms per frame on average, '
+                '%.2fms at most') % (
+                    self.redraw_count, self.request_count,
+                    average * 1000, self.max_frame_time * 1000)
@@ -0,0 +1,174 @@
+"""
+Module defining the XMLHighlighter, which colorizes the stanzas of the XML
+console.
+
+The stanzas are captured as plain text, and only the ones that are actually
+displayed are colorized (with pygments, if it is available). The results
+are cached by text, and the colorization can run in a worker thread when
+``xml_highlight_thread`` is set, so that a busy XML console does not delay
+the handling of the stanzas.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from poezio import xhtml
+from poezio.config import config
+from poezio.ui.types import XMLLog
+
+log = logging.getLogger(__name__)
+
+__all__ = [
+    'XMLHighlighter',
+    'colorize',
+    'get_pygments',
+]
+
+
+@lru_cache(maxsize=None)
+def get_pygments() -> Optional[Tuple[Callable, Any, Any]]:
+    """
+    Import pygments, the first time a stanza is colorized, and return its
+    highlight function, XML lexer and formatter (or None if it is not
+    available).
+    """
+    try:
+        from pygments import highlight
+        from pygments.lexers import get_lexer_by_name
+        from pygments.formatters import HtmlFormatter
+    except ImportError:
+        return None
+    return highlight, get_lexer_by_name('xml'), HtmlFormatter(noclasses=True)
+
+
+def colorize(raw: str) -> str:
+    """Colorize a serialized stanza with the poezio color codes"""
+    pygments = get_pygments()
+    if pygments is None or not raw.strip():
+        return raw
+    highlight, lexer, formatter = pygments
+    try:
+        xhtml_text = highlight(raw, lexer, formatter)
+        return xhtml.xhtml_to_poezio_colors(
+            xhtml_text, force=True).rstrip('\x19o').strip()
+    except Exception:
+        log.debug('Unable to colorize %r', raw, exc_info=True)
+        return raw
+
+
+class XMLHighlighter:
+    """
+    Colorize the XMLLog messages on demand, and cache the results.
+    """
+    size: int
+    # number of texts found in the cache, and actually colorized
+    hits: int
+    misses: int
+
+    def __init__(self, size: int = 1024) -> None:
+        self.size = size
+        # raw text -> colorized text
+        self._cache: OrderedDict[str, str] = OrderedDict()
+        # id -> message being colorized in the worker thread
+        self._pending: Dict[int, XMLLog] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.hits = 0
+        self.misses = 0
+
+    def highlight(self, messages: Iterable[XMLLog],
+                  callback: Callable[[List[XMLLog]], None]) -> None:
+        """
+        Colorize the given messages. The callback is called with the
+        messages whose text changed, right away for the ones found in the
+        cache (or all of them without a worker thread), and later for the
+        others.
+        """
+        done: List[XMLLog] = []
+        todo: List[XMLLog] = []
+        for msg in messages:
+            if msg.highlighted or id(msg) in self._pending:
+                continue
+            colored = self._lookup(msg.raw)
+            if colored is not None:
+                msg.set_highlighted(colored)
+                done.append(msg)
+            else:
+                todo.append(msg)
+        if todo and self._use_thread():
+            for msg in todo:
+                self._pending[id(msg)] = msg
+            asyncio.ensure_future(self._highlight_in_thread(todo, callback))
+        else:
+            for msg in todo:
+                msg.set_highlighted(self._colorize(msg.raw))
+            done.extend(todo)
+        if done:
+            callback(done)
+
+    def clear(self) -> None:
+        """Forget the cached results and the pending messages"""
+        self._cache.clear()
+        self._pending.clear()
+
+    def stats(self) -> str:
+        """A summary of the cache statistics, for debugging purposes."""
+        return '%d hits, %d misses, %d stanzas cached' % (
+            self.hits, self.misses, len(self._cache))
+
+    def _use_thread(self) -> bool:
+        if not config.getbool('xml_highlight_thread') or \
+                get_pygments() is None:
+            return False
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+        return True
+
+    async def _highlight_in_thread(
+            self, messages: List[XMLLog],
+            callback: Callable[[List[XMLLog]], None]) -> None:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix='xml_highlight')
+        loop = asyncio.get_running_loop()
+        raws = [msg.raw for msg in messages]
+        try:
+            results = await loop.run_in_executor(
+                self._executor, lambda: [colorize(raw) for raw in raws])
+        finally:
+            for msg in messages:
+                self._pending.pop(id(msg), None)
+        done = []
+        for msg, raw, colored in zip(messages, raws, results):
+            self._store(raw, colored)
+            if not msg.highlighted:
+                msg.set_highlighted(colored)
+                done.append(msg)
+        self.misses += len(messages)
+        if done:
+            callback(done)
+
+    def _colorize(self, raw: str) -> str:
+        self.misses += 1
+        colored = colorize(raw)
+        self._store(raw, colored)
+        return colored
+
+    def _lookup(self, raw: str) -> Optional[str]:
+        colored = self._cache.get(raw)
+        if colored is not None:
+            self._cache.move_to_end(raw)
+            self.hits += 1
+        return colored
+
+    def _store(self, raw: str, colored: str) -> None:
+        self._cache[raw] = colored
+        self._cache.move_to_end(raw)
+        while len(self._cache) > self.size:
+            self._cache.popitem(last=False)
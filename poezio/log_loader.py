@@ -14,22 +14,23 @@ How the log loading works will depend on the poezio configuration:
 - all log loading/writing workflows are paused until the MAM sync is complete
   (so that the local log loading can be up-to-date with the MAM history)
 - when use_log is False, mam_sync has no effect
+- the MAM syncs are run by the MAMSyncScheduler of the core, a few at a
+  time (mam_sync_concurrency), the current tab first
 """
 from __future__ import annotations
 import asyncio
 import logging
 from datetime import datetime, timedelta, timezone
-from typing import List, Optional
+from time import monotonic
+from typing import AsyncGenerator, List, Optional, Tuple, TYPE_CHECKING
 from poezio import tabs
+from poezio.config import config
 from poezio.logger import (
-    build_log_message,
-    iterate_messages_reverse,
-    last_message_in_archive,
     Logger,
     LogDict,
 )
 from poezio.mam import (
-    fetch_history,
+    fetch_history_pages,
     NoMAMSupportException,
     MAMQueryException,
     DiscoInfoException,
@@ -40,6 +41,8 @@ from poezio.ui.types import EndOfArchive, Message, BaseMessage
 from poezio.text_buffer import HistoryGap
 from slixmpp import JID
 
+if TYPE_CHECKING:
+    from poezio.core.core import Core
 
 # Max number of messages to insert when filling a gap
 HARD_LIMIT = 999
@@ -92,32 +95,52 @@ class LogLoader:
         """Called on a tab opening or a MUC join"""
         amount = 2 * self.tab.text_win.height
         gap = self.tab._text_buffer.find_last_gap_muc()
-        messages = []
-        if gap is not None:
-            if self.mam_only:
-                messages = await self.mam_fill_gap(gap, amount)
+        if self.mam_only:
+            if gap is not None:
+                pages = self.mam_fill_gap(gap, amount)
             else:
-                messages = await self.local_fill_gap(gap, amount)
+                pages = self.mam_tab_open(amount)
+            count = await self.insert_pages(pages)
         else:
-            if self.mam_only:
-                messages = await self.mam_tab_open(amount)
+            await self.logger.import_text_logs(self.tab.jid)
+            if gap is not None:
+                messages = await self.local_fill_gap(gap, amount)
             else:
                 messages = await self.local_tab_open(amount)
+            count = len(messages)
+            if messages:
+                self.tab._text_buffer.add_history_messages(messages)
+                self.tab.core.refresh_window()
 
-        log.debug(
-            'Fetched %s messages for %s',
-            len(messages), self.tab.jid
-        )
-        if messages:
-            self.tab._text_buffer.add_history_messages(messages)
-            self.tab.core.refresh_window()
+        log.debug('Fetched %s messages for %s', count, self.tab.jid)
         self._done()
 
-    async def mam_tab_open(self, nb: int) -> List[BaseMessage]:
+    async def insert_pages(
+            self, pages: AsyncGenerator[List[BaseMessage], None]) -> int:
+        """Insert pages of history messages in the tab as they arrive (the
+        latest first), and display them. No more pages are fetched once the
+        tab is closed.
+
+        :returns: the number of inserted messages
+        """
+        count = 0
+        try:
+            async for page in pages:
+                if not self.tab.closed:
+                    self.tab._text_buffer.add_history_messages(page)
+                    self.tab.core.refresh_window()
+                    count += len(page)
+                if self.tab.closed:
+                    break
+        finally:
+            await pages.aclose()
+        return count
+
+    async def mam_tab_open(self, nb: int) -> AsyncGenerator[List[BaseMessage], None]:
         """Fetch messages in MAM when opening a new tab.
 
         :param nb: number of max messages to fetch.
-        :returns: list of ui messages to add
+        :returns: pages of ui messages to add, the latest first
         """
         tab = self.tab
         end = datetime.now()
@@ -128,9 +151,10 @@ class LogLoader:
                 break
         end = end - timedelta(microseconds=1)
         try:
-            return await fetch_history(tab, end=end, amount=nb)
+            async for page in fetch_history_pages(tab, end=end, amount=nb):
+                yield page
         except (NoMAMSupportException, MAMQueryException, DiscoInfoException):
-            return []
+            return
         finally:
             tab.query_status = False
 
@@ -147,9 +171,8 @@ class LogLoader:
         await self.wait_mam()
         limit = self._get_time_limit()
         results: List[BaseMessage] = []
-        filepath = self.logger.get_file_path(self.tab.jid)
         count = 0
-        for msg in iterate_messages_reverse(filepath):
+        for msg in self.logger.iterate_messages_reverse(self.tab.jid):
             typ_ = msg.pop('type')
             if typ_ == 'message':
                 results.append(make_line_local(self.tab, msg))
@@ -162,11 +185,11 @@ class LogLoader:
                 await asyncio.sleep(0)
         return results[::-1]
 
-    async def mam_fill_gap(self, gap: HistoryGap, amount: Optional[int] = None) -> List[BaseMessage]:
+    async def mam_fill_gap(self, gap: HistoryGap, amount: Optional[int] = None) -> AsyncGenerator[List[BaseMessage], None]:
         """Fill a message gap in an existing tab using MAM.
 
         :param gap: Object describing the history gap
-        :returns: list of ui messages to add
+        :returns: pages of ui messages to add, the latest first
         """
         tab = self.tab
         if amount is None:
@@ -179,14 +202,15 @@ class LogLoader:
         if end:
             end = end - timedelta(seconds=1)
         try:
-            return await fetch_history(
+            async for page in fetch_history_pages(
                 tab,
                 start=start,
                 end=end,
                 amount=amount,
-            )
+            ):
+                yield page
         except (NoMAMSupportException, MAMQueryException, DiscoInfoException):
-            return []
+            return
         finally:
             tab.query_status = False
 
@@ -206,8 +230,8 @@ class LogLoader:
         count = 0
 
         results: List[BaseMessage] = []
-        filepath = self.logger.get_file_path(self.tab.jid)
-        for msg in iterate_messages_reverse(filepath):
+        messages = self.logger.iterate_messages_reverse(self.tab.jid, before=end)
+        for msg in messages:
             typ_ = msg.pop('type')
             if start and msg['time'] < start:
                 break
@@ -240,12 +264,12 @@ class LogLoader:
             return None
 
         if self.mam_only:
-            messages = await self.mam_scroll_requested(height)
+            await self.insert_pages(self.mam_scroll_requested(height))
         else:
             messages = await self.local_scroll_requested(height)
-        if messages:
-            tab._text_buffer.add_history_messages(messages)
-            tab.core.refresh_window()
+            if messages:
+                tab._text_buffer.add_history_messages(messages)
+                tab.core.refresh_window()
         self._done()
 
     async def local_scroll_requested(self, nb: int) -> List[BaseMessage]:
@@ -264,8 +288,10 @@ class LogLoader:
             first_message_time = first_message.time - timedelta(microseconds=1)
 
         results: List[BaseMessage] = []
-        filepath = self.logger.get_file_path(self.tab.jid)
-        for msg in iterate_messages_reverse(filepath):
+        messages = self.logger.iterate_messages_reverse(
+            self.tab.jid, before=first_message_time,
+        )
+        for msg in messages:
             typ_ = msg.pop('type')
             if first_message_time is None or msg['time'] < first_message_time:
                 if typ_ == 'message':
@@ -277,33 +303,106 @@ class LogLoader:
                 await asyncio.sleep(0)
         return results[::-1]
 
-    async def mam_scroll_requested(self, nb: int) -> List[BaseMessage]:
+    async def mam_scroll_requested(self, nb: int) -> AsyncGenerator[List[BaseMessage], None]:
         """Fetch messages from MAM on scroll up.
 
         :param nb: Number of messages to fetch
-        :returns: list of ui messages to add
+        :returns: pages of ui messages to add, the latest first
         """
         tab = self.tab
         try:
-            messages = await fetch_history(tab, amount=nb)
+            fetched = False
+            async for page in fetch_history_pages(tab, amount=nb):
+                fetched = True
+                yield page
             last_message_exists = False
             if tab._text_buffer.messages:
                 last_message = tab._text_buffer.messages[0]
                 last_message_exists = True
-            if (not messages and
+            if (not fetched and
                     last_message_exists
                     and not isinstance(last_message, EndOfArchive)):
                 time = tab._text_buffer.messages[0].time
-                messages = [EndOfArchive('End of archive reached', time=time)]
-            return messages
+                yield [EndOfArchive('End of archive reached', time=time)]
         except NoMAMSupportException:
-            return []
+            return
         except (MAMQueryException, DiscoInfoException):
             tab.core.information(
                 f'An error occured when fetching MAM for {tab.jid}',
                 'Error'
             )
-            return []
+            return
+        finally:
+            tab.query_status = False
+
+    async def goto_requested(self, date: datetime) -> None:
+        """When /sb goto asks for a date older than the buffer.
+
+        Load the history since that date, then go to it.
+        """
+        if self.mam_only:
+            count = await self.insert_pages(self.mam_goto_requested(date))
+        else:
+            messages = await self.local_goto_requested(date)
+            count = len(messages)
+            if messages:
+                self.tab._text_buffer.add_history_messages(messages)
+        if count and not self.tab.closed:
+            self.tab.goto_build_lines(date, load_history=False)
+        self._done()
+
+    async def local_goto_requested(self, date: datetime) -> List[BaseMessage]:
+        """Fetch the local messages between a date and the buffer.
+
+        :param date: Date to go to
+        :returns: list of ui messages to add
+        """
+        await self.wait_mam()
+        tab = self.tab
+        count = 0
+
+        first_message = tab._text_buffer.find_first_message()
+        first_message_time = None
+        if first_message:
+            first_message_time = first_message.time - timedelta(microseconds=1)
+
+        date = to_utc(date)
+        results: List[BaseMessage] = []
+        messages = self.logger.iterate_messages_reverse(
+            self.tab.jid, before=first_message_time,
+        )
+        for msg in messages:
+            typ_ = msg.pop('type')
+            reached = to_utc(msg['time']) <= date
+            if typ_ == 'message':
+                results.append(make_line_local(self.tab, msg))
+            # Stop on the last message sent before the date
+            if reached or len(results) >= HARD_LIMIT:
+                break
+            count += 1
+            if count % 20 == 0:
+                await asyncio.sleep(0)
+        return results[::-1]
+
+    async def mam_goto_requested(self, date: datetime) -> AsyncGenerator[List[BaseMessage], None]:
+        """Fetch the MAM messages between a date and the buffer.
+
+        :param date: Date to go to
+        :returns: pages of ui messages to add, the latest first
+        """
+        tab = self.tab
+        try:
+            async for page in fetch_history_pages(
+                    tab, start=date, amount=HARD_LIMIT):
+                yield page
+        except NoMAMSupportException:
+            return
+        except (MAMQueryException, DiscoInfoException):
+            tab.core.information(
+                f'An error occured when fetching MAM for {tab.jid}',
+                'Error'
+            )
+            return
         finally:
             tab.query_status = False
 
@@ -322,7 +421,7 @@ class MAMFiller:
     """
     tab: tabs.ChatTab
     logger: Logger
-    future: asyncio.Future
+    future: Optional[asyncio.Future]
     done: asyncio.Event
     limit: int
 
@@ -330,36 +429,49 @@ class MAMFiller:
         self.tab = tab
         self.logger = logger
         logger.fd_busy(tab.jid)
-        self.future = asyncio.create_task(self.fetch_routine())
+        self.future = None
         self.done = asyncio.Event()
         self.limit = limit
         self.result = 0
+        tab.core.mam_sync.submit(self)
+
+    def start(self) -> None:
+        """Start the routine, when the MAMSyncScheduler allows it."""
+        self.future = asyncio.create_task(self.fetch_routine())
 
     def cancel(self) -> None:
         """Cancel the routine and signal the end."""
-        self.future.cancel()
+        if self.future is not None:
+            self.future.cancel()
         self.end()
 
     async def fetch_routine(self) -> None:
         """Load logs into the local archive, if possible."""
-        filepath = self.logger.get_file_path(self.tab.jid)
         log.debug('Fetching logs for %s', self.tab.jid)
         try:
-            last_msg = last_message_in_archive(filepath)
+            await self.logger.import_text_logs(self.tab.jid)
+            last_msg = self.logger.last_message(self.tab.jid)
             last_msg_time = None
             if last_msg:
                 last_msg_time = last_msg['time'] + timedelta(seconds=1)
+            # The pages arrive latest first: the database can store them
+            # right away, but the text logs have to be written in order.
+            streaming = self.logger.get_store() is not None
+            pages = []
             try:
-                messages = await fetch_history(
-                    self.tab,
-                    start=last_msg_time,
-                    amount=self.limit,
-                )
+                async for page in fetch_history_pages(
+                        self.tab,
+                        start=last_msg_time,
+                        amount=self.limit):
+                    if streaming:
+                        self.logger.log_history(self.tab.jid, page)
+                    else:
+                        pages.append(page)
+                    self.result += len(page)
                 log.debug(
                     'Fetched %s messages to fill local logs for %s',
-                    len(messages), self.tab.jid,
+                    self.result, self.tab.jid,
                 )
-                self.result = len(messages)
             except NoMAMSupportException:
                 log.debug('The entity %s does not support MAM', self.tab.jid)
                 return
@@ -370,16 +482,9 @@ class MAMFiller:
                 )
                 return
 
-            def build_message(msg) -> str:
-                return build_log_message(
-                    msg.nickname,
-                    msg.txt,
-                    msg.time,
-                    prefix='MR',
-                )
-
-            logs = ''.join(map(build_message, messages))
-            self.logger.log_raw(self.tab.jid, logs, force=True)
+            messages = [msg for page in reversed(pages) for msg in page]
+            if messages:
+                self.logger.log_history(self.tab.jid, messages)
         finally:
             self.end()
 
@@ -393,3 +498,79 @@ class MAMFiller:
             log.error('Error when restoring log fd:', exc_info=True)
         self.tab.mam_filler = None
         self.done.set()
+        self.tab.core.mam_sync.finished(self)
+
+
+class MAMSyncScheduler:
+    """
+    Run the MAM syncs of the tabs (MAMFiller) a few at a time, instead of
+    all of them at once when joining many rooms.
+
+    The waiting syncs are started in order of priority: the current tab
+    first, then the tabs with the most important state (highlight, private
+    message…), then in the order they were requested.
+    """
+    core: Core
+    waiting: List[MAMFiller]
+    running: List[MAMFiller]
+    # number of syncs requested and done since the scheduler was last idle
+    total: int
+    finished_count: int
+    # duration of the last batch of syncs, in seconds
+    last_sync_time: float
+
+    def __init__(self, core: Core) -> None:
+        self.core = core
+        self.waiting = []
+        self.running = []
+        self.total = 0
+        self.finished_count = 0
+        self.last_sync_time = 0.0
+        self._start = 0.0
+
+    def submit(self, filler: MAMFiller) -> None:
+        """Start a sync now, or once there is room for it"""
+        if not self.waiting and not self.running:
+            self.total = self.finished_count = 0
+            self._start = monotonic()
+        self.total += 1
+        self.waiting.append(filler)
+        self._start_next()
+
+    def finished(self, filler: MAMFiller) -> None:
+        """Called when a sync is over (or cancelled)"""
+        if filler in self.running:
+            self.running.remove(filler)
+        elif filler in self.waiting:
+            self.waiting.remove(filler)
+        else:
+            return
+        self.finished_count += 1
+        log.debug('MAM sync for %s over (%s)', filler.tab.jid,
+                  self.progress())
+        if self.waiting or self.running:
+            self._start_next()
+            return
+        self.last_sync_time = monotonic() - self._start
+        if self.total > 1:
+            self.core.information(
+                'History of %d conversations synced in %.1fs' %
+                (self.total, self.last_sync_time), 'Info')
+
+    def progress(self) -> str:
+        """A summary of the current syncs"""
+        return '%d/%d done, %d running, %d waiting' % (
+            self.finished_count, self.total, len(self.running),
+            len(self.waiting))
+
+    def _priority(self, filler: MAMFiller) -> Tuple[bool, float]:
+        tab = filler.tab
+        return (tab is not self.core.tabs.current_tab, -tab.priority)
+
+    def _start_next(self) -> None:
+        limit = max(config.getint('mam_sync_concurrency'), 1)
+        while self.waiting and len(self.running) < limit:
+            filler = min(self.waiting, key=self._priority)
+            self.waiting.remove(filler)
+            self.running.append(filler)
+            filler.start()
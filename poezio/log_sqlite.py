@@ -0,0 +1,363 @@
+"""
+SQLite storage for the conversation logs, used instead of the plain text
+files when log_backend is set to ``sqlite``.
+
+All the messages are kept in a single table, indexed by JID and date, so
+that loading the history of a tab (or the part of it older than a date) is
+a range query. The id of the messages is also stored, to avoid duplicates
+when syncing the logs with the MAM archive of the server.
+
+The existing text logs of a JID are imported the first time the JID is
+used, a chunk at a time, and the text files are left untouched.
+
+When the SQLite library has the FTS5 extension, the words of the messages
+are also indexed in a full-text table, used by the searches.
+"""
+
+import asyncio
+import logging
+import sqlite3
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import (
+    Generator, Iterable, List, Mapping, Optional, Set, Tuple, Union
+)
+
+from poezio import common
+from poezio.logger import (
+    INDEX_DIR,
+    SEARCH_INDEX_DIR,
+    WORD_RE,
+    LogDict,
+    parse_log_lines,
+    utc_timestamp,
+)
+
+from slixmpp import JID
+
+log = logging.getLogger(__name__)
+
+# Name of the database, inside the log dir
+DB_NAME = 'logs.db'
+# Number of bytes of a text log imported in each transaction
+IMPORT_CHUNK_SIZE = 1 << 20
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    jid TEXT NOT NULL,
+    time INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    nick TEXT NOT NULL DEFAULT '',
+    stanza_id TEXT NOT NULL DEFAULT '',
+    txt TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_time ON messages (jid, time, id);
+CREATE INDEX IF NOT EXISTS messages_nick
+    ON messages (jid, nick COLLATE NOCASE, time);
+CREATE UNIQUE INDEX IF NOT EXISTS messages_stanza_id
+    ON messages (jid, stanza_id, nick) WHERE stanza_id != '';
+CREATE TABLE IF NOT EXISTS imported (
+    name TEXT PRIMARY KEY,
+    size INTEGER NOT NULL
+);
+'''
+
+FTS_SCHEMA = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5 (
+    txt, content='messages', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages
+BEGIN
+    INSERT INTO messages_fts (rowid, txt) VALUES (new.id, new.txt);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages
+BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, txt)
+        VALUES ('delete', old.id, old.txt);
+END;
+'''
+
+# (UTC timestamp, type, nick, stanza id, text) of a message to store
+Row = Tuple[int, str, str, str, str]
+
+
+def make_log_dict(time: int, typ: str, nick: str, txt: str) -> LogDict:
+    """Build the same dict as parse_log_lines from a row"""
+    utc = datetime.fromtimestamp(time, timezone.utc).replace(tzinfo=None)
+    message = LogDict({
+        'history': True,
+        'time': common.get_local_time(utc),
+        'type': typ,
+        'txt': txt,
+    })
+    if typ == 'message':
+        message['nickname'] = nick
+    return message
+
+
+class SQLiteLogStore:
+    """
+    The messages of all the JIDs, in a SQLite database.
+    """
+    path: Path
+    log_dir: Path
+
+    def __init__(self, log_dir: Path):
+        self.log_dir = log_dir
+        self.path = log_dir / DB_NAME
+        log_dir.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.path))
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(SCHEMA)
+        self.fts = self._create_fts()
+        # JIDs whose text logs are known to be imported
+        self._imported: Set[str] = set()
+        # JIDs whose text logs are being imported by import_text_logs_async
+        self._importing: Set[str] = set()
+
+    def _create_fts(self) -> bool:
+        """Create the full-text index if FTS5 is available"""
+        exists = self._db.execute(
+            'SELECT 1 FROM sqlite_master WHERE name = \'messages_fts\''
+        ).fetchone()
+        try:
+            with self._db:
+                self._db.executescript(FTS_SCHEMA)
+                if not exists:
+                    # Index the messages stored before
+                    self._db.execute(
+                        'INSERT INTO messages_fts (messages_fts) '
+                        'VALUES (\'rebuild\')')
+        except sqlite3.OperationalError:
+            log.debug('FTS5 is not available, searching without it',
+                      exc_info=True)
+            return False
+        return True
+
+    def close(self) -> None:
+        """Close the database"""
+        self._db.close()
+
+    def import_text_logs(self, jid: Union[str, JID]) -> int:
+        """
+        Import the part of the text log file of a JID which is not in the
+        database yet.
+
+        :returns: the number of imported messages
+        """
+        jid = str(jid)
+        if jid in self._imported or jid in self._importing:
+            return 0
+        self._imported.add(jid)
+        return sum(self._import_chunks(jid))
+
+    async def import_text_logs_async(self, jid: Union[str, JID]) -> int:
+        """
+        Same as :meth:`import_text_logs`, but let the other tasks run
+        between the chunks.
+        """
+        jid = str(jid)
+        if jid in self._imported or jid in self._importing:
+            return 0
+        self._importing.add(jid)
+        count = 0
+        try:
+            for imported in self._import_chunks(jid):
+                count += imported
+                await asyncio.sleep(0)
+        finally:
+            self._importing.discard(jid)
+        self._imported.add(jid)
+        return count
+
+    def _import_chunks(self, jid: str) -> Generator[int, None, None]:
+        """
+        Import the new part of the text log file of a JID, one transaction
+        of about IMPORT_CHUNK_SIZE bytes at a time, yielding the number of
+        messages imported by each of them.
+        """
+        name = jid.replace('/', '\\')
+        path = self.log_dir / name
+        row = self._db.execute('SELECT size FROM imported WHERE name = ?',
+                               (name, )).fetchone()
+        done = row[0] if row else 0
+        chunk_size = IMPORT_CHUNK_SIZE
+        total = 0
+        try:
+            size = path.stat().st_size
+            if size <= done:
+                return
+            fd = path.open('rb')
+        except OSError:
+            return
+        with fd:
+            while done < size:
+                fd.seek(done)
+                data = fd.read(min(chunk_size, size - done))
+                if done + len(data) >= size:
+                    # Only import complete lines
+                    end = data.rfind(b'\n') + 1
+                else:
+                    # Do not split a message: stop before the last one
+                    end = data.rfind(b'\nM') + 1
+                    if end == 0:
+                        chunk_size *= 2
+                        continue
+                if end == 0:
+                    break
+                rows = [(utc_timestamp(msg['time']), msg['type'],
+                         msg.get('nickname', ''), '', msg['txt'])
+                        for msg in parse_log_lines(
+                            data[:end].decode('utf-8', errors='replace')
+                            .splitlines(), jid)]
+                done += end
+                with self._db:
+                    self._insert(jid, rows)
+                    self._db.execute(
+                        'INSERT OR REPLACE INTO imported (name, size) '
+                        'VALUES (?, ?)', (name, done))
+                total += len(rows)
+                yield len(rows)
+        log.debug('Imported %s messages of %s in %s', total, jid, self.path)
+
+    def text_log_jids(self) -> List[str]:
+        """Return the JIDs which have a text log file"""
+        try:
+            paths = list(self.log_dir.iterdir())
+        except OSError:
+            return []
+        return [
+            path.name.replace('\\', '/') for path in paths
+            if path.name not in (INDEX_DIR, SEARCH_INDEX_DIR, 'roster.log')
+            and not path.name.startswith(DB_NAME) and path.is_file()
+        ]
+
+    def add_messages(self, jid: Union[str, JID], rows: Iterable[Row]) -> None:
+        """
+        Store some messages, ignoring the ones which are already stored
+        (with the same id)
+        """
+        self.add_all({str(jid): rows})
+
+    def add_all(self, messages: Mapping[str, Iterable[Row]]) -> None:
+        """
+        Store the messages of several JIDs in a single transaction
+        """
+        for jid in messages:
+            self.import_text_logs(jid)
+        with self._db:
+            for jid, rows in messages.items():
+                self._insert(jid, rows)
+
+    def _insert(self, jid: str, rows: Iterable[Row]) -> None:
+        self._db.executemany(
+            'INSERT OR IGNORE INTO messages '
+            '(jid, time, type, nick, stanza_id, txt) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            ((jid, *row) for row in rows))
+
+    def iterate_messages_reverse(
+            self,
+            jid: Union[str, JID],
+            before: Optional[datetime] = None,
+            batch_size: int = 50) -> Generator[LogDict, None, None]:
+        """Get the messages of a JID older than a date (or all of them),
+        latest first, in batches.
+        """
+        jid = str(jid)
+        self.import_text_logs(jid)
+        if before is None:
+            query = ('SELECT id, time, type, nick, txt FROM messages '
+                     'WHERE jid = ? ORDER BY time DESC, id DESC LIMIT ?')
+            args: tuple = (jid, batch_size)
+        else:
+            end = utc_timestamp(before) + (1 if before.microsecond else 0)
+            query = ('SELECT id, time, type, nick, txt FROM messages '
+                     'WHERE jid = ? AND time < ? '
+                     'ORDER BY time DESC, id DESC LIMIT ?')
+            args = (jid, end, batch_size)
+        while True:
+            rows = self._db.execute(query, args).fetchall()
+            for _, time, typ, nick, txt in rows:
+                yield make_log_dict(time, typ, nick, txt)
+            if len(rows) < batch_size:
+                return
+            last_id, last_time = rows[-1][0], rows[-1][1]
+            query = ('SELECT id, time, type, nick, txt FROM messages '
+                     'WHERE jid = ? AND (time < ? OR (time = ? AND id < ?)) '
+                     'ORDER BY time DESC, id DESC LIMIT ?')
+            args = (jid, last_time, last_time, last_id, batch_size)
+
+    def last_message(self, jid: Union[str, JID]) -> Optional[LogDict]:
+        """Get the latest message (not info) of a JID"""
+        jid = str(jid)
+        self.import_text_logs(jid)
+        row = self._db.execute(
+            'SELECT time, type, nick, txt FROM messages '
+            'WHERE jid = ? AND type = \'message\' '
+            'ORDER BY time DESC, id DESC LIMIT 1', (jid, )).fetchone()
+        if row is None:
+            return None
+        return make_log_dict(*row)
+
+    def search(self,
+               jid: Optional[Union[str, JID]],
+               words: List[str],
+               nick: Optional[str] = None,
+               after: Optional[datetime] = None,
+               before: Optional[datetime] = None,
+               limit: int = 100) -> List[Tuple[str, LogDict]]:
+        """Find the messages of a JID (or of all of them if jid is None)
+        containing all the given words, latest first, as (jid, message)
+        tuples.
+
+        The text logs of a JID are imported first, but not the ones of all
+        the JIDs (see :meth:`Logger.search_all`).
+        """
+        words = list(dict.fromkeys(WORD_RE.findall(' '.join(words).lower())))
+        if not words:
+            return []
+        if jid is None:
+            conditions = ['1']
+            args: list = []
+        else:
+            self.import_text_logs(jid)
+            conditions = ['jid = ?']
+            args = [str(jid)]
+        conditions.append('type = \'message\'')
+        if nick is not None:
+            conditions.append('nick = ? COLLATE NOCASE')
+            args.append(nick)
+        if after is not None:
+            conditions.append('time >= ?')
+            args.append(utc_timestamp(after))
+        if before is not None:
+            conditions.append('time < ?')
+            args.append(utc_timestamp(before))
+        if self.fts:
+            conditions.append(
+                'id IN (SELECT rowid FROM messages_fts '
+                'WHERE messages_fts MATCH ?)')
+            args.append(' AND '.join('"%s"' % word for word in words))
+        else:
+            for word in words:
+                conditions.append('txt LIKE ? ESCAPE \'\\\'')
+                args.append('%' + word.replace('\\', '\\\\').replace(
+                    '%', '\\%').replace('_', '\\_') + '%')
+        cursor = self._db.execute(
+            'SELECT jid, time, type, nick, txt FROM messages WHERE ' +
+            ' AND '.join(conditions) + ' ORDER BY time DESC, id DESC', args)
+        needle = set(words)
+        results: List[Tuple[str, LogDict]] = []
+        for found_jid, time, typ, found_nick, txt in cursor:
+            # LIKE also matches parts of words, and FTS5 splits the words
+            # on underscores
+            if not needle <= set(WORD_RE.findall(txt.lower())):
+                continue
+            results.append(
+                (found_jid, make_log_dict(time, typ, found_nick, txt)))
+            if len(results) >= limit:
+                break
+        return results
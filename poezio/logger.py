@@ -9,11 +9,22 @@ The logger module that handles logging of the poezio
 conversations and roster changes
 """
 
+import asyncio
 import mmap
+import os
 import re
-from typing import List, Dict, Optional, IO, Any, Union, Generator
+import sqlite3
+import sys
+from array import array
+from bisect import bisect_left
+from calendar import timegm
+from typing import (
+    List, Dict, Optional, IO, Any, Union, Callable, Generator, Sequence,
+    Tuple, TYPE_CHECKING
+)
 from datetime import datetime
 from pathlib import Path
+from time import monotonic
 
 from poezio import common
 from poezio.config import config
@@ -24,6 +35,9 @@ from poezio.types import TypedDict
 
 import logging
 
+if TYPE_CHECKING:
+    from poezio.log_sqlite import Row, SQLiteLogStore
+
 log = logging.getLogger(__name__)
 
 MESSAGE_LOG_RE = re.compile(r'^MR (\d{4})(\d{2})(\d{2})T'
@@ -32,6 +46,35 @@ MESSAGE_LOG_RE = re.compile(r'^MR (\d{4})(\d{2})(\d{2})T'
 INFO_LOG_RE = re.compile(r'^MI (\d{4})(\d{2})(\d{2})T'
                          r'(\d{2}):(\d{2}):(\d{2})Z '
                          r'(\d+) (.*)$')
+# Start of a message (MR or MI) in the raw log data, with its UTC timestamp
+LOG_ENTRY_RE = re.compile(rb'^M[RI] (\d{8})T(\d{2}):(\d{2}):(\d{2})Z ',
+                          re.MULTILINE)
+# Words of the messages, for the search index
+WORD_RE = re.compile(r'\w+')
+
+# Name of the directory (inside the log dir) containing the log indexes
+INDEX_DIR = '.index'
+# Name of the directory (inside the log dir) containing the search indexes
+SEARCH_INDEX_DIR = '.search'
+# Number of log indexes kept in memory
+INDEX_CACHE_SIZE = 32
+# Number of search indexes kept open
+SEARCH_INDEX_CACHE_SIZE = 8
+# Number of words kept in memory before being written in a search index
+SEARCH_INDEX_BATCH = 50000
+
+SEARCH_INDEX_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS words (
+    word TEXT NOT NULL,
+    entry INTEGER NOT NULL,
+    PRIMARY KEY (word, entry)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS state (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    count INTEGER NOT NULL,
+    last_offset INTEGER NOT NULL
+);
+'''
 
 
 class LogItem:
@@ -92,6 +135,397 @@ def parse_log_line(msg: str, jid: str = '') -> Optional[LogItem]:
     return None
 
 
+class LogIndex:
+    """
+    Sidecar index of a log file: the UTC timestamp and the byte offset of
+    each message, in file order, to seek directly to the messages before
+    a given date instead of scanning the file from its end.
+
+    The index is stored next to the logs as an array of (timestamp,
+    offset) pairs, and is only ever appended to. Whatever is missing at the
+    end of it (messages logged while it was not loaded, or lost on a
+    crash) is rebuilt from the log file in :meth:`update`.
+    """
+    path: Path
+    log_path: Path
+    times: array
+    offsets: array
+    size: int
+
+    def __init__(self, path: Path, log_path: Path):
+        self.path = path
+        self.log_path = log_path
+        self.times = array('q')
+        self.offsets = array('q')
+        # min_after[i] is the smallest timestamp of the entries i and later,
+        # which is sorted even if the log is not (e.g. after a MAM sync).
+        self._min_after = array('q')
+        # Number of bytes of the log file covered by the index
+        self.size = 0
+        # Number of entries already written in the index file
+        self._saved = 0
+        # Whether the entry at self.size must still be checked (see load)
+        self._unchecked = False
+        self._days: Dict[bytes, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def load(self) -> None:
+        """Read the index file, and check it still matches the log file"""
+        data = array('q')
+        try:
+            with self.path.open('rb') as fd:
+                data.frombytes(fd.read())
+        except (OSError, ValueError):
+            data = array('q')
+        if sys.byteorder == 'big':
+            data.byteswap()
+        self._clear()
+        self.times = data[0::2]
+        self.offsets = data[1::2]
+        self._saved = len(self.offsets)
+        self._min_after = array('q', self.times)
+        for i in range(len(self._min_after) - 2, -1, -1):
+            if self._min_after[i] > self._min_after[i + 1]:
+                self._min_after[i] = self._min_after[i + 1]
+        if self.offsets:
+            # The last message might have been incomplete, so parse it again
+            # (and check that it is still there) in update
+            self.size = self.offsets[-1]
+            self._pop()
+            self._unchecked = True
+
+    def save(self) -> None:
+        """Append the new entries to the index file"""
+        if self._saved == len(self.offsets):
+            return
+        mode = 'ab' if self._saved else 'wb'
+        data = array('q', [0]) * (2 * (len(self.offsets) - self._saved))
+        data[0::2] = self.times[self._saved:]
+        data[1::2] = self.offsets[self._saved:]
+        if sys.byteorder == 'big':
+            data.byteswap()
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open(mode) as fd:
+                data.tofile(fd)
+        except OSError:
+            log.error('Unable to write the log index (%s)', self.path,
+                      exc_info=True)
+            return
+        self._saved = len(self.offsets)
+
+    def update(self) -> None:
+        """Index the part of the log file that is not indexed yet"""
+        try:
+            with open(self.log_path, 'rb') as fd:
+                size = os.fstat(fd.fileno()).st_size
+                if not size:
+                    self._clear()
+                    return
+                with mmap.mmap(fd.fileno(), 0, prot=mmap.PROT_READ) as m:
+                    self._update(m, size)
+        except FileNotFoundError:
+            self._clear()
+        except (OSError, ValueError):
+            log.debug('Unable to index %s', self.log_path, exc_info=True)
+
+    def _update(self, data: Any, size: int) -> None:
+        if size < self.size or (
+                self.offsets and
+                not self._is_entry_start(data, self.offsets[-1])) or (
+                    self._unchecked and
+                    not self._is_entry_start(data, self.size)):
+            log.debug('Log file %s changed, rebuilding its index',
+                      self.log_path)
+            self._clear()
+        self._unchecked = False
+        if size == self.size:
+            return
+        self._add_entries(data, self.size, size)
+        self.size = size
+        self.save()
+
+    def append_raw(self, data: bytes) -> None:
+        """Index data that has just been appended to the log file"""
+        self._add_entries(data, 0, len(data), base=self.size)
+        self.size += len(data)
+
+    def position_before(self, time: Optional[datetime]) -> int:
+        """
+        Return the number of entries to read backwards in order to find
+        all the messages older than time (all of them if time is None)
+        """
+        if time is None:
+            return len(self.offsets)
+        utc = common.to_utc(time)
+        key = timegm(utc.timetuple()) + (1 if utc.microsecond else 0)
+        return bisect_left(self._min_after, key)
+
+    def _clear(self) -> None:
+        self.times = array('q')
+        self.offsets = array('q')
+        self._min_after = array('q')
+        self.size = 0
+        self._saved = 0
+        self._unchecked = False
+
+    def _pop(self) -> None:
+        self.times.pop()
+        self.offsets.pop()
+        self._min_after.pop()
+        self._saved = min(self._saved, len(self.offsets))
+
+    @staticmethod
+    def _is_entry_start(data: Any, offset: int) -> bool:
+        if offset == 0:
+            return data[:1] == b'M'
+        return data[offset - 1:offset + 1] == b'\nM'
+
+    def _add_entries(self, data: Any, start: int, end: int,
+                     base: int = 0) -> None:
+        times, offsets, min_after = self.times, self.offsets, self._min_after
+        days = self._days
+        for match in LOG_ENTRY_RE.finditer(data, start, end):
+            day, hour, minute, second = match.groups()
+            day_start = days.get(day)
+            if day_start is None:
+                day_start = days[day] = timegm(
+                    (int(day[:4]), int(day[4:6]), int(day[6:]), 0, 0, 0))
+            time = (day_start + int(hour) * 3600 + int(minute) * 60 +
+                    int(second))
+            times.append(time)
+            offsets.append(base + match.start())
+            min_after.append(time)
+            i = len(min_after) - 2
+            while i >= 0 and min_after[i] > time:
+                min_after[i] = time
+                i -= 1
+
+
+class SearchIndex:
+    """
+    Inverted index of the words of the messages of a log file, to find the
+    messages containing some words without reading the whole file.
+
+    The messages are designated by their position in the :class:`LogIndex`
+    of the same file. The index is a small SQLite database stored next to
+    the logs, with a (word, position) row for each word of each message,
+    sorted by word, so a search only reads the positions of the words it
+    looks for. The new rows are kept in memory until :meth:`save`.
+    """
+    path: Path
+    log_index: LogIndex
+    count: int
+
+    def __init__(self, path: Path, log_index: LogIndex):
+        self.path = path
+        self.log_index = log_index
+        # Number of entries of the log index already indexed
+        self.count = 0
+        # Offset of the last indexed entry, to notice when the log index
+        # has been rebuilt
+        self._last_offset = -1
+        self._db: Optional[sqlite3.Connection] = None
+        # (word, position) rows not written yet
+        self._pending: List[Tuple[str, int]] = []
+
+    def load(self) -> None:
+        """Open the index file, and check it still matches the log index"""
+        self.close()
+        self._clear()
+        try:
+            self._open()
+        except (OSError, sqlite3.Error):
+            log.debug('Search index for %s is invalid',
+                      self.log_index.log_path, exc_info=True)
+            self._remove()
+            try:
+                self._open()
+            except (OSError, sqlite3.Error):
+                log.error('Unable to open the search index (%s)', self.path,
+                          exc_info=True)
+                self.close()
+                return
+        assert self._db is not None
+        row = self._db.execute(
+            'SELECT count, last_offset FROM state').fetchone()
+        if row is None:
+            return
+        count, last_offset = row
+        offsets = self.log_index.offsets
+        if count > len(offsets) or (count and
+                                    offsets[count - 1] != last_offset):
+            log.debug('Search index for %s is invalid',
+                      self.log_index.log_path)
+            self._reset()
+            return
+        self.count, self._last_offset = count, last_offset
+
+    def close(self) -> None:
+        """Close the index file, forgetting what was not saved"""
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+        self._pending = []
+
+    def save(self) -> None:
+        """Write the newly indexed messages to the index file"""
+        if not self._pending or self._db is None:
+            return
+        try:
+            with self._db:
+                self._db.executemany(
+                    'INSERT OR IGNORE INTO words (word, entry) VALUES (?, ?)',
+                    self._pending)
+                self._db.execute(
+                    'INSERT OR REPLACE INTO state (id, count, last_offset) '
+                    'VALUES (0, ?, ?)', (self.count, self._last_offset))
+        except sqlite3.Error:
+            log.error('Unable to write the search index (%s)', self.path,
+                      exc_info=True)
+            return
+        self._pending = []
+
+    def update(self) -> None:
+        """Index the messages of the log index that are not indexed yet"""
+        for _ in self.update_steps():
+            pass
+
+    def update_steps(self) -> Generator[int, None, None]:
+        """
+        Same as :meth:`update`, yielding the number of indexed messages
+        each time SEARCH_INDEX_BATCH words have been written to the index
+        file, so that the indexing of a large log can be interleaved with
+        other tasks.
+        """
+        index = self.log_index
+        if self.count > len(index) or (
+                self.count and index.offsets[self.count - 1] != self._last_offset):
+            log.debug('Log index of %s changed, rebuilding its search index',
+                      index.log_path)
+            self._reset()
+        if self.count == len(index):
+            return
+        try:
+            with open(index.log_path, 'rb') as fd:
+                with mmap.mmap(fd.fileno(), 0, prot=mmap.PROT_READ) as m:
+                    yield from self._add_entries(m, 0, index.size)
+        except (OSError, ValueError):
+            log.debug('Unable to index %s', index.log_path, exc_info=True)
+            return
+        self.save()
+
+    def append_raw(self, data: bytes, base: int) -> None:
+        """Index data that has just been appended to the log file at offset
+        base, and added to the log index"""
+        offsets = self.log_index.offsets
+        if self.count < len(offsets) and offsets[self.count] >= base:
+            for _ in self._add_entries(data, base, base + len(data)):
+                pass
+
+    def search(self, words: List[str]) -> List[int]:
+        """
+        Return the positions of the messages containing all the words
+        (which must be lowercase), in file order
+        """
+        if not words:
+            return []
+        self.save()
+        if self._db is None:
+            return []
+        query = ' INTERSECT '.join(
+            ['SELECT entry FROM words WHERE word = ?'] * len(words))
+        try:
+            rows = self._db.execute(query + ' ORDER BY entry', words)
+            return [entry for entry, in rows]
+        except sqlite3.Error:
+            log.error('Unable to read the search index (%s)', self.path,
+                      exc_info=True)
+            return []
+
+    def _open(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.path))
+        self._db.executescript(SEARCH_INDEX_SCHEMA)
+
+    def _remove(self) -> None:
+        self.close()
+        try:
+            self.path.unlink()
+        except OSError:
+            pass
+
+    def _reset(self) -> None:
+        """Remove everything from the index"""
+        self._clear()
+        if self._db is None:
+            return
+        try:
+            with self._db:
+                self._db.execute('DELETE FROM words')
+                self._db.execute('DELETE FROM state')
+        except sqlite3.Error:
+            log.error('Unable to clear the search index (%s)', self.path,
+                      exc_info=True)
+
+    def _clear(self) -> None:
+        self.count = 0
+        self._last_offset = -1
+        self._pending = []
+
+    def _add_entries(self, data: Any, base: int,
+                     end: int) -> Generator[int, None, None]:
+        """Index the entries from self.count which are in data, data[0]
+        being at the offset base in the log file, and data ending at the
+        offset end, yielding self.count after each save"""
+        offsets = self.log_index.offsets
+        pending = self._pending
+        entry = self.count
+        while entry < len(offsets) and offsets[entry] < end:
+            start = offsets[entry]
+            stop = offsets[entry + 1] if entry + 1 < len(offsets) else end
+            for word in message_words(data[start - base:stop - base]):
+                pending.append((word, entry))
+            entry += 1
+            self.count = entry
+            self._last_offset = start
+            if len(pending) >= SEARCH_INDEX_BATCH:
+                self.save()
+                if self._db is None:
+                    # Closed meanwhile, nothing more can be written
+                    return
+                pending = self._pending
+                yield entry
+
+
+def utc_timestamp(time: datetime) -> int:
+    """
+    Return the UTC timestamp of a date, converted the same way as the dates
+    of the logged messages if it is a local time
+    """
+    if time.tzinfo is None:
+        utc = common.get_utc_time(time)
+    else:
+        utc = common.to_utc(time)
+    return timegm(utc.timetuple())
+
+
+def message_words(raw: bytes) -> List[str]:
+    """
+    Return the distinct words (lowercased) of the text of a raw log entry,
+    or nothing if it is not a message
+    """
+    if not raw.startswith(b'MR '):
+        return []
+    start = raw.find(b'> ')
+    if start == -1:
+        return []
+    text = raw[start + 2:].decode('utf-8', errors='replace').lower()
+    return list(dict.fromkeys(WORD_RE.findall(text)))
+
+
 class Logger:
     """
     Appends things to files. Error/information/warning logs
@@ -101,6 +535,12 @@ class Logger:
     log_dir: Path
     _fds: Dict[str, IO[str]]
     _busy_fds: Dict[str, bool]
+    _indexes: Dict[str, LogIndex]
+    _search_indexes: Dict[str, SearchIndex]
+    _pending: Dict[str, List[str]]
+    _pending_rows: Dict[str, List['Row']]
+    _flush_handle: Optional[asyncio.TimerHandle]
+    _store: Optional['SQLiteLogStore']
 
     def __init__(self):
         self.log_dir = Path()
@@ -109,25 +549,324 @@ class Logger:
         self._fds = {}
         self._busy_fds = {}
         self._buffered_fds = {}
+        # a dict of 'groupchatname': LogIndex, for the indexes in use, the
+        # least recently used first
+        self._indexes = {}
+        # a dict of 'groupchatname': SearchIndex, for the ones open, the
+        # least recently used first
+        self._search_indexes = {}
+        # a dict of 'groupchatname': list of log lines not written yet,
+        # when log_flush_interval is set
+        self._pending = {}
+        # a dict of 'jid': list of rows not stored yet, when log_backend is
+        # sqlite and log_flush_interval is set
+        self._pending_rows = {}
+        self._flush_handle = None
+        # the database of the logs, when log_backend is sqlite
+        self._store = None
+        # Counters to tune log_flush_interval and log_flush_size:
+        # characters waiting to be written, number of flushes, and duration
+        # (in seconds) of the last and slowest flushes.
+        self.queued_size = 0
+        self.flush_count = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
 
     def __del__(self):
         """Close all fds on exit"""
+        try:
+            self.flush()
+        except Exception:
+            pass
         for opened_file in self._fds.values():
             if opened_file:
                 try:
                     opened_file.close()
                 except Exception:  # Can't close? too bad
                     pass
+        for index in self._indexes.values():
+            try:
+                index.save()
+            except Exception:
+                pass
+        for search_index in self._search_indexes.values():
+            try:
+                search_index.save()
+                search_index.close()
+            except Exception:
+                pass
         try:
             self._roster_logfile.close()
         except Exception:
             pass
+        try:
+            self._store.close()
+        except Exception:
+            pass
+
+    def get_store(self) -> Optional['SQLiteLogStore']:
+        """Return the database of the logs if log_backend is sqlite, or
+        None if the logs are text files"""
+        if config.getstr('log_backend') != 'sqlite':
+            return None
+        if self._store is not None and self._store.log_dir != self.log_dir:
+            # Write what was queued for the previous log_dir first
+            self._write_rows(self._store, list(self._pending_rows))
+            self._store.close()
+            self._store = None
+        if self._store is None:
+            from poezio.log_sqlite import SQLiteLogStore
+            try:
+                self._store = SQLiteLogStore(self.log_dir)
+            except (OSError, sqlite3.Error):
+                log.error('Unable to open the log database in %s',
+                          self.log_dir, exc_info=True)
+                return None
+        return self._store
+
+    async def import_text_logs(self, jid: Union[str, JID]) -> None:
+        """Import the text logs of a jid in the database if log_backend is
+        sqlite, letting the other tasks run while it is done"""
+        store = self.get_store()
+        if store is None:
+            return
+        try:
+            await store.import_text_logs_async(jid)
+        except sqlite3.Error:
+            log.error('Unable to import the logs of %s in %s', jid,
+                      store.path, exc_info=True)
 
     def get_file_path(self, jid: Union[str, JID]) -> Path:
         """Return the log path for a specific jid"""
         jidstr = str(jid).replace('/', '\\')
         return self.log_dir / jidstr
 
+    def get_index(self, jid: Union[str, JID]) -> LogIndex:
+        """Return the up-to-date index of the log file of a jid.
+        Only the INDEX_CACHE_SIZE last used ones are kept in memory."""
+        jidstr = str(jid).replace('/', '\\')
+        self.flush(jidstr)
+        index = self._indexes.pop(jidstr, None)
+        if index is None:
+            while len(self._indexes) >= INDEX_CACHE_SIZE:
+                self._close_index(next(iter(self._indexes)))
+            index = LogIndex(
+                self.log_dir / INDEX_DIR / jidstr,
+                self.get_file_path(jidstr),
+            )
+            index.load()
+        self._indexes[jidstr] = index
+        index.update()
+        return index
+
+    def _close_index(self, jidstr: str) -> None:
+        self._close_search_index(jidstr)
+        index = self._indexes.pop(jidstr, None)
+        if index is not None:
+            index.save()
+
+    def get_search_index(self, jid: Union[str, JID],
+                         update: bool = True) -> SearchIndex:
+        """Return the up-to-date search index of the log file of a jid
+        (only loaded, if update is False).
+        Only the SEARCH_INDEX_CACHE_SIZE last used ones are kept open."""
+        jidstr = str(jid).replace('/', '\\')
+        index = self.get_index(jidstr)
+        search_index = self._search_indexes.pop(jidstr, None)
+        if search_index is not None and search_index.log_index is not index:
+            search_index.save()
+            search_index.close()
+            search_index = None
+        if search_index is None:
+            while len(self._search_indexes) >= SEARCH_INDEX_CACHE_SIZE:
+                self._close_search_index(next(iter(self._search_indexes)))
+            search_index = SearchIndex(
+                self.log_dir / SEARCH_INDEX_DIR / jidstr,
+                index,
+            )
+            search_index.load()
+        self._search_indexes[jidstr] = search_index
+        if update:
+            search_index.update()
+        return search_index
+
+    def _close_search_index(self, jidstr: str) -> None:
+        search_index = self._search_indexes.pop(jidstr, None)
+        if search_index is not None:
+            search_index.save()
+            search_index.close()
+
+    def search(self,
+               jid: Union[str, JID],
+               words: List[str],
+               nick: Optional[str] = None,
+               after: Optional[datetime] = None,
+               before: Optional[datetime] = None,
+               limit: int = 100) -> List[LogDict]:
+        """Find the messages of a log file containing all the given words,
+        latest first.
+
+        :param jid: JID of the log file
+        :param words: words to look for (case insensitive)
+        :param nick: only return the messages of this nick
+        :param after: only return the messages sent after that date
+        :param before: only return the messages sent before that date
+        :param limit: maximum number of messages to return
+        """
+        store = self.get_store()
+        if store is not None:
+            self.flush(jid)
+            return [
+                msg for _, msg in
+                store.search(jid, words, nick, after, before, limit)
+            ]
+        words = list(dict.fromkeys(WORD_RE.findall(' '.join(words).lower())))
+        if not words:
+            return []
+        search_index = self.get_search_index(jid)
+        index = search_index.log_index
+        entries = search_index.search(words)
+        low = high = None
+        if after is not None:
+            low = utc_timestamp(after)
+        if before is not None:
+            high = utc_timestamp(before)
+        if nick is not None:
+            nick = nick.lower()
+        results: List[LogDict] = []
+        try:
+            with open(index.log_path, 'rb') as fd:
+                for entry in reversed(entries):
+                    time = index.times[entry]
+                    if (low is not None and time < low) or (
+                            high is not None and time >= high):
+                        continue
+                    offset = index.offsets[entry]
+                    if entry + 1 < len(index):
+                        end_offset = index.offsets[entry + 1]
+                    else:
+                        end_offset = index.size
+                    fd.seek(offset)
+                    data = fd.read(end_offset - offset)
+                    for msg in parse_log_lines(
+                            data.decode(errors='replace').splitlines(),
+                            str(jid)):
+                        if nick is not None and \
+                                msg.get('nickname', '').lower() != nick:
+                            continue
+                        results.append(msg)
+                    if len(results) >= limit:
+                        break
+        except (OSError, ValueError):
+            log.debug('Unable to read the log file for %s', jid,
+                      exc_info=True)
+        return results[:limit]
+
+    async def search_all(
+            self,
+            words: List[str],
+            nick: Optional[str] = None,
+            after: Optional[datetime] = None,
+            before: Optional[datetime] = None,
+            limit: int = 100,
+            progress: Optional[Callable[[int, int], None]] = None
+    ) -> List[Tuple[str, LogDict]]:
+        """Find the messages containing all the given words in all the log
+        files, latest first, as (jid, message) tuples.
+
+        The missing parts of the search indexes are built (or the text logs
+        imported in the database) one log file, and one batch of words (or
+        chunk of the file) at a time, letting the other tasks run.
+
+        See :meth:`search` for the parameters.
+
+        :param progress: called with the number of log files searched and
+                         the total number of log files, after each one
+        """
+        store = self.get_store()
+        if store is not None:
+            self.flush()
+            jids = store.text_log_jids()
+            for done, jid in enumerate(jids, 1):
+                await self.import_text_logs(jid)
+                if progress is not None:
+                    progress(done, len(jids))
+            return store.search(None, words, nick, after, before, limit)
+        results: List[Tuple[str, LogDict]] = []
+        try:
+            paths = [
+                path for path in self.log_dir.iterdir()
+                if not path.name.startswith('.') and
+                path.name != 'roster.log' and path.is_file()
+            ]
+        except OSError:
+            return results
+        in_use = set(self._indexes)
+        for done, path in enumerate(paths, 1):
+            jid = path.name.replace('\\', '/')
+            for _ in self.get_search_index(jid, update=False).update_steps():
+                await asyncio.sleep(0)
+            results.extend(
+                (jid, msg)
+                for msg in self.search(jid, words, nick, after, before, limit))
+            if path.name not in in_use:
+                # Do not keep the indexes of all the logs in memory
+                self._close_index(path.name)
+            if progress is not None:
+                progress(done, len(paths))
+            await asyncio.sleep(0)
+        results.sort(key=lambda result: result[1]['time'], reverse=True)
+        return results[:limit]
+
+    def iterate_messages_reverse(
+            self,
+            jid: Union[str, JID],
+            before: Optional[datetime] = None,
+            batch_size: int = 50) -> Generator[LogDict, None, None]:
+        """Get the messages of a log file older than a date (or all of
+        them), latest first, using its index to seek to the right place.
+        The messages are read and parsed in batches.
+
+        :param jid: JID of the log file
+        :param before: only return messages older than that (the file may
+                       not be sorted, so this is only a hint)
+        :param batch_size: number of messages to parse at once
+        """
+        store = self.get_store()
+        if store is not None:
+            self.flush(jid)
+            yield from store.iterate_messages_reverse(jid, before, batch_size)
+            return
+        index = self.get_index(jid)
+        end = index.position_before(before)
+        try:
+            with open(index.log_path, 'rb') as fd:
+                while end > 0:
+                    start = max(end - batch_size, 0)
+                    offset = index.offsets[start]
+                    if end < len(index):
+                        end_offset = index.offsets[end]
+                    else:
+                        end_offset = index.size
+                    fd.seek(offset)
+                    data = fd.read(end_offset - offset)
+                    lines = parse_log_lines(
+                        data.decode(errors='replace').splitlines(), str(jid)
+                    )
+                    yield from reversed(lines)
+                    end = start
+        except (OSError, ValueError):
+            log.debug('Unable to read the log file for %s', jid,
+                      exc_info=True)
+
+    def last_message(self, jid: Union[str, JID]) -> Optional[LogDict]:
+        """Get the latest message (not info) logged for a jid"""
+        store = self.get_store()
+        if store is not None:
+            self.flush(jid)
+            return store.last_message(jid)
+        return last_message_in_archive(self.get_file_path(jid))
+
     def fd_busy(self, jid: Union[str, JID]) -> None:
         """Signal to the logger that this logfile is busy elsewhere.
         And that the messages should be queued to be logged later.
@@ -135,6 +874,7 @@ class Logger:
         :param jid: file name
         """
         jidstr = str(jid).replace('/', '\\')
+        self.flush(jidstr)
         self._busy_fds[jidstr] = True
         if jidstr not in self._buffered_fds:
             self._buffered_fds[jidstr] = []
@@ -148,6 +888,7 @@ class Logger:
         jidstr = str(jid).replace('/', '\\')
         if jidstr in self._busy_fds:
             del self._busy_fds[jidstr]
+        self.flush(jidstr)
         if jidstr in self._buffered_fds:
             msgs = ''.join(self._buffered_fds.pop(jidstr))
             if jidstr in self._fds:
@@ -158,13 +899,16 @@ class Logger:
     def close(self, jid: str) -> None:
         """Close the log file for a JID."""
         jidstr = str(jid).replace('/', '\\')
+        self.flush(jidstr)
         if jidstr in self._fds:
             self._fds[jidstr].close()
             log.debug('Log file for %s closed.', jid)
             del self._fds[jidstr]
+        self._close_index(jidstr)
 
     def reload_all(self) -> None:
         """Close and reload all the file handles (on SIGHUP)"""
+        self.flush()
         not_closed = set()
         for key, opened_file in self._fds.items():
             if opened_file:
@@ -178,6 +922,10 @@ class Logger:
             except Exception:
                 not_closed.add('roster')
         log.debug('All log file handles closed')
+        for index in self._indexes.values():
+            index.save()
+        for search_index in self._search_indexes.values():
+            search_index.save()
         if not_closed:
             log.error('Unable to close log files for: %s', not_closed)
         for room in self._fds:
@@ -240,48 +988,196 @@ class Logger:
             if msg.me:
                 txt = f'/me {txt}'
             typ = 'MR'
+        if self.get_store() is not None:
+            return self._store_messages(jid, [
+                (utc_timestamp(date), 'message' if typ == 'MR' else 'info',
+                 nick, msg.identifier, clean_text(txt))
+            ])
         logged_msg = build_log_message(nick, txt, date=date, prefix=typ)
         if not logged_msg:
             return True
         return self.log_raw(jid, logged_msg)
 
+    def log_history(self, jid: Union[str, JID],
+                    messages: Sequence[BaseMessage]) -> bool:
+        """
+        Log messages fetched from the history of the server, which may be
+        older than the ones already logged.
+
+        :param jid: JID of the entity for which to log the messages
+        :param messages: Messages to log (only the Message ones are)
+        :returns: True if no error was encountered
+        """
+        history = [msg for msg in messages if isinstance(msg, Message)]
+        if self.get_store() is not None:
+            return self._store_messages(jid, [
+                (utc_timestamp(msg.time), 'message', msg.nickname or '',
+                 msg.identifier, clean_text(msg.txt)) for msg in history
+            ])
+        logs = ''.join(
+            build_log_message(msg.nickname or '', msg.txt, msg.time,
+                              prefix='MR')
+            for msg in history)
+        return self.log_raw(jid, logs, force=True)
+
+    def _store_messages(self, jid: Union[str, JID], rows: List['Row']) -> bool:
+        """Store rows in the database, or queue them for the next flush if
+        log_flush_interval is set"""
+        jidstr = str(jid)
+        self._pending_rows.setdefault(jidstr, []).extend(rows)
+        self.queued_size += sum(len(row[4]) for row in rows)
+        interval = config.getfloat('log_flush_interval')
+        if interval > 0 and self._schedule_flush(interval):
+            if self.queued_size >= config.getint('log_flush_size'):
+                return self.flush()
+            return True
+        store = self.get_store()
+        if store is None:
+            return False
+        return self._write_rows(store, [jidstr])
+
+    def _write_rows(self, store: 'SQLiteLogStore', jids: List[str]) -> bool:
+        """Store the queued rows of some JIDs in a single transaction"""
+        messages = {}
+        for jid in jids:
+            rows = self._pending_rows.pop(jid, None)
+            if rows:
+                messages[jid] = rows
+                self.queued_size -= sum(len(row[4]) for row in rows)
+        if not messages:
+            return True
+        try:
+            store.add_all(messages)
+        except sqlite3.Error:
+            log.error('Unable to write in the log database (%s)',
+                      store.path, exc_info=True)
+            return False
+        return True
+
     def log_raw(self, jid: Union[str, JID], logged_msg: str, force: bool = False) -> bool:
         """Log a raw string.
 
+        If log_flush_interval is set, the string is queued and written
+        later by :meth:`flush`.
+
         :param jid: filename
         :param logged_msg: string to log
         :param force: Bypass the buffered fd check
         :returns: True if no error was encountered
         """
         jidstr = str(jid).replace('/', '\\')
-        if jidstr in self._fds.keys():
-            fd = self._fds[jidstr]
-        else:
+        if jidstr not in self._fds.keys():
             option_fd = self._check_and_create_log_dir(jid)
             if option_fd is None:
                 return True
-            fd = option_fd
-        filename = self.get_file_path(jid)
+        if not force and self._busy_fds.get(jidstr):
+            self._buffered_fds[jidstr].append(logged_msg)
+            return True
+        interval = config.getfloat('log_flush_interval')
+        if interval > 0 and self._schedule_flush(interval):
+            self._pending.setdefault(jidstr, []).append(logged_msg)
+            self.queued_size += len(logged_msg)
+            if self.queued_size >= config.getint('log_flush_size'):
+                return self.flush()
+            return True
+        return self._write(jidstr, logged_msg)
+
+    def flush(self, jid: Union[None, str, JID] = None) -> bool:
+        """Write the queued log lines (or database rows) of a JID (or all of
+        them) to disk.
+
+        :param jid: JID to flush, or None for all of them
+        :returns: True if no error was encountered
+        """
+        if jid is None:
+            if self._flush_handle is not None:
+                self._flush_handle.cancel()
+                self._flush_handle = None
+            jids = list(self._pending)
+            row_jids = list(self._pending_rows)
+        else:
+            jids = [str(jid).replace('/', '\\')]
+            row_jids = [str(jid)]
+        start = monotonic()
+        success = True
+        flushed = False
+        if any(self._pending_rows.get(jidstr) for jidstr in row_jids):
+            store = self.get_store()
+            if store is not None:
+                success = self._write_rows(store, row_jids)
+                flushed = True
+            else:
+                success = False
+        for jidstr in jids:
+            lines = self._pending.pop(jidstr, None)
+            if not lines:
+                continue
+            data = ''.join(lines)
+            self.queued_size -= len(data)
+            success = self._write(jidstr, data, sync=True) and success
+            flushed = True
+        if flushed:
+            latency = monotonic() - start
+            self.flush_count += 1
+            self.last_flush_latency = latency
+            self.max_flush_latency = max(self.max_flush_latency, latency)
+        return success
+
+    def _schedule_flush(self, interval: float) -> bool:
+        """Schedule a flush of all the queued log lines, if needed.
+
+        :returns: False if there is no event loop to do it later
+        """
+        if self._flush_handle is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                return False
+            self._flush_handle = loop.call_later(interval, self._timed_flush)
+        return True
+
+    def _timed_flush(self) -> None:
+        self._flush_handle = None
+        self.flush()
+
+    def _write(self, jidstr: str, data: str, sync: bool = False) -> bool:
+        """Write data to a log file, and flush it.
+
+        :param jidstr: filename
+        :param data: string to write
+        :param sync: also fsync the file if log_fsync is set
+        :returns: True if no error was encountered
+        """
+        filename = self.get_file_path(jidstr)
         try:
-            if not force and self._busy_fds.get(jidstr):
-                self._buffered_fds[jidstr].append(logged_msg)
-                return True
-            fd.write(logged_msg)
+            fd = self._fds.get(jidstr)
+            if fd is None:
+                fd = self._fds[jidstr] = filename.open('a', encoding='utf-8')
+            fd.write(data)
+            index = self._indexes.get(jidstr)
+            if index is not None:
+                raw = data.encode('utf-8')
+                base = index.size
+                index.append_raw(raw)
+                search_index = self._search_indexes.get(jidstr)
+                if search_index is not None:
+                    search_index.append_raw(raw, base)
         except OSError:
             log.error(
                 'Unable to write in the log file (%s)',
                 filename,
                 exc_info=True)
             return False
-        else:
-            try:
-                fd.flush()  # TODO do something better here?
-            except OSError:
-                log.error(
-                    'Unable to flush the log file (%s)',
-                    filename,
-                    exc_info=True)
-                return False
+        try:
+            fd.flush()
+            if sync and config.getbool('log_fsync'):
+                os.fsync(fd.fileno())
+        except OSError:
+            log.error(
+                'Unable to flush the log file (%s)',
+                filename,
+                exc_info=True)
+            return False
         return True
 
     def log_roster_change(self, jid: str, message: str) -> bool:
@@ -11,6 +11,7 @@ from hashlib import md5
 from typing import (
     Any,
     AsyncIterable,
+    AsyncIterator,
     Dict,
     List,
     Optional,
@@ -34,7 +35,6 @@ class DiscoInfoException(Exception): pass
 class MAMQueryException(Exception): pass
 class NoMAMSupportException(Exception): pass
 
-
 def make_line(
         tab: tabs.ChatTab,
         text: str,
@@ -82,6 +82,20 @@ def make_line(
         user=None,
     )
 
+async def check_mam_support(core, jid: JID) -> None:
+    """Check that an entity supports MAM (see DiscoCache).
+
+    :raises DiscoInfoException: if the entity could not be queried
+    :raises NoMAMSupportException: if it does not support MAM
+    """
+    try:
+        supported = await core.disco.has_feature(jid, 'urn:xmpp:mam:2')
+    except (IqError, IqTimeout):
+        raise DiscoInfoException()
+    if not supported:
+        raise NoMAMSupportException()
+
+
 async def get_mam_iterator(
         core,
         groupchat: bool,
@@ -93,13 +107,8 @@ async def get_mam_iterator(
         before: Optional[str] = None,
     ) -> AsyncIterable[SMessage]:
     """Get an async iterator for this mam query"""
-    try:
-        query_jid = remote_jid if groupchat else JID(core.xmpp.boundjid.bare)
-        iq = await core.xmpp.plugin['xep_0030'].get_info(jid=query_jid)
-    except (IqError, IqTimeout):
-        raise DiscoInfoException()
-    if 'urn:xmpp:mam:2' not in iq['disco_info'].get_features():
-        raise NoMAMSupportException()
+    query_jid = remote_jid if groupchat else JID(core.xmpp.boundjid.bare)
+    await check_mam_support(core, query_jid)
 
     args: Dict[str, Any] = {
         'iterator': True,
@@ -144,19 +153,25 @@ def _ignore_private_message(stanza: SMessage, filter_jid: Optional[JID]) -> bool
     return False
 
 
-async def retrieve_messages(tab: tabs.ChatTab,
-                            results: AsyncIterable[SMessage],
-                            amount: int = 100) -> List[BaseMessage]:
-    """Run the MAM query and put messages in order"""
+async def retrieve_pages(tab: tabs.ChatTab,
+                         results: AsyncIterable[SMessage],
+                         amount: int = 100
+                         ) -> AsyncIterator[List[BaseMessage]]:
+    """Run the MAM query and yield the messages one page at a time, as they
+    arrive: the latest page first, each page in chronological order.
+
+    The next page is only requested when the previous one has been
+    consumed, and no more pages are requested once amount messages have
+    been received.
+    """
     msg_count = 0
-    msgs = []
-    to_add = []
     tab_is_private = isinstance(tab, tabs.PrivateTab)
     filter_jid = None
     if tab_is_private:
         filter_jid = tab.jid
     try:
         async for rsm in results:
+            msgs: List[BaseMessage] = []
             for msg in rsm['mam']['results']:
                 stanza = msg['mam_result']['forwarded']['stanza']
                 if stanza.xml.find('{%s}%s' % ('jabber:client', 'body')) is not None:
@@ -164,24 +179,52 @@ async def retrieve_messages(tab: tabs.ChatTab,
                         continue
                     args = _parse_message(msg)
                     msgs.append(make_line(tab, **args))
-            for msg in reversed(msgs):
-                to_add.append(msg)
-                msg_count += 1
-                if msg_count == amount:
-                    to_add.reverse()
-                    return to_add
-            msgs = []
-        to_add.reverse()
-        return to_add
+            msgs = msgs[max(len(msgs) - (amount - msg_count), 0):]
+            msg_count += len(msgs)
+            if msgs:
+                yield msgs
+            if msg_count >= amount:
+                return
     except (IqError, IqTimeout) as exc:
         log.debug('Unable to complete MAM query: %s', exc, exc_info=True)
         raise MAMQueryException('Query interrupted')
 
 
+async def retrieve_messages(tab: tabs.ChatTab,
+                            results: AsyncIterable[SMessage],
+                            amount: int = 100) -> List[BaseMessage]:
+    """Run the MAM query and put messages in order"""
+    pages = [page async for page in retrieve_pages(tab, results, amount)]
+    return [msg for page in reversed(pages) for msg in page]
+
+
 async def fetch_history(tab: tabs.ChatTab,
                         start: Optional[datetime] = None,
                         end: Optional[datetime] = None,
                         amount: int = 100) -> List[BaseMessage]:
+    """Fetch the messages of a tab from MAM, in chronological order.
+
+    See fetch_history_pages.
+    """
+    pages = [
+        page async for page in fetch_history_pages(tab, start, end, amount)
+    ]
+    return [msg for page in reversed(pages) for msg in page]
+
+
+async def fetch_history_pages(tab: tabs.ChatTab,
+                              start: Optional[datetime] = None,
+                              end: Optional[datetime] = None,
+                              amount: int = 100
+                              ) -> AsyncIterator[List[BaseMessage]]:
+    """Fetch the messages of a tab from MAM, and yield them one page at a
+    time, the latest page first (see retrieve_pages).
+
+    :param start: only fetch the messages after that date
+    :param end: only fetch the messages before that date (by default,
+                the first message of the tab)
+    :param amount: maximum number of messages to fetch
+    """
     remote_jid = tab.jid
     if not end:
         for msg in tab._text_buffer.messages:
@@ -208,4 +251,5 @@ async def fetch_history(tab: tabs.ChatTab,
         start=start_str,
         reverse=True,
     )
-    return await retrieve_messages(tab, mam_iterator, amount)
+    async for page in retrieve_pages(tab, mam_iterator, amount):
+        yield page
@@ -23,9 +23,9 @@ from typing import (
 from slixmpp import (
     JID,
     ClientXMPP,
-    Iq,
     Presence,
 )
+from slixmpp.exceptions import IqError, IqTimeout
 
 import logging
 log = logging.getLogger(__name__)
@@ -91,8 +91,12 @@ def join_groupchat(
         passelement.text = passwd
         x.append(passelement)
 
-    def on_disco(iq: Iq) -> None:
-        if ('urn:xmpp:mam:2' in iq['disco_info'].get_features()
+    async def join() -> None:
+        try:
+            features = await core.disco.get_features(jid)
+        except (IqError, IqTimeout):
+            features = frozenset()
+        if ('urn:xmpp:mam:2' in features
                 or (tab and tab._text_buffer.last_message)):
             history = ET.Element('{http://jabber.org/protocol/muc}history')
             history.attrib['seconds'] = str(0)
@@ -109,9 +113,7 @@ def join_groupchat(
         xmpp.plugin['xep_0045'].rooms[jid] = {}
         xmpp.plugin['xep_0045'].our_nicks[jid] = to.resource
 
-    asyncio.create_task(
-        xmpp.plugin['xep_0030'].get_info(jid=jid, callback=on_disco)
-    )
+    asyncio.create_task(join())
 
 
 def leave_groupchat(
@@ -7,11 +7,10 @@ plugin env.
 
 import logging
 import os
-from typing import Dict, Set
+from typing import Any, Dict, Iterable, Optional, Set
 from importlib import import_module, machinery
 from pathlib import Path
 from os import path
-import pkg_resources
 
 from poezio import tabs, xdg
 from poezio.core.structs import Command, Completion
@@ -20,6 +19,33 @@ from poezio.config import config
 
 log = logging.getLogger(__name__)
 
+ENTRY_POINTS_GROUP = 'poezio_plugins'
+
+
+def scan_entry_points() -> Dict[str, Any]:
+    """
+    Find the plugins installed as packages, through their entry points.
+
+    :returns: a dict of plugin name -> entry point
+    """
+    entries: Iterable[Any]
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:  # Python < 3.8
+        import pkg_resources
+        entries = pkg_resources.iter_entry_points(ENTRY_POINTS_GROUP)
+    else:
+        all_entries = entry_points()
+        if hasattr(all_entries, 'select'):
+            entries = all_entries.select(group=ENTRY_POINTS_GROUP)
+        else:  # Python < 3.10
+            entries = all_entries.get(ENTRY_POINTS_GROUP, [])
+    result: Dict[str, Any] = {}
+    for entry in entries:
+        # The same distribution can be found several times in sys.path
+        result.setdefault(entry.name, entry)
+    return result
+
 
 class PluginManager:
     """
@@ -50,6 +76,8 @@ class PluginManager:
         self.roster_elements = {}
 
         self.finder = machinery.PathFinder()
+        # plugin name -> entry point, scanned once
+        self._entry_points: Optional[Dict[str, Any]] = None
 
         self.initial_set_plugins_dir()
         self.initial_set_plugins_conf_dir()
@@ -96,16 +124,14 @@ class PluginManager:
                     module = import_module('poezio_plugins.%s' % name)
                 except ModuleNotFoundError:
                     pass
-            for entry in pkg_resources.iter_entry_points('poezio_plugins'):
-                if entry.name == name:
-                    log.debug('Found candidate entry for plugin %s: %r', name, entry)
-                    try:
-                        module = entry.load()
-                    except Exception as exn:
-                        log.debug('Failed to import plugin: %s\n%r', name,
-                                  exn, exc_info=True)
-                    finally:
-                        break
+            entry = self.entry_points.get(name) if not module else None
+            if entry is not None:
+                log.debug('Found candidate entry for plugin %s: %r', name, entry)
+                try:
+                    module = entry.load()
+                except Exception as exn:
+                    log.debug('Failed to import plugin: %s\n%r', name,
+                              exn, exc_info=True)
             if not module:
                 self.core.information('Could not find plugin: %s' % name,
                                       'Error')
@@ -346,7 +372,7 @@ class PluginManager:
     def completion_load(self, the_input):
         """
         completion function that completes the name of the plugins, from
-        all .py files in plugins_dir
+        all .py files in plugins_dir and the installed plugin packages
         """
         names = set()
         for path_ in self.load_path:
@@ -355,11 +381,12 @@ class PluginManager:
                 names |= add
             except OSError:
                 pass
-        plugins_files = [
+        plugins_names = {
             name[:-3] for name in names if name.endswith('.py')
             and name != '__init__.py' and not name.startswith('.')
-        ]
-        plugins_files.sort()
+        }
+        plugins_names.update(self.entry_points)
+        plugins_files = sorted(plugins_names)
         position = the_input.get_argument_position(quoted=False)
         return Completion(
             the_input.new_completion,
@@ -439,12 +466,26 @@ class PluginManager:
                 return False
         return True
 
+    @property
+    def entry_points(self) -> Dict[str, Any]:
+        """
+        The plugins installed as packages, found the first time they are
+        needed (scanning all the installed distributions is slow).
+        """
+        if self._entry_points is None:
+            self._entry_points = scan_entry_points()
+            log.debug('Plugins found in the entry points: %s',
+                      ', '.join(sorted(self._entry_points)))
+        return self._entry_points
+
     def fill_load_path(self):
         """
         Append the global packages and the source directory if available
         """
 
         self.load_path = []
+        # The installed packages may have changed as well
+        self._entry_points = None
 
         default_plugin_path = path.join(
             path.dirname(path.dirname(__file__)), 'plugins')
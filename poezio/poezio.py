@@ -81,9 +81,13 @@ def main():
     sys.stdout.flush()
     from poezio.args import run_cmdline_args
     options, firstrun = run_cmdline_args()
-    from poezio import config
-    config.create_global_config(options.filename)
-    config.setup_logging(options.debug)
+    from poezio.startup_profile import profiler
+    if options.profile_startup:
+        profiler.enable(options.profile_startup)
+    with profiler.phase('config'):
+        from poezio import config
+        config.create_global_config(options.filename)
+        config.setup_logging(options.debug)
 
     import logging
     logging.raiseExceptions = False
@@ -104,14 +108,17 @@ def main():
     from poezio import roster
     roster.roster.reset()
 
-    from poezio.core.core import Core
+    with profiler.phase('imports'):
+        from poezio.core.core import Core
 
     signal.signal(signal.SIGINT, signal.SIG_IGN)  # ignore ctrl-c
-    cocore = Core(options.custom_version, firstrun)
+    with profiler.phase('Core.__init__'):
+        cocore = Core(options.custom_version, firstrun)
     signal.signal(signal.SIGUSR1, cocore.sigusr_handler)  # reload the config
     signal.signal(signal.SIGHUP, cocore.exit_from_signal)
     signal.signal(signal.SIGTERM, cocore.exit_from_signal)
-    cocore.start()
+    with profiler.phase('Core.start'):
+        cocore.start()
 
     from slixmpp.exceptions import IqError, IqTimeout
 
@@ -124,6 +131,7 @@ def main():
 
     loop.add_reader(sys.stdin, cocore.on_input_readable)
     loop.add_signal_handler(signal.SIGWINCH, cocore.sigwinch_handler)
+    profiler.start_phase('connection')
     cocore.xmpp.start()
     loop.run_forever()
     # We reach this point only when loop.stop() is called
@@ -1,7 +1,9 @@
 
-from typing import List, Tuple
+from array import array
+from typing import List, Sequence, Tuple, Union
 
 def xwcwidth(c: str) -> int: ...
 def cut_text(string: str, width: int) -> List[Tuple[int, int]]: ...
+def cut_texts(texts: Sequence[str], widths: Union[int, Sequence[int]]) -> Tuple[array[int], array[int]]: ...
 def wcswidth(string: str) -> int: ...
 def cut_by_columns(string: str, limit: int) -> str: ...
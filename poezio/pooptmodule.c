@@ -44,36 +44,17 @@ static int xwcwidth(wchar_t c)
  ***/
 
 /**
-   cut_text: takes a string and returns a tuple of int.
-
-   Each two int tuple is a line, represented by the ending position it
-   (where it should be cut).  Not that this position is calculed using the
-   position of the python string characters, not just the individual bytes.
-
-   For example,
-   poopt_cut_text("vivent les réfrigérateurs", 6);
-   will return [(0, 6), (7, 10), (11, 17), (17, 22), (22, 24)], meaning that
-   the lines are
-   "vivent", "les", "réfrig", "érateu" and "rs"
+   cut_buffer: the line cutting algorithm used by cut_text and cut_texts.
 
+   It takes an UTF-8 buffer and calls add_line(data, start, end) for each
+   line found, start and end being positions in the python string.
+   Returns -1 (with a python exception set) on error, 0 otherwise.
 */
-PyDoc_STRVAR(poopt_cut_text_doc, "cut_text(text, width)\n\n\nReturn a list of two-tuple, the first int is the starting position of the line and the second is its end.");
+typedef int (*add_line_func)(void* data, unsigned int start, unsigned int end);
 
-static PyObject* poopt_cut_text(PyObject* self, PyObject* args)
+static int cut_buffer(const char* buffer, const Py_ssize_t buffer_len,
+                      const size_t width, add_line_func add_line, void* data)
 {
-    /* The list of tuples that we return */
-    PyObject* retlist = PyList_New(0);
-    /* The temporary name for the tuples */
-    PyObject* tmp;
-
-    /* Get the python arguments */
-    const size_t width;
-    const char* buffer;
-    const Py_ssize_t buffer_len;
-
-    if (PyArg_ParseTuple(args, "s#k", &buffer, &buffer_len, &width) == 0)
-        return NULL;
-
     /* Pointer to the end of the string */
     const char* const end = buffer + buffer_len;
 
@@ -133,13 +114,13 @@ static PyObject* poopt_cut_text(PyObject* self, PyObject* args)
         {
             PyErr_SetString(PyExc_UnicodeError,
                             "mbrtowc returned -1: Invalid multibyte sequence.");
-            return NULL;
+            return -1;
         }
         else if ((size_t)-2 == consumed)
         {
             PyErr_SetString(PyExc_UnicodeError,
                             "mbrtowc returned -2: Could not parse a complete multibyte character.");
-            return NULL;
+            return -1;
         }
 
         buffer += consumed;
@@ -148,13 +129,8 @@ static PyObject* poopt_cut_text(PyObject* self, PyObject* args)
         if (wc == (wchar_t)'\n')
         {
             spos++;
-            tmp = Py_BuildValue("II", start_pos, spos);
-            if (PyList_Append(retlist, tmp) == -1)
-            {
-                Py_XDECREF(tmp);
-                return NULL;
-            }
-            Py_XDECREF(tmp);
+            if (add_line(data, start_pos, spos) == -1)
+                return -1;
             /* And then initiate a new line */
             start_pos = spos;
             last_space = -1;
@@ -171,13 +147,8 @@ static PyObject* poopt_cut_text(PyObject* self, PyObject* args)
         {   /* If possible, cut on a space */
             if (last_space != -1)
             {
-                tmp = Py_BuildValue("II", start_pos, last_space);
-                if (PyList_Append(retlist, tmp) == -1)
-                {
-                    Py_XDECREF(tmp);
-                    return NULL;
-                }
-                Py_XDECREF(tmp);
+                if (add_line(data, start_pos, last_space) == -1)
+                    return -1;
                 start_pos = last_space + 1;
                 last_space = -1;
                 columns -= (cols_until_space + 1);
@@ -185,13 +156,8 @@ static PyObject* poopt_cut_text(PyObject* self, PyObject* args)
             else
             {
                 /* Otherwise, cut in the middle of a word */
-                tmp = Py_BuildValue("II", start_pos, spos);
-                if (PyList_Append(retlist, tmp) == -1)
-                {
-                    Py_XDECREF(tmp);
-                    return NULL;
-                }
-                Py_XDECREF(tmp);
+                if (add_line(data, start_pos, spos) == -1)
+                    return -1;
                 start_pos = spos;
                 columns = 0;
             }
@@ -211,16 +177,219 @@ static PyObject* poopt_cut_text(PyObject* self, PyObject* args)
         spos++;
     }
     /* We are at the end of the string, append the last line, not finished */
-    tmp = Py_BuildValue("II", start_pos, spos);
-    if (PyList_Append(retlist, tmp) == -1)
+    return add_line(data, start_pos, spos);
+}
+
+/**
+   cut_text: takes a string and returns a tuple of int.
+
+   Each two int tuple is a line, represented by the ending position it
+   (where it should be cut).  Not that this position is calculed using the
+   position of the python string characters, not just the individual bytes.
+
+   For example,
+   poopt_cut_text("vivent les réfrigérateurs", 6);
+   will return [(0, 6), (7, 10), (11, 17), (17, 22), (22, 24)], meaning that
+   the lines are
+   "vivent", "les", "réfrig", "érateu" and "rs"
+
+*/
+PyDoc_STRVAR(poopt_cut_text_doc, "cut_text(text, width)\n\n\nReturn a list of two-tuple, the first int is the starting position of the line and the second is its end.");
+
+static int append_tuple(void* data, unsigned int start, unsigned int end)
+{
+    PyObject* tmp = Py_BuildValue("II", start, end);
+    if (tmp == NULL)
+        return -1;
+    const int res = PyList_Append((PyObject*)data, tmp);
+    Py_DECREF(tmp);
+    return res;
+}
+
+static PyObject* poopt_cut_text(PyObject* self, PyObject* args)
+{
+    /* Get the python arguments */
+    const size_t width;
+    const char* buffer;
+    const Py_ssize_t buffer_len;
+
+    if (PyArg_ParseTuple(args, "s#k", &buffer, &buffer_len, &width) == 0)
+        return NULL;
+
+    /* The list of tuples that we return */
+    PyObject* retlist = PyList_New(0);
+    if (retlist == NULL)
+        return NULL;
+    if (cut_buffer(buffer, buffer_len, width, append_tuple, retlist) == -1)
     {
-        Py_XDECREF(tmp);
+        Py_DECREF(retlist);
         return NULL;
     }
-    Py_XDECREF(tmp);
     return retlist;
 }
 
+/**
+   cut_texts: the same as cut_text, for many strings at once.
+
+   Instead of a list of tuples for each string, it returns two arrays of
+   unsigned ints: the start and end positions of all the lines, one pair
+   after the other, and the number of lines of each string.
+
+   For example,
+   poopt_cut_texts(["abcd", "e"], 2);
+   will return (array('I', [0, 2, 2, 4, 0, 1]), array('I', [2, 1])).
+*/
+PyDoc_STRVAR(poopt_cut_texts_doc, "cut_texts(texts, widths)\n\n\nCut a sequence of strings, either with a width for each of them or the same for all. Return a tuple of two array('I'): the start and end positions of all the lines (one pair after the other), and the number of lines of each string.");
+
+/* A growable array of unsigned ints */
+typedef struct
+{
+    unsigned int* items;
+    Py_ssize_t len;
+    Py_ssize_t size;
+} uint_vector;
+
+static int uint_vector_append(uint_vector* vec, unsigned int value)
+{
+    if (vec->len == vec->size)
+    {
+        const Py_ssize_t size = vec->size ? vec->size * 2 : 256;
+        unsigned int* items = PyMem_Realloc(vec->items,
+                                            size * sizeof(unsigned int));
+        if (items == NULL)
+        {
+            PyErr_NoMemory();
+            return -1;
+        }
+        vec->items = items;
+        vec->size = size;
+    }
+    vec->items[vec->len++] = value;
+    return 0;
+}
+
+static int append_pair(void* data, unsigned int start, unsigned int end)
+{
+    if (uint_vector_append((uint_vector*)data, start) == -1)
+        return -1;
+    return uint_vector_append((uint_vector*)data, end);
+}
+
+/* Create an array('I') holding the values of the vector */
+static PyObject* uint_vector_to_array(PyObject* array_type, const uint_vector* vec)
+{
+    PyObject* array = PyObject_CallFunction(array_type, "s", "I");
+    if (array == NULL)
+        return NULL;
+    if (vec->len == 0)
+        return array;
+    PyObject* res = PyObject_CallMethod(array, "frombytes", "y#",
+                                        (const char*)vec->items,
+                                        (Py_ssize_t)(vec->len * sizeof(unsigned int)));
+    if (res == NULL)
+    {
+        Py_DECREF(array);
+        return NULL;
+    }
+    Py_DECREF(res);
+    return array;
+}
+
+static PyObject* poopt_cut_texts(PyObject* self, PyObject* args)
+{
+    PyObject* texts;
+    PyObject* widths;
+    if (PyArg_ParseTuple(args, "OO", &texts, &widths) == 0)
+        return NULL;
+
+    PyObject* texts_seq = PySequence_Fast(texts, "texts must be a sequence");
+    if (texts_seq == NULL)
+        return NULL;
+    const Py_ssize_t nb_texts = PySequence_Fast_GET_SIZE(texts_seq);
+
+    /* Either one width for all the texts, or a sequence of them */
+    PyObject* widths_seq = NULL;
+    size_t width = 0;
+    if (PyLong_Check(widths))
+    {
+        /* Same conversion as the "k" format of cut_text */
+        width = PyLong_AsUnsignedLongMask(widths);
+    }
+    else
+    {
+        widths_seq = PySequence_Fast(widths, "widths must be an int or a sequence");
+        if (widths_seq == NULL)
+        {
+            Py_DECREF(texts_seq);
+            return NULL;
+        }
+        if (PySequence_Fast_GET_SIZE(widths_seq) != nb_texts)
+        {
+            PyErr_SetString(PyExc_ValueError,
+                            "texts and widths must have the same length");
+            Py_DECREF(texts_seq);
+            Py_DECREF(widths_seq);
+            return NULL;
+        }
+    }
+
+    uint_vector positions = {NULL, 0, 0};
+    uint_vector counts = {NULL, 0, 0};
+    PyObject* array_module = NULL;
+    PyObject* array_type = NULL;
+    PyObject* positions_array = NULL;
+    PyObject* counts_array = NULL;
+    PyObject* result = NULL;
+
+    for (Py_ssize_t i = 0; i < nb_texts; i++)
+    {
+        PyObject* text = PySequence_Fast_GET_ITEM(texts_seq, i);
+        Py_ssize_t buffer_len;
+        /* The UTF-8 representation is cached in the str object */
+        const char* buffer = PyUnicode_AsUTF8AndSize(text, &buffer_len);
+        if (buffer == NULL)
+            goto end;
+        if (widths_seq != NULL)
+        {
+            width = PyLong_AsUnsignedLongMask(
+                PySequence_Fast_GET_ITEM(widths_seq, i));
+            if (PyErr_Occurred())
+                goto end;
+        }
+        const Py_ssize_t before = positions.len;
+        if (cut_buffer(buffer, buffer_len, width, append_pair, &positions) == -1)
+            goto end;
+        if (uint_vector_append(&counts,
+                               (unsigned int)((positions.len - before) / 2)) == -1)
+            goto end;
+    }
+
+    array_module = PyImport_ImportModule("array");
+    if (array_module == NULL)
+        goto end;
+    array_type = PyObject_GetAttrString(array_module, "array");
+    if (array_type == NULL)
+        goto end;
+    positions_array = uint_vector_to_array(array_type, &positions);
+    if (positions_array == NULL)
+        goto end;
+    counts_array = uint_vector_to_array(array_type, &counts);
+    if (counts_array == NULL)
+        goto end;
+    result = PyTuple_Pack(2, positions_array, counts_array);
+
+ end:
+    Py_XDECREF(positions_array);
+    Py_XDECREF(counts_array);
+    Py_XDECREF(array_type);
+    Py_XDECREF(array_module);
+    PyMem_Free(positions.items);
+    PyMem_Free(counts.items);
+    Py_DECREF(texts_seq);
+    Py_XDECREF(widths_seq);
+    return result;
+}
+
 /**
    wcswidth: An emulation of the POSIX wcswidth(3) function using wcwidth
    and mbrtowc.
@@ -417,6 +586,7 @@ static PyTypeObject Null_Type = {
 /* List of functions defined in the module */
 static PyMethodDef poopt_methods[] = {
   {"cut_text", poopt_cut_text, METH_VARARGS, poopt_cut_text_doc},
+  {"cut_texts", poopt_cut_texts, METH_VARARGS, poopt_cut_texts_doc},
   {"wcswidth", poopt_wcswidth, METH_VARARGS, poopt_wcswidth_doc},
   {"cut_by_columns", poopt_cut_by_columns, METH_VARARGS, poopt_cut_by_columns_doc},
   {}           /* sentinel */
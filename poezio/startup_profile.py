@@ -0,0 +1,204 @@
+"""
+Measure the time spent starting poezio, with --profile-startup.
+
+The import time of each module is measured by a finder placed in front of
+sys.meta_path, which times the execution of the modules (both including
+and excluding the modules they import). The main steps of the startup
+(Core.__init__, the theme, the plugins, the roster…) are measured as
+phases. The report is written once the session is started and the phases
+in progress are done.
+"""
+
+import logging
+import sys
+from contextlib import contextmanager
+from copy import copy
+from importlib.abc import MetaPathFinder
+from pathlib import Path
+from time import perf_counter
+from typing import (
+    Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+)
+
+log = logging.getLogger(__name__)
+
+__all__ = [
+    'StartupProfiler',
+    'profiler',
+]
+
+
+class _ImportTimer(MetaPathFinder):
+    """Time the execution of the modules imported, by name"""
+
+    def __init__(self, profiler: 'StartupProfiler') -> None:
+        self.profiler = profiler
+        # time spent in the modules imported by the ones being executed
+        self._children: List[float] = []
+
+    def find_spec(self, fullname: str,
+                  path: Optional[Sequence[Union[bytes, str]]],
+                  target=None):
+        for finder in sys.meta_path:
+            if finder is self:
+                continue
+            find_spec = getattr(finder, 'find_spec', None)
+            if find_spec is None:
+                continue
+            spec = find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        loader = spec.loader
+        # Builtin and frozen modules are loaded by the importer classes
+        # themselves, they are not worth measuring.
+        if loader is None or isinstance(loader, type) or \
+                not hasattr(loader, 'exec_module'):
+            return spec
+        # Some loaders are shared by several modules (zipimport)
+        try:
+            loader = copy(loader)
+        except Exception:
+            return spec
+        loader.exec_module = self._timed(fullname, loader.exec_module)
+        spec.loader = loader
+        return spec
+
+    def _timed(self, name: str, exec_module: Callable) -> Callable:
+        def timed_exec_module(module) -> None:
+            self._children.append(0.0)
+            start = perf_counter()
+            try:
+                exec_module(module)
+            finally:
+                total = perf_counter() - start
+                children = self._children.pop()
+                if self._children:
+                    self._children[-1] += total
+                self.profiler.imports[name] = (total, total - children)
+
+        return timed_exec_module
+
+
+class StartupProfiler:
+    """
+    Keep the import times of the modules and the durations of the startup
+    phases. Does nothing until enabled.
+    """
+    enabled: bool
+    # module name -> (time including the imported modules, own time)
+    imports: Dict[str, Tuple[float, float]]
+    # (name, duration) of the finished phases, in order
+    phases: List[Tuple[str, float]]
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.imports = {}
+        self.phases = []
+        self.path: Optional[Path] = None
+        self._start = perf_counter()
+        self._pending: Dict[str, float] = {}
+        self._timer: Optional[_ImportTimer] = None
+        self._finished = False
+        self._callback: Optional[Callable[[Path], None]] = None
+
+    def enable(self, path: Path) -> None:
+        """Start measuring, the report will be written to path"""
+        self.enabled = True
+        self.path = path
+        self._start = perf_counter()
+        self._timer = _ImportTimer(self)
+        sys.meta_path.insert(0, self._timer)
+
+    def disable(self) -> None:
+        """Stop measuring the imports"""
+        if self._timer is not None and self._timer in sys.meta_path:
+            sys.meta_path.remove(self._timer)
+        self._timer = None
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Measure a step of the startup"""
+        if not self.enabled:
+            yield
+            return
+        self.start_phase(name)
+        try:
+            yield
+        finally:
+            self.end_phase(name)
+
+    def start_phase(self, name: str) -> None:
+        """Start measuring a step which ends later (see end_phase)"""
+        if self.enabled:
+            self._pending[name] = perf_counter()
+
+    def end_phase(self, name: str) -> None:
+        """A step of the startup is done"""
+        start = self._pending.pop(name, None)
+        if start is None:
+            return
+        self.phases.append((name, perf_counter() - start))
+        if self._finished and not self._pending:
+            self.write_report()
+
+    def finish(self, callback: Optional[Callable[[Path], None]] = None
+               ) -> None:
+        """
+        The startup is done: write the report once the phases in progress
+        are finished, and call the callback with its path.
+        """
+        if not self.enabled or self._finished:
+            return
+        self._finished = True
+        self._callback = callback
+        if not self._pending:
+            self.write_report()
+
+    def report(self, limit: int = 40) -> str:
+        """The phases, and the slowest imports"""
+        lines = [
+            'Startup profile: %.1fms since the start of the profiling' %
+            ((perf_counter() - self._start) * 1000),
+            '',
+            'Phases:',
+        ]
+        for name, duration in self.phases:
+            lines.append('  %-40s %9.1fms' % (name, duration * 1000))
+        for name in self._pending:
+            lines.append('  %-40s  (not done)' % name)
+        imports = sorted(self.imports.items(),
+                         key=lambda item: item[1][0], reverse=True)
+        lines += [
+            '',
+            'Imports: %d modules, %.1fms in total' % (
+                len(imports),
+                sum(own for _, own in self.imports.values()) * 1000),
+            '  %-40s %11s %11s' % ('module', 'cumulative', 'self'),
+        ]
+        for name, (total, own) in imports[:limit]:
+            lines.append('  %-40s %9.1fms %9.1fms' %
+                         (name, total * 1000, own * 1000))
+        return '\n'.join(lines) + '\n'
+
+    def write_report(self) -> None:
+        """Write the report, and stop measuring"""
+        if not self.enabled or self.path is None:
+            return
+        self.disable()
+        self.enabled = False
+        report = self.report()
+        log.info('%s', report)
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.path.write_text(report)
+        except OSError:
+            log.error('Unable to write the startup profile to %s',
+                      self.path, exc_info=True)
+            return
+        if self._callback is not None:
+            self._callback(self.path)
+
+
+profiler = StartupProfiler()
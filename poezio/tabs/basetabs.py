@@ -19,7 +19,6 @@ import logging
 import string
 import asyncio
 from copy import copy
-from math import ceil, log10
 from datetime import datetime
 from xml.etree import ElementTree as ET
 from xml.sax import SAXParseException
@@ -36,7 +35,6 @@ from typing import (
 )
 
 from poezio import (
-    poopt,
     timed_events,
     xhtml,
     windows
@@ -49,7 +47,6 @@ from poezio.log_loader import MAMFiller, LogLoader
 from poezio.text_buffer import TextBuffer
 from poezio.theming import get_theme, dump_tuple
 from poezio.user import User
-from poezio.ui.funcs import truncate_nick
 from poezio.timed_events import DelayedEvent
 from poezio.ui.types import (
     BaseMessage,
@@ -514,6 +511,7 @@ class ChatTab(Tab):
     timed_event_paused: Optional[DelayedEvent]
     timed_event_not_paused: Optional[DelayedEvent]
     mam_filler: Optional[MAMFiller]
+    goto_future: Optional[asyncio.Future]
     e2e_encryption: Optional[str] = None
 
     def __init__(self, core, jid: Union[JID, str]):
@@ -531,6 +529,8 @@ class ChatTab(Tab):
         self._text_buffer = TextBuffer()
         self._text_buffer.add_window(self.text_win)
         self.mam_filler = None
+        # The loading of the history requested by /scrollback goto
+        self.goto_future = None
         self.chatstate = None  # can be "active", "composing", "paused", "gone", "inactive"
         # We keep a reference of the event that will set our chatstate to "paused", so that
         # we can delete it or change it if we need to
@@ -836,6 +836,13 @@ class ChatTab(Tab):
     def get_conversation_messages(self):
         return self._text_buffer.messages
 
+    def on_close(self) -> None:
+        super().on_close()
+        self._text_buffer.clear_line_cache()
+        if self.goto_future is not None:
+            self.goto_future.cancel()
+            self.goto_future = None
+
     def check_scrolled(self) -> None:
         if self.text_win.pos != 0:
             self.state = 'scrolled'
@@ -844,46 +851,38 @@ class ChatTab(Tab):
     async def command_say(self, line: str, attention: bool = False, correct: bool = False):
         pass
 
-    def goto_build_lines(self, new_date):
-        text_buffer = self._text_buffer
-        built_lines = []
-        message_count = 0
-        timestamp = config.getbool('show_timestamps')
-        nick_size = config.getint('max_nick_length')
-        theme = get_theme()
-        for message in text_buffer.messages:
-            # Build lines of a message
-            txt = message.txt
-            nick = truncate_nick(message.nickname, nick_size)
-            offset = 0
-            theme = get_theme()
-            if message.ack:
-                if message.ack > 0:
-                    offset += poopt.wcswidth(theme.CHAR_ACK_RECEIVED) + 1
-                else:
-                    offset += poopt.wcswidth(theme.CHAR_NACK) + 1
-            if nick:
-                offset += poopt.wcswidth(nick) + 2
-            if message.revisions > 0:
-                offset += ceil(log10(message.revisions + 1))
-            if message.me:
-                offset += 1
-            if timestamp:
-                if message.history:
-                    offset += 1 + theme.LONG_TIME_FORMAT_LENGTH
-            lines = poopt.cut_text(txt, self.text_win.width - offset - 1)
-            for line in lines:
-                built_lines.append(line)
-            # Find the message with timestamp less than or equal to the queried
-            # timestamp and goto that location in the tab.
-            if message.time <= new_date:
-                message_count += 1
-                if len(self.text_win.built_lines) - self.text_win.height >= len(built_lines):
-                    self.text_win.pos = len(self.text_win.built_lines) - self.text_win.height - len(built_lines) + 1
-                else:
-                    self.text_win.pos = 0
-        if message_count == 0:
-            self.text_win.scroll_up(len(self.text_win.built_lines))
+    def goto_build_lines(self, new_date: datetime,
+                         load_history: bool = True) -> None:
+        """
+        Scroll to the last message sent at or before new_date. If the
+        buffer only contains more recent messages, scroll to the top and
+        load the older ones from the logs (or MAM).
+        """
+        text_win = self.text_win
+        index = self._text_buffer.find_message_index(new_date)
+        line = None
+        if index >= 0:
+            message = self._text_buffer.messages[index]
+            line = text_win.message_line(message)
+            if line is None:
+                # Above the lines built so far
+                text_win.build_older_lines()
+                line = text_win.message_line(message)
+        if line is None:
+            text_win.build_older_lines()
+            text_win.scroll_up(len(text_win.built_lines))
+            if index < 0 and load_history and not self.query_status:
+                if self.goto_future is not None:
+                    self.goto_future.cancel()
+                self.goto_future = asyncio.create_task(
+                    LogLoader(
+                        logger, self, config.getbool('use_log')
+                    ).goto_requested(new_date)
+                )
+        else:
+            text_win.pos = max(
+                len(text_win.built_lines) - text_win.height - line, 0)
+            text_win.scroll_up(0)
         self.core.refresh_window()
 
     @command_args_parser.quoted(0, 2)
@@ -903,6 +902,7 @@ class ChatTab(Tab):
                 self.core.refresh_window()
                 return
             elif args[0] == 'home':
+                self.text_win.build_older_lines()
                 self.text_win.scroll_up(len(self.text_win.built_lines))
                 self.core.refresh_window()
                 return
@@ -954,6 +954,7 @@ class ChatTab(Tab):
                     return
             # Check for the argument of type goto <linenum>
             elif args[1].isdigit():
+                self.text_win.build_older_lines()
                 if len(self.text_win.built_lines) - self.text_win.height >= int(args[1]):
                     self.text_win.pos = len(self.text_win.built_lines) - self.text_win.height - int(args[1])
                     self.core.refresh_window()
@@ -439,7 +439,7 @@ class ConversationTab(OneToOneTab):
             Tab.tab_win_height(), 0)
 
     def on_close(self):
-        Tab.on_close(self)
+        super().on_close()
         if config.get_by_tabname('send_chat_states', self.general_jid):
             self.send_chat_state('gone')
 
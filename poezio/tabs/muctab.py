@@ -10,7 +10,6 @@ user list, and updates private tabs when necessary.
 from __future__ import annotations
 
 import asyncio
-import bisect
 import curses
 import logging
 import os
@@ -20,6 +19,8 @@ import functools
 from copy import copy
 from dataclasses import dataclass
 from datetime import datetime
+from itertools import groupby
+from operator import itemgetter
 from typing import (
     cast,
     Any,
@@ -53,7 +54,7 @@ from poezio.log_loader import LogLoader, MAMFiller
 from poezio.roster import roster
 from poezio.text_buffer import CorrectionError
 from poezio.theming import get_theme, dump_tuple
-from poezio.user import User
+from poezio.user import User, UserList
 from poezio.core.structs import Completion, Status
 from poezio.ui.types import (
     BaseMessage,
@@ -72,7 +73,6 @@ log = logging.getLogger(__name__)
 
 NS_MUC_USER = 'http://jabber.org/protocol/muc#user'
 
-COMPARE_USERS_LAST_TALKED = lambda x: x.last_talked
 
 
 @dataclass
@@ -109,8 +109,13 @@ class MucTab(ChatTab):
         self.password = password
         # buffered presences
         self.presence_buffer: List[Presence] = []
+        # presences received while joined, waiting to be applied in one pass
+        self.presence_queue: List[Presence] = []
+        self._presence_handle: Optional[asyncio.Handle] = None
+        # join/part messages being aggregated during a batch
+        self._join_part_batch: Optional[List[Tuple[str, str, bool]]] = None
         # userlist
-        self.users: List[User] = []
+        self.users = UserList()
         # private conversations
         self.privates: List[Tab] = []
         self.topic = ''
@@ -248,7 +253,8 @@ class MucTab(ChatTab):
             self.core.disable_private_tabs(self.jid.bare, reason=msg)
         else:
             self.presence_buffer = []
-            self.users = []
+            self.drop_presence_queue()
+            self.users.clear()
             muc.leave_groupchat(self.core.xmpp, self.jid, self.own_nick,
                                 message)
 
@@ -272,11 +278,10 @@ class MucTab(ChatTab):
             return
         jid = None
         nick = None
-        for user in self.users:
-            if user.nick == nick_or_jid:
-                jid = user.jid
-                nick = user.nick
-                break
+        user = self.users.get(str(nick_or_jid))
+        if user is not None:
+            jid = user.jid
+            nick = user.nick
         if jid is None:
             try:
                 jid = JID(nick_or_jid)
@@ -542,12 +547,9 @@ class MucTab(ChatTab):
     def _refresh_after_message(self, old_state: str) -> None:
         """Refresh the appropriate UI after a message is received"""
         if self is self.core.tabs.current_tab:
-            self.refresh()
+            self.core.refresh_window()
         elif self.state != old_state:
             self.core.refresh_tab_win()
-            current = self.core.tabs.current_tab
-            current.refresh_input()
-        self.core.doupdate()
 
     async def _handle_correction_message(self, message: MessageData) -> bool:
         """Process a correction message.
@@ -627,18 +629,121 @@ class MucTab(ChatTab):
                 self.presence_buffer.append(presence)
                 return
         else:
-            try:
-                self.handle_presence_joined(presence, status_codes)
-            except PresenceError:
-                self.core.room_error(presence, presence['from'].bare)
+            self.presence_queue.append(presence)
+            if not self._schedule_presence_queue():
+                self.process_presence_queue()
+            return
+        self.refresh_after_presence()
+
+    def refresh_after_presence(self) -> None:
+        """
+        Refresh the windows affected by presences, if we are the current tab
+        """
         if self.core.tabs.current_tab is self:
-            self.text_win.refresh()
-            self.user_win.refresh_if_changed(self.users)
-            self.info_header.refresh(
-                self, self.text_win, user=self.own_user,
-                information=MucTab.additional_information)
-            self.input.refresh()
-            self.core.doupdate()
+            self.core.refresh_window()
+
+    def _schedule_presence_queue(self) -> bool:
+        """
+        Schedule the processing of the queued presences, if needed.
+
+        :returns: False if there is no event loop to do it later
+        """
+        if self._presence_handle is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                return False
+            delay = config.getfloat('muc_presence_batch_delay')
+            if delay > 0:
+                self._presence_handle = loop.call_later(
+                    delay, self.process_presence_queue)
+            else:
+                self._presence_handle = loop.call_soon(
+                    self.process_presence_queue)
+        return True
+
+    def drop_presence_queue(self) -> None:
+        """
+        Forget the presences received while joined that were not applied
+        yet, because we left the room.
+        """
+        self.presence_queue = []
+        if self._presence_handle is not None:
+            self._presence_handle.cancel()
+            self._presence_handle = None
+
+    def process_presence_queue(self) -> None:
+        """
+        Apply all the presences received while joined since the last batch,
+        then refresh the screen once.
+        """
+        if self._presence_handle is not None:
+            self._presence_handle.cancel()
+            self._presence_handle = None
+        queue, self.presence_queue = self.presence_queue, []
+        if not queue:
+            return
+        if len(queue) > 1 and config.get_by_tabname('group_join_part',
+                                                    self.general_jid):
+            self._join_part_batch = []
+        try:
+            for presence in queue:
+                if not self.joined:
+                    # We left the room in the middle of the batch
+                    self.handle_presence(presence)
+                    continue
+                try:
+                    self.handle_presence_joined(
+                        presence, presence['muc']['status_codes'])
+                except PresenceError:
+                    self.core.room_error(presence, presence['from'].bare)
+        finally:
+            self.flush_join_part_messages()
+        self.refresh_after_presence()
+
+    def add_join_part_message(self, msg: str, nick: str, joined: bool) -> None:
+        """
+        Add a join or part message, or keep it for the summary line if
+        the presences are being processed in a batch.
+        """
+        if self._join_part_batch is None:
+            self.add_message(PersistentInfoMessage(msg))
+        else:
+            self._join_part_batch.append((msg, nick, joined))
+
+    def flush_join_part_messages(self) -> None:
+        """
+        Add the join/part messages kept during a batch in the order they
+        were received, with a single summary line for each run of several
+        joins or several parts.
+        """
+        batch, self._join_part_batch = self._join_part_batch, None
+        if not batch:
+            return
+        theme = get_theme()
+        info_col = dump_tuple(theme.COLOR_INFORMATION_TEXT)
+        for joined, run in groupby(batch, key=itemgetter(2)):
+            entries = list(run)
+            if len(entries) == 1:
+                self.add_message(PersistentInfoMessage(entries[0][0]))
+            else:
+                if joined:
+                    spec_col = dump_tuple(theme.COLOR_JOIN_CHAR)
+                    spec, action = theme.CHAR_JOIN, 'joined'
+                else:
+                    spec_col = dump_tuple(theme.COLOR_QUIT_CHAR)
+                    spec, action = theme.CHAR_QUIT, 'left'
+                nicks = ', '.join(nick for _, nick, _ in entries)
+                msg = ('\x19%(color_spec)s}%(spec)s \x19%(info_col)s}'
+                       '%(nb)s users %(action)s the room: %(nicks)s') % {
+                           'color_spec': spec_col,
+                           'spec': spec,
+                           'info_col': info_col,
+                           'nb': len(entries),
+                           'action': action,
+                           'nicks': nicks,
+                       }
+                self.add_message(PersistentInfoMessage(msg))
 
     def process_presence_buffer(self, last_presence: Presence, own: bool) -> None:
         """
@@ -651,7 +756,6 @@ class MucTab(ChatTab):
                 self.core.room_error(stanza, stanza['from'].bare)
         self.presence_buffer = []
         self.handle_presence_unjoined(last_presence, own)
-        self.users.sort()
         # Enable the self ping event, to regularly check if we
         # are still in the room.
         if own:
@@ -675,7 +779,7 @@ class MucTab(ChatTab):
         user_color = self.search_for_color(from_nick)
         new_user = User(from_nick, affiliation, show, status, role, jid,
                         user_color)
-        self.users.append(new_user)
+        self.users.add(new_user)
         self.core.events.trigger('muc_join', presence, self)
         if own:
             status_codes = presence['muc']['status_codes']
@@ -838,7 +942,7 @@ class MucTab(ChatTab):
         """
         user = User(from_nick, affiliation, show, status, role, jid,
                     color)
-        bisect.insort_left(self.users, user)
+        self.users.add(user)
         hide_exit_join = config.get_by_tabname('hide_exit_join',
                                                self.general_jid)
         if hide_exit_join != 0:
@@ -872,7 +976,7 @@ class MucTab(ChatTab):
                            'jid_color': dump_tuple(theme.COLOR_MUC_JID),
                            'color_spec': spec_col,
                        }
-            self.add_message(PersistentInfoMessage(msg))
+            self.add_join_part_message(msg, from_nick, joined=True)
         self.core.on_user_rejoined_private_conversation(self.jid.bare, from_nick)
 
     def on_user_nick_change(self, presence: Presence, user: User, from_nick: str) -> None:
@@ -889,8 +993,7 @@ class MucTab(ChatTab):
             user.change_nick(new_nick)
             color = config.getstr(new_nick, section='muc_colors') or None
             user.change_color(color)
-        self.users.remove(user)
-        bisect.insort_left(self.users, user)
+        self.users.update(user)
 
         if config.get_by_tabname('display_user_color_in_join_part',
                                  self.general_jid):
@@ -1135,7 +1238,7 @@ class MucTab(ChatTab):
                              }
             if status:
                 leave_msg += ' (\x19o%s\x19%s})' % (status, info_col)
-            self.add_message(PersistentInfoMessage(leave_msg))
+            self.add_join_part_message(leave_msg, from_nick, joined=False)
         self.core.on_user_left_private_conversation(from_room.bare, user, status)
 
     def on_user_change_status(self, user: User, from_nick: str, from_room: str, affiliation: str,
@@ -1198,10 +1301,9 @@ class MucTab(ChatTab):
         self.core.on_user_changed_status_in_private(
             JID('%s/%s' % (from_room, from_nick)), Status(show, status)
         )
-        self.users.remove(user)
         # finally, effectively change the user status
         user.update(affiliation, show, status, role)
-        bisect.insort_left(self.users, user)
+        self.users.update(user)
 
     def disconnect(self) -> None:
         """
@@ -1209,7 +1311,8 @@ class MucTab(ChatTab):
         we can know if we can join it, send messages to it, etc
         """
         self.presence_buffer = []
-        self.users = []
+        self.drop_presence_queue()
+        self.users.clear()
         if self is not self.core.tabs.current_tab:
             self.state = 'disconnected'
         self.joined = False
@@ -1225,10 +1328,7 @@ class MucTab(ChatTab):
         """
         Gets the user associated with the given nick, or None if not found
         """
-        for user in self.users:
-            if user.nick == nick:
-                return user
-        return None
+        return self.users.get(nick)
 
     def add_message(self, msg: BaseMessage) -> None:
         """Add a message to the text buffer and set various tab status"""
@@ -1240,6 +1340,7 @@ class MucTab(ChatTab):
             return
         if msg.user:
             msg.user.set_last_talked(msg.time)
+            self.users.touch(msg.user)
         if config.get_by_tabname('notify_messages', self.jid) and self.state != 'current':
             if msg.nickname != self.own_nick and not msg.history:
                 self.state = 'message'
@@ -1589,7 +1690,7 @@ class MucTab(ChatTab):
             return
         nick = args[0]
         try:
-            if nick in {user.nick for user in self.users}:
+            if self.users.get(nick) is not None:
                 jid = copy(self.jid)
                 jid.resource = nick
             else:
@@ -1677,9 +1778,9 @@ class MucTab(ChatTab):
             return
         nick = args[0]
         r = None
-        for user in self.users:
-            if user.nick == nick:
-                r = self.core.open_private_window(self.jid.bare, user.nick)
+        user = self.users.get(nick)
+        if user is not None:
+            r = self.core.open_private_window(self.jid.bare, user.nick)
         if r and len(args) == 2:
             msg = args[1]
             asyncio.ensure_future(
@@ -1980,7 +2081,7 @@ class MucTab(ChatTab):
         # If we are not completing a command or a command argument,
         # complete a nick
         word_list = []
-        for user in sorted(self.users, key=COMPARE_USERS_LAST_TALKED, reverse=True):
+        for user in self.users.by_last_talked():
             if user.nick != self.own_nick:
                 word_list.append(user.nick)
         after = config.getstr('after_completion') + ' '
@@ -2005,7 +2106,7 @@ class MucTab(ChatTab):
     def completion_version(self, the_input: windows.MessageInput) -> Completion:
         """Completion for /version"""
         userlist = []
-        for user in sorted(self.users, key=COMPARE_USERS_LAST_TALKED, reverse=True):
+        for user in self.users.by_last_talked():
             if user.nick != self.own_nick:
                 userlist.append(user.nick)
         comp = []
@@ -2020,7 +2121,7 @@ class MucTab(ChatTab):
     def completion_info(self, the_input: windows.MessageInput) -> Completion:
         """Completion for /info"""
         userlist = []
-        for user in sorted(self.users, key=COMPARE_USERS_LAST_TALKED, reverse=True):
+        for user in self.users.by_last_talked():
             userlist.append(user.nick)
         return Completion(the_input.auto_completion, userlist, quotify=False)
 
@@ -2044,7 +2145,7 @@ class MucTab(ChatTab):
         """Completion for /color"""
         n = the_input.get_argument_position(quoted=True)
         if n == 1:
-            userlist = [user.nick for user in self.users]
+            userlist = self.users.nicks()
             if self.own_nick in userlist:
                 userlist.remove(self.own_nick)
             return Completion(
@@ -2060,7 +2161,7 @@ class MucTab(ChatTab):
 
     def completion_ignore(self, the_input: windows.MessageInput) -> Completion:
         """Completion for /ignore"""
-        userlist = [user.nick for user in self.users]
+        userlist = self.users.nicks()
         if self.own_nick in userlist:
             userlist.remove(self.own_nick)
         userlist.sort()
@@ -2070,7 +2171,7 @@ class MucTab(ChatTab):
         """Completion for /role"""
         n = the_input.get_argument_position(quoted=True)
         if n == 1:
-            userlist = [user.nick for user in self.users]
+            userlist = self.users.nicks()
             if self.own_nick in userlist:
                 userlist.remove(self.own_nick)
             return Completion(
@@ -2085,7 +2186,7 @@ class MucTab(ChatTab):
         """Completion for /affiliation"""
         n = the_input.get_argument_position(quoted=True)
         if n == 1:
-            userlist = [user.nick for user in self.users]
+            userlist = self.users.nicks()
             if self.own_nick in userlist:
                 userlist.remove(self.own_nick)
             jidlist = [user.jid.bare for user in self.users]
@@ -2127,7 +2228,7 @@ class MucTab(ChatTab):
         """Nick completion, but with quotes"""
         if the_input.get_argument_position(quoted=True) == 1:
             word_list = []
-            for user in sorted(self.users, key=COMPARE_USERS_LAST_TALKED, reverse=True):
+            for user in self.users.by_last_talked():
                 if user.nick != self.own_nick:
                     word_list.append(user.nick)
 
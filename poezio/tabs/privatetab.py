@@ -126,9 +126,8 @@ class PrivateTab(OneToOneTab):
             return
 
         # If we are not completing a command or a command's argument, complete a nick
-        compare_users = lambda x: x.last_talked
-        word_list = [user.nick for user in sorted(self.parent_muc.users, key=compare_users, reverse=True)\
-                         if user.nick != self.own_nick]
+        word_list = [user.nick for user in self.parent_muc.users.by_last_talked()
+                     if user.nick != self.own_nick]
         after = config.getstr('after_completion') + ' '
         input_pos = self.input.pos
         if ' ' not in self.input.get_text()[:input_pos] or (self.input.last_completion and\
@@ -10,6 +10,11 @@ log = logging.getLogger(__name__)
 
 import curses
 import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Optional, Tuple, Union
+
 from slixmpp import JID, InvalidJID
 from slixmpp.xmlstream import matcher, StanzaBase
 from slixmpp.xmlstream.tostring import tostring
@@ -20,8 +25,34 @@ from poezio.tabs import Tab
 
 from poezio import text_buffer
 from poezio import windows
-from poezio.xhtml import clean_text
+from poezio.config import config
 from poezio.decorators import command_args_parser, refresh_wrapper
+from poezio.ui.types import StanzaInfo, XMLLog
+from poezio.xml_capture import XMLCapture, get_capture_path
+
+# Number of parsed stanzas kept for the XPath and XML mask filters
+PARSED_CACHE_SIZE = 4096
+
+# A message and its parsed stanza (None if it is not valid XML)
+ParsedEntry = Tuple[XMLLog, Optional[ElementBase]]
+
+
+def _normalize_jid(jid: str) -> str:
+    try:
+        return JID(jid).full
+    except InvalidJID:
+        return jid
+
+
+def stanza_info(xml: ET.Element) -> StanzaInfo:
+    """Extract the attributes used by the filters from a stanza element"""
+    return StanzaInfo(
+        from_=_normalize_jid(xml.get('from', '')),
+        to=_normalize_jid(xml.get('to', '')),
+        id=xml.get('id', ''),
+        type=xml.get('type', ''),
+        tag=xml.tag,
+    )
 
 
 class MatchJID:
@@ -42,6 +73,21 @@ class MatchJID:
             return to_ == self.jid
         return self.jid in (from_, to_)
 
+    def match_info(self, info: StanzaInfo) -> bool:
+        """Same as match, using the attributes extracted from the stanza"""
+        from_ = info.from_
+        to_ = info.to
+        if self.jid.full == self.jid.bare:
+            from_ = from_.split('/', 1)[0]
+            to_ = to_.split('/', 1)[0]
+
+        jid = self.jid.full
+        if self.dest == 'from':
+            return from_ == jid
+        elif self.dest == 'to':
+            return to_ == jid
+        return jid in (from_, to_)
+
     def __repr__(self):
         return '%s%s%s' % (self.dest, ': ' if self.dest else '', self.jid)
 
@@ -53,6 +99,13 @@ MATCHERS_MAPPINGS = {
     matcher.MatchXPath: ('XPath', lambda obj: obj._criteria)
 }
 
+# The filters which only need the attributes of the stanza (StanzaInfo),
+# and can be tested without parsing it again.
+INDEXED_MATCHERS = {
+    MatchJID: lambda obj, info: obj.match_info(info),
+    matcher.MatcherId: lambda obj, info: info.id == obj._criteria,
+}
+
 
 class XMLTab(Tab):
     def __init__(self, core):
@@ -60,9 +113,25 @@ class XMLTab(Tab):
         self.state = 'normal'
         self._name = 'XMLTab'
         self.filters = []
+        # message id -> parsed stanza
+        self._parsed: 'OrderedDict[int, ParsedEntry]' = OrderedDict()
 
         self.core_buffer = self.core.xml_buffer
         self.filtered_buffer = text_buffer.TextBuffer()
+        # The stanzas are also written to disk, and the older ones are
+        # read from there when scrolling up
+        self.capture: Optional[XMLCapture] = None
+        # The records before that one were cleared (/clear)
+        self.capture_start = 0
+        if config.getbool('xml_capture'):
+            path = get_capture_path()
+            try:
+                self.capture = XMLCapture(
+                    path, config.getint('xml_capture_size') * 1024 * 1024)
+            except OSError as e:
+                self.core.information(
+                    'Unable to open the XML capture %s: %s' % (path, e),
+                    'Error')
 
         self.info_header = windows.XMLInfoWin()
         self.text_win = windows.TextWin()
@@ -118,7 +187,8 @@ class XMLTab(Tab):
             'dump',
             self.command_dump,
             usage='<filename>',
-            desc='Writes the content of the XML buffer into a file.',
+            desc='Writes the content of the XML buffer (or of the XML '
+            'capture, if xml_capture is enabled) into a file.',
             shortdesc='Write in a file.')
         self.input = self.default_help_message  # type: ignore
         self.key_func['^T'] = self.close
@@ -154,18 +224,86 @@ class XMLTab(Tab):
             messages = self.filtered_buffer.messages
             self.filtered_buffer.messages = []
         self.filters.append(matcher)
-        new_messages = []
-        for msg in messages:
-            try:
-                if msg.txt.strip() and self.match_stanza(
-                        ElementBase(ET.fromstring(clean_text(msg.txt)))):
-                    new_messages.append(msg)
-            except ET.ParseError:
-                log.debug('Malformed XML : %s', msg.txt, exc_info=True)
+        # The messages already match the previous filters
+        new_messages = [
+            msg for msg in messages
+            if isinstance(msg, XMLLog) and self._match(matcher, msg)
+        ]
         self.filtered_buffer.messages = new_messages
         self.text_win.rebuild_everything(self.filtered_buffer)
         self.gen_filter_repr()
 
+    def add_stanza(self, stanza: Union[str, StanzaBase],
+                   incoming: bool) -> None:
+        """
+        Add a stanza to the buffer, and to the filtered buffer if it
+        matches the filters. It is only colorized when displayed.
+        """
+        stanza_str = str(stanza)
+        element = None
+        info = None
+        if isinstance(stanza, ElementBase):
+            element = stanza
+            info = stanza_info(stanza.xml)
+        now = time.time()
+        capture_id = None
+        if self.capture is not None and stanza_str.strip():
+            try:
+                capture_id = self.capture.append(stanza_str.encode('utf-8'),
+                                                 incoming, now)
+            except OSError as e:
+                self.core.information(
+                    'Unable to write to the XML capture: %s' % e, 'Error')
+                self.capture.close()
+                self.capture = None
+        msg = XMLLog(
+            txt=stanza_str,
+            incoming=incoming,
+            info=info,
+            time=datetime.fromtimestamp(now),
+            capture_id=capture_id,
+        )
+        self.core_buffer.add_message(msg)
+        # Most of the time what gets logged is whitespace pings. Skip.
+        if self.filters and stanza_str.strip():
+            try:
+                if self.match_message(msg, element):
+                    self.filtered_buffer.add_message(msg)
+            except:
+                log.debug('', exc_info=True)
+        if self.core.tabs.current_tab is self:
+            self.core.refresh_window()
+
+    def highlight_visible(self) -> None:
+        """
+        Colorize the stanzas in view which are not colorized yet.
+        """
+        text_win = self.text_win
+        if text_win.height <= 0:
+            return
+        if text_win.pos == 0:
+            lines = text_win.built_lines[-text_win.height:]
+        else:
+            lines = text_win.built_lines[-text_win.height - text_win.pos:
+                                         -text_win.pos]
+        messages = {}
+        for line in lines:
+            if line is not None and isinstance(line.msg, XMLLog) \
+                    and not line.msg.highlighted:
+                messages[id(line.msg)] = line.msg
+        if messages:
+            self.core.xml_highlighter.highlight(messages.values(),
+                                                self._on_highlighted)
+
+    def _on_highlighted(self, messages) -> None:
+        """The text of some messages changed, build their lines again"""
+        if self.closed:
+            return
+        for msg in messages:
+            self.text_win.modify_message(None, msg)
+        if self.core.tabs.current_tab is self:
+            self.core.refresh_window()
+
     def on_freeze(self):
         """
         Freeze the display.
@@ -179,6 +317,52 @@ class XMLTab(Tab):
                 return False
         return True
 
+    def match_message(self, msg: XMLLog,
+                      stanza: Optional[ElementBase] = None) -> bool:
+        """
+        Check if a message matches the filters. The filters on the
+        attributes are tested first, and the stanza is only parsed (if not
+        given) for the other ones.
+        """
+        filters = sorted(self.filters,
+                         key=lambda obj: type(obj) not in INDEXED_MATCHERS)
+        return all(
+            self._match(matcher_, msg, stanza) for matcher_ in filters)
+
+    def _match(self, matcher_, msg: XMLLog,
+               stanza: Optional[ElementBase] = None) -> bool:
+        indexed = INDEXED_MATCHERS.get(type(matcher_))
+        info = msg.info
+        if indexed is not None and info is not None:
+            return indexed(matcher_, info)
+        if stanza is None:
+            stanza = self._parse(msg)
+            if stanza is None:
+                return False
+        if info is None:
+            info = msg.info = stanza_info(stanza.xml)
+            if indexed is not None:
+                return indexed(matcher_, info)
+        return matcher_.match(stanza)
+
+    def _parse(self, msg: XMLLog) -> Optional[ElementBase]:
+        """Parse the text of a message, or get it from the cache"""
+        key = id(msg)
+        entry = self._parsed.get(key)
+        if entry is not None and entry[0] is msg:
+            self._parsed.move_to_end(key)
+            return entry[1]
+        stanza = None
+        if msg.raw.strip():
+            try:
+                stanza = ElementBase(ET.fromstring(msg.raw))
+            except ET.ParseError:
+                log.debug('Malformed XML : %s', msg.raw, exc_info=True)
+        self._parsed[key] = (msg, stanza)
+        while len(self._parsed) > PARSED_CACHE_SIZE:
+            self._parsed.popitem(last=False)
+        return stanza
+
     @command_args_parser.raw
     def command_filter_xmlmask(self, mask):
         """/filter_xmlmask <xml mask>"""
@@ -260,6 +444,15 @@ class XMLTab(Tab):
         """/dump <filename>"""
         if args is None:
             return self.core.command.help('dump')
+        filename = os.path.expandvars(os.path.expanduser(args[0]))
+        if self.capture is not None:
+            try:
+                with open(filename, 'wb') as fd:
+                    self.dump_capture(fd)
+            except Exception as e:
+                self.core.information('Could not write the XML dump: %s' % e,
+                                      'Error')
+            return
         if self.filters:
             xml = self.filtered_buffer.messages[:]
         else:
@@ -268,9 +461,8 @@ class XMLTab(Tab):
             ('%s %s %s' % (
                 msg.time.strftime('%H:%M:%S'),
                 'IN' if msg.incoming else 'OUT',
-                clean_text(msg.txt))
+                msg.raw)
              for msg in xml))
-        filename = os.path.expandvars(os.path.expanduser(args[0]))
         try:
             with open(filename, 'w') as fd:
                 fd.write(text)
@@ -278,6 +470,64 @@ class XMLTab(Tab):
             self.core.information('Could not write the XML dump: %s' % e,
                                   'Error')
 
+    def dump_capture(self, fd) -> None:
+        """
+        Write the captured stanzas (the ones matching the filters if any)
+        to a binary file, copying them from the capture.
+        """
+        assert self.capture is not None
+        if not self.filters:
+            self.capture.dump(
+                fd, range(max(self.capture_start, self.capture.first_id),
+                          self.capture.next_id))
+            return
+        for msg in self.filtered_buffer.messages[:]:
+            if msg.capture_id is not None and \
+                    self.capture.dump(fd, (msg.capture_id, )):
+                continue
+            fd.write(('%s %s %s\n' % (
+                msg.time.strftime('%H:%M:%S'),
+                'IN' if msg.incoming else 'OUT',
+                msg.raw)).encode('utf-8'))
+
+    def load_captured(self, nb: int) -> List[XMLLog]:
+        """
+        Insert the captured stanzas older than the ones in the buffer, if
+        the view is close to the top of the buffer.
+
+        :returns: the inserted messages
+        """
+        capture = self.capture
+        text_win = self.text_win
+        if capture is None:
+            return []
+        if (len(text_win.built_lines) - text_win.pos) // max(
+                text_win.height, 1) > 1:
+            return []
+        end = capture.next_id
+        for msg in self.core_buffer.messages:
+            if isinstance(msg, XMLLog) and msg.capture_id is not None:
+                end = msg.capture_id
+                break
+        start = max(end - nb, self.capture_start)
+        messages = [
+            XMLLog(
+                txt=data.decode('utf-8', errors='replace'),
+                incoming=incoming,
+                time=datetime.fromtimestamp(timestamp),
+                capture_id=record_id,
+            ) for record_id, (timestamp, incoming, data) in
+            capture.read_range(start, end)
+        ]
+        if not messages:
+            return []
+        self.core_buffer.add_history_messages(messages)
+        if self.filters:
+            matching = [msg for msg in messages if self.match_message(msg)]
+            if matching:
+                self.filtered_buffer.add_history_messages(matching)
+        return messages
+
     def on_slash(self):
         """
         '/' is pressed, activate the input
@@ -298,6 +548,7 @@ class XMLTab(Tab):
         return True
 
     def on_scroll_up(self) -> bool:
+        self.load_captured(self.text_win.height)
         return self.text_win.scroll_up(self.text_win.height - 1)
 
     def on_scroll_down(self) -> bool:
@@ -310,6 +561,9 @@ class XMLTab(Tab):
         """
         self.core_buffer.messages = []
         self.filtered_buffer.messages = []
+        self._parsed.clear()
+        if self.capture is not None:
+            self.capture_start = self.capture.next_id
         self.text_win.rebuild_everything(self.filtered_buffer)
         self.refresh()
         self.core.doupdate()
@@ -361,6 +615,7 @@ class XMLTab(Tab):
         else:
             display_info_win = True
 
+        self.highlight_visible()
         self.text_win.refresh()
         self.info_header.refresh(self.filter_type, self.filter, self.text_win)
         self.refresh_tab_win()
@@ -378,6 +633,9 @@ class XMLTab(Tab):
     def on_close(self):
         super().on_close()
         self.command_clear()
+        if self.capture is not None:
+            self.capture.close()
+            self.capture = None
         self.core.xml_tab = False
 
     def on_info_win_size_changed(self):
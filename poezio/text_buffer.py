@@ -12,17 +12,29 @@ from __future__ import annotations
 
 import logging
 
+from bisect import bisect_right
+from collections import deque
+from itertools import islice
 from typing import (
+    Deque,
     Dict,
+    Generic,
+    Iterable,
+    Iterator,
     List,
     Optional,
+    Sequence,
     TYPE_CHECKING,
     Tuple,
+    TypeVar,
     Union,
+    overload,
 )
 from dataclasses import dataclass
 from datetime import datetime
+from poezio.common import to_utc
 from poezio.config import config
+from poezio.ui.render import line_cache
 from poezio.ui.types import (
     BaseMessage,
     Message,
@@ -38,6 +50,8 @@ if TYPE_CHECKING:
 
 log = logging.getLogger(__name__)
 
+T = TypeVar('T')
+
 
 class CorrectionError(Exception):
     pass
@@ -47,6 +61,137 @@ class AckError(Exception):
     pass
 
 
+class RingBuffer(Generic[T]):
+    """
+    A list-like container with a soft size limit, used to store the
+    messages of a TextBuffer and the built lines of a TextWin.
+
+    Items are kept in a deque, so that appending at the end and evicting
+    the oldest items (see :meth:`evict`) are O(1) instead of the O(n)
+    list.pop(0). Indexing, slicing, reverse iteration and insertion in the
+    middle (for history) are still supported.
+    """
+    __slots__ = ('_items', 'limit')
+
+    def __init__(self, items: Iterable[T] = (),
+                 limit: Optional[int] = None) -> None:
+        self._items: Deque[T] = deque(items)
+        self.limit = limit
+
+    def evict(self) -> int:
+        """
+        Remove the oldest items until the buffer fits in its limit.
+        Return the number of removed items.
+        """
+        if self.limit is None:
+            return 0
+        removed = 0
+        while len(self._items) > self.limit:
+            self._items.popleft()
+            removed += 1
+        return removed
+
+    def append(self, item: T) -> None:
+        self._items.append(item)
+
+    def extend(self, items: Iterable[T]) -> None:
+        self._items.extend(items)
+
+    def insert(self, index: int, item: T) -> None:
+        self._items.insert(index, item)
+
+    def insert_many(self, index: int, items: Sequence[T]) -> None:
+        """Insert several items before index, in order"""
+        size = len(self._items)
+        if index < 0:
+            index = max(size + index, 0)
+        index = min(index, size)
+        if index == size:
+            self._items.extend(items)
+            return
+        self._items.rotate(-index)
+        self._items.extendleft(reversed(items))
+        self._items.rotate(index)
+
+    def pop(self, index: int = -1) -> T:
+        if index == 0:
+            return self._items.popleft()
+        if index == -1:
+            return self._items.pop()
+        item = self._items[index]
+        del self._items[index]
+        return item
+
+    def remove(self, item: T) -> None:
+        self._items.remove(item)
+
+    def index(self, item: T) -> int:
+        return self._items.index(item)
+
+    def clear(self) -> None:
+        self._items.clear()
+
+    def _slice(self, index: slice) -> List[T]:
+        start, stop, step = index.indices(len(self._items))
+        if step != 1:
+            return [self._items[i] for i in range(start, stop, step)]
+        if stop <= start:
+            return []
+        size = len(self._items)
+        if start > size - stop:
+            # Closer to the end (the usual case when rendering a window)
+            items = list(islice(reversed(self._items),
+                                size - stop, size - start))
+            items.reverse()
+            return items
+        return list(islice(self._items, start, stop))
+
+    @overload
+    def __getitem__(self, index: int) -> T:
+        ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[T]:
+        ...
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._slice(index)
+        return self._items[index]
+
+    def __setitem__(self, index: int, item: T) -> None:
+        self._items[index] = item
+
+    def __delitem__(self, index: int) -> None:
+        del self._items[index]
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __bool__(self) -> bool:
+        return bool(self._items)
+
+    def __iter__(self) -> Iterator[T]:
+        return iter(self._items)
+
+    def __reversed__(self) -> Iterator[T]:
+        return reversed(self._items)
+
+    def __contains__(self, item: object) -> bool:
+        return item in self._items
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, RingBuffer):
+            return self._items == other._items
+        if isinstance(other, (list, tuple, deque)):
+            return len(self._items) == len(other) and \
+                all(a == b for a, b in zip(self._items, other))
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return 'RingBuffer(%r, limit=%s)' % (list(self._items), self.limit)
+
+
 @dataclass
 class HistoryGap:
     """Class representing a period of non-presence inside a MUC"""
@@ -68,13 +213,58 @@ class TextBuffer:
             messages_nb_limit = config.getint('max_messages_in_memory')
         self._messages_nb_limit: int = messages_nb_limit
         # Message objects
-        self.messages: List[BaseMessage] = []
+        self._messages: RingBuffer[BaseMessage] = RingBuffer(
+            limit=messages_nb_limit)
         # COMPAT: Correction id -> Original message id.
         self.correction_ids: Dict[str, str] = {}
         # we keep track of one or more windows
         # so we can pass the new messages to them, as they are added, so
         # they (the windows) can build the lines from the new message
         self._windows: List[TextWin] = []
+        # The (UTC) time of each message, or of a previous one if it is
+        # more recent, so that the list stays sorted even when messages
+        # were not received in order. Built the first time a date is
+        # looked for (see find_message_index), and then kept up to date
+        # when messages are added; the first _time_index_start entries
+        # belong to messages that were evicted.
+        self._time_index: Optional[List[datetime]] = None
+        self._time_index_start = 0
+
+    @property
+    def messages(self) -> RingBuffer[BaseMessage]:
+        return self._messages
+
+    @messages.setter
+    def messages(self, messages: Iterable[BaseMessage]) -> None:
+        self._messages = RingBuffer(messages, limit=self._messages_nb_limit)
+        self._time_index = None
+
+    def _get_time_index(self) -> List[datetime]:
+        """Return the time index, (re)building it if needed"""
+        index = self._time_index
+        if index is not None and \
+                len(index) - self._time_index_start == len(self.messages):
+            return index
+        index = []
+        latest: Optional[datetime] = None
+        for message in self.messages:
+            time = to_utc(message.time)
+            if latest is None or time > latest:
+                latest = time
+            index.append(latest)
+        self._time_index = index
+        self._time_index_start = 0
+        return index
+
+    def find_message_index(self, date: datetime) -> int:
+        """
+        Return the index of the last message of the buffer sent at or
+        before date (in order of the buffer), or -1 if they are all more
+        recent.
+        """
+        index = self._get_time_index()
+        start = self._time_index_start
+        return bisect_right(index, to_utc(date), lo=start) - start - 1
 
     def add_window(self, win) -> None:
         self._windows.append(win)
@@ -165,12 +355,12 @@ class TextBuffer:
             if new_index is None:  # Not sure what happened, abort
                 return
             index = new_index
+        self.messages.insert_many(index, messages)
+        self._time_index = None
         for message in messages:
-            self.messages.insert(index, message)
-            index += 1
             log.debug('inserted message: %s', message)
-        for window in self._windows:  # make the associated windows
-            window.rebuild_everything(self)
+        for window in self._windows:  # build only the inserted lines
+            window.add_history_messages(messages, self, index)
 
     @property
     def last_message(self) -> Optional[BaseMessage]:
@@ -180,14 +370,29 @@ class TextBuffer:
         """
         Create a message and add it to the text buffer
         """
+        index = self._time_index
+        if index is not None:
+            if len(index) - self._time_index_start == len(self.messages):
+                time = to_utc(msg.time)
+                index.append(max(index[-1], time) if index else time)
+            else:
+                self._time_index = None
         self.messages.append(msg)
-
-        while len(self.messages) > self._messages_nb_limit:
-            self.messages.pop(0)
+        overflow = len(self.messages) - self._messages_nb_limit
+        if overflow > 0:
+            # Do not keep the evicted messages alive in the cache
+            for old in self.messages[:overflow]:
+                line_cache.invalidate(old)
+        evicted = self.messages.evict()
+        if evicted and self._time_index is not None:
+            self._time_index_start += evicted
+            if self._time_index_start > len(self.messages):
+                del self._time_index[:self._time_index_start]
+                self._time_index_start = 0
 
         ret_val = 0
         show_timestamps = config.getbool('show_timestamps')
-        nick_size = config.getbool('max_nick_length')
+        nick_size = config.getint('max_nick_length')
         for window in self._windows:  # make the associated windows
             # build the lines from the new message
             nb = window.build_new_message(
@@ -304,12 +509,19 @@ class TextBuffer:
             revisions=msg.revisions + 1,
             jid=jid)
         self.messages[i] = message
+        self._time_index = None
+        line_cache.invalidate(msg)
         log.debug('Replacing message %s with %s.', orig_id, new_id)
         return message
 
     def del_window(self, win) -> None:
         self._windows.remove(win)
 
+    def clear_line_cache(self) -> None:
+        """Drop the cached lines of the messages (e.g. on tab close)"""
+        for message in self.messages:
+            line_cache.invalidate(message)
+
     def find_last_message(self) -> Optional[Message]:
         """Find the last real message received in this buffer"""
         for message in reversed(self.messages):
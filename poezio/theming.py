@@ -400,6 +400,10 @@ class Theme:
 # This is the default theme object, used if no theme is defined in the conf
 theme = Theme()
 
+# Incremented each time the theme is reloaded, so that the values computed
+# from the previous one can be invalidated
+theme_generation = 0
+
 # a dict "color tuple -> color_pair"
 # Each time we use a color tuple, we check if it has already been used.
 # If not we create a new color_pair and keep it in that dict, to use it
@@ -509,6 +513,13 @@ def get_theme() -> Theme:
     return theme
 
 
+def get_theme_generation() -> int:
+    """
+    Returns the number of times the theme has been reloaded
+    """
+    return theme_generation
+
+
 def update_themes_dir(option: Optional[str] = None,
                       value: Optional[str] = None):
     global load_path
@@ -568,7 +579,8 @@ def prepare_ccolor_palette(theme: Theme) -> None:
 
 def reload_theme() -> Optional[str]:
     theme_name = config.getstr('theme')
-    global theme
+    global theme, theme_generation
+    theme_generation += 1
     if theme_name == 'default' or not theme_name.strip():
         theme = Theme()
         return None
@@ -2,12 +2,21 @@
 Standalone functions used by the modules
 """
 
+import curses
 import string
-from typing import Optional, List
+from bisect import bisect_right
+from functools import lru_cache
+from typing import Optional, List, Tuple
+from poezio import poopt
+from poezio.theming import read_tuple, to_curses_attr
 from poezio.ui.consts import FORMAT_CHAR, FORMAT_CHARS
 
 DIGITS = string.digits + '-'
 
+# A run of text without format chars: (start, end, curses attribute), start
+# and end being positions in the original string.
+Run = Tuple[int, int, int]
+
 
 def find_first_format_char(text: str,
                            chars: str = None) -> int:
@@ -32,6 +41,15 @@ def truncate_nick(nick: Optional[str], size=10) -> str:
     return ''
 
 
+@lru_cache(maxsize=128)
+def theme_char_width(chars: str) -> int:
+    """
+    Width of the characters defined by the theme (ack, nack, xml…), cached
+    since there are only a handful of them.
+    """
+    return poopt.wcswidth(chars)
+
+
 def parse_attrs(text: str, previous: Optional[List[str]] = None) -> List[str]:
     next_attr_char = text.find(FORMAT_CHAR)
     if previous:
@@ -60,3 +78,86 @@ def parse_attrs(text: str, previous: Optional[List[str]] = None) -> List[str]:
             text = text[next_attr_char + 2:]
         next_attr_char = text.find(FORMAT_CHAR)
     return attrs
+
+
+def _attr_on(state: int, attr: int) -> int:
+    """Emulate attron(): a color pair replaces the current one"""
+    if attr & curses.A_COLOR:
+        state &= ~curses.A_COLOR
+    return state | attr
+
+
+def _attr_off(state: int, attr: int) -> int:
+    """Emulate attroff(): a color pair resets the color"""
+    if attr & curses.A_COLOR:
+        state &= ~curses.A_COLOR
+    return state & ~(attr & ~curses.A_COLOR)
+
+
+def parse_runs(text: str) -> List[Run]:
+    """
+    Split a string containing format chars into runs of plain text, along
+    with the curses attribute to write each of them with (the same ones
+    Win.addstr_colored would set while writing the string).
+
+    This needs curses to be initialized.
+    """
+    runs: List[Run] = []
+    attr_italic = curses.A_ITALIC if hasattr(
+        curses, 'A_ITALIC') else curses.A_REVERSE
+    state = 0
+    pos = 0
+    length = len(text)
+    while pos < length:
+        next_attr_char = text.find(FORMAT_CHAR, pos)
+        if next_attr_char == -1:
+            next_attr_char = length
+        if next_attr_char != pos:
+            runs.append((pos, next_attr_char, state))
+        if next_attr_char + 1 >= length:
+            break
+        attr_char = text[next_attr_char + 1].lower()
+        pos = next_attr_char + 2
+        if attr_char == 'o':
+            state = 0
+        elif attr_char == 'u':
+            state = _attr_on(state, curses.A_UNDERLINE)
+        elif attr_char == 'b':
+            state = _attr_on(state, curses.A_BOLD)
+        elif attr_char == 'i':
+            state = _attr_on(state, attr_italic)
+        elif attr_char in DIGITS:
+            end = text.find('}', next_attr_char)
+            if end == -1:
+                continue
+            color_str = text[next_attr_char + 1:end]
+            pos = end + 1
+            try:
+                if ',' in color_str:
+                    tup, char = read_tuple(color_str)
+                    state = _attr_on(state, to_curses_attr(tup))
+                    if char == 'o':
+                        state = 0
+                    elif char == 'u':
+                        state = _attr_on(state, curses.A_UNDERLINE)
+                    elif char == 'b':
+                        state = _attr_on(state, curses.A_BOLD)
+                    elif char == 'i':
+                        state = _attr_on(state, attr_italic)
+                    elif not char:
+                        # reset the previous bold/underline sequences
+                        state = _attr_off(state, curses.A_UNDERLINE)
+                        state = _attr_off(state, curses.A_BOLD)
+                elif color_str:
+                    state = _attr_on(state, to_curses_attr((int(color_str), -1)))
+            except ValueError:
+                pass
+    return runs
+
+
+def find_run(runs: List[Run], pos: int) -> int:
+    """Index of the first run ending after pos"""
+    index = bisect_right(runs, (pos, -1, -1))
+    if index > 0 and runs[index - 1][1] > pos:
+        return index - 1
+    return index
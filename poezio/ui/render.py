@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import curses
 
+from collections import OrderedDict
 from datetime import (
     datetime,
     date,
@@ -9,8 +10,10 @@ from datetime import (
 from functools import singledispatch
 from math import ceil, log10
 from typing import (
+    Dict,
     List,
     Optional,
+    Sequence,
     Tuple,
     TYPE_CHECKING,
 )
@@ -19,12 +22,9 @@ from poezio import poopt
 from poezio.theming import (
     get_theme,
 )
-from poezio.ui.consts import (
-    FORMAT_CHAR,
-)
 from poezio.ui.funcs import (
+    theme_char_width,
     truncate_nick,
-    parse_attrs,
 )
 from poezio.ui.types import (
     BaseMessage,
@@ -38,7 +38,9 @@ if TYPE_CHECKING:
     from poezio.windows import Win
 
 # msg is a reference to the corresponding Message object. text_start and
-# text_end are the position delimiting the text in this line.
+# text_end are the position delimiting the text in this line. The
+# formatting of the line comes from the runs of the message, prepend is
+# only kept for compatibility.
 class Line:
     __slots__ = ('msg', 'start_pos', 'end_pos', 'prepend')
 
@@ -56,32 +58,99 @@ LinePos = Tuple[int, int]
 
 
 def generate_lines(lines: List[LinePos], msg: BaseMessage, default_color: str = '') -> List[Line]:
-    line_objects = []
-    attrs: List[str] = []
-    prepend = default_color if default_color else ''
-    for line in lines:
-        saved = Line(
-            msg=msg,
-            start_pos=line[0],
-            end_pos=line[1],
-            prepend=prepend)
-        attrs = parse_attrs(msg.txt[line[0]:line[1]], attrs)
-        if attrs:
-            prepend = FORMAT_CHAR + FORMAT_CHAR.join(attrs)
-        else:
-            if default_color:
-                prepend = default_color
-            else:
-                prepend = ''
-        line_objects.append(saved)
-    return line_objects
+    """
+    Create the Line objects of a message from the positions of its lines.
+    The formatting of each line is not computed here: the window writes
+    them using the formatting runs of the message (see BaseMessage.runs).
+    """
+    return [
+        Line(msg=msg, start_pos=start, end_pos=end, prepend=default_color)
+        for start, end in lines
+    ]
+
+
+class LineCache:
+    """
+    Bounded cache of the lines built for a message, so that rebuilding a
+    buffer (or resizing back to a previous width) does not cut and parse
+    the text again.
+
+    Entries are keyed by the message identity and the width available for
+    its text, which already accounts for the timestamps, the nick size and
+    the theme. An entry is only used while the text of the message is the
+    same string object, so a corrected (or rebuilt) message gets new lines.
+    """
+    __slots__ = ('size', '_entries', '_widths', 'hits', 'misses')
+
+    def __init__(self, size: int = 16384) -> None:
+        self.size = size
+        self._entries: OrderedDict[
+            Tuple[int, int], Tuple[BaseMessage, str, List[Line]]
+        ] = OrderedDict()
+        # widths cached for each message, to invalidate them
+        self._widths: Dict[int, List[int]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, msg: BaseMessage, width: int) -> List[Line]:
+        """Return the lines of a message cut at the given width"""
+        lines = self.lookup(msg, width)
+        if lines is None:
+            lines = generate_lines(poopt.cut_text(msg.txt, width), msg)
+            self.store(msg, width, lines)
+        return list(lines)
+
+    def lookup(self, msg: BaseMessage, width: int) -> Optional[List[Line]]:
+        """Return the cached lines of a message, or None"""
+        key = (id(msg), width)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] is msg and entry[1] is msg.txt:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return list(entry[2])
+        self.misses += 1
+        return None
+
+    def store(self, msg: BaseMessage, width: int, lines: List[Line]) -> None:
+        """Keep the lines of a message, built from its current text"""
+        key = (id(msg), width)
+        if key not in self._entries:
+            self._widths.setdefault(key[0], []).append(width)
+        self._entries[key] = (msg, msg.txt, lines)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            (msg_id, old_width), _ = self._entries.popitem(last=False)
+            self._forget_width(msg_id, old_width)
+
+    def _forget_width(self, msg_id: int, width: int) -> None:
+        widths = self._widths.get(msg_id)
+        if widths is not None:
+            widths.remove(width)
+            if not widths:
+                del self._widths[msg_id]
+
+    def invalidate(self, msg: BaseMessage) -> None:
+        """Drop the cached lines of a message (e.g. when it is corrected)"""
+        msg_id = id(msg)
+        for width in self._widths.pop(msg_id, []):
+            self._entries.pop((msg_id, width), None)
+
+    def clear(self) -> None:
+        """Drop everything (e.g. when the theme changes)"""
+        self._entries.clear()
+        self._widths.clear()
+
+
+line_cache = LineCache()
 
 
 @singledispatch
 def build_lines(msg: BaseMessage, width: int, timestamp: bool, nick_size: int = 10) -> List[Line]:
     offset = msg.compute_offset(timestamp, nick_size)
-    lines = poopt.cut_text(msg.txt, width - offset - 1)
-    return generate_lines(lines, msg, default_color='')
+    return line_cache.get(msg, width - offset - 1)
 
 
 @build_lines.register(type(None))
@@ -98,31 +167,82 @@ def build_message(msg: Message, width: int, timestamp: bool, nick_size: int = 10
     if not txt:
         return []
     offset = msg.compute_offset(timestamp, nick_size)
-    lines = poopt.cut_text(txt, width - offset - 1)
-    generated_lines = generate_lines(lines, msg, default_color='')
-    return generated_lines
+    return line_cache.get(msg, width - offset - 1)
 
 
 @build_lines.register(StatusMessage)
 def build_status(msg: StatusMessage, width: int, timestamp: bool, nick_size: int = 10) -> List[Line]:
     msg.rebuild()
     offset = msg.compute_offset(timestamp, nick_size)
-    lines = poopt.cut_text(msg.txt, width - offset - 1)
-    return generate_lines(lines, msg, default_color='')
+    return line_cache.get(msg, width - offset - 1)
 
 
 @build_lines.register(XMLLog)
 def build_xmllog(msg: XMLLog, width: int, timestamp: bool, nick_size: int = 10) -> List[Line]:
     offset = msg.compute_offset(timestamp, nick_size)
-    lines = poopt.cut_text(msg.txt, width - offset - 1)
-    return generate_lines(lines, msg, default_color='')
+    return line_cache.get(msg, width - offset - 1)
+
+
+def build_many_lines(messages: Sequence[Optional[BaseMessage]], width: int,
+                     timestamp: bool, nick_size: int = 10) -> List[List[Line]]:
+    """
+    Build the lines of several messages, like build_lines does for each of
+    them, but wrap all the texts missing from the line cache with a single
+    call to poopt.cut_texts.
+    """
+    results: List[List[Line]] = []
+    # messages to cut: their index in results and available width
+    todo: List[Tuple[int, BaseMessage, int]] = []
+    for msg in messages:
+        builder = build_lines.dispatch(type(msg))
+        if msg is None or builder not in _CACHED_BUILDERS:
+            results.append(builder(msg, width, timestamp, nick_size))
+            continue
+        if isinstance(msg, StatusMessage):
+            msg.rebuild()
+        elif builder is build_message and not msg.txt:
+            results.append([])
+            continue
+        available = width - msg.compute_offset(timestamp, nick_size) - 1
+        lines = line_cache.lookup(msg, available)
+        if lines is None:
+            todo.append((len(results), msg, available))
+            lines = []
+        results.append(lines)
+    if not todo:
+        return results
+    positions, counts = poopt.cut_texts(
+        [msg.txt for _, msg, _ in todo],
+        [available for _, _, available in todo],
+    )
+    pos = 0
+    for (index, msg, available), count in zip(todo, counts):
+        end = pos + 2 * count
+        lines = [
+            Line(msg=msg, start_pos=positions[i], end_pos=positions[i + 1],
+                 prepend='')
+            for i in range(pos, end, 2)
+        ]
+        pos = end
+        line_cache.store(msg, available, lines)
+        results[index] = list(lines)
+    return results
+
+
+# The builders that only cut the text, which build_many_lines can batch
+_CACHED_BUILDERS = frozenset((
+    build_lines.dispatch(BaseMessage),
+    build_message,
+    build_status,
+    build_xmllog,
+))
 
 
 @singledispatch
 def write_pre(msg: BaseMessage, win: Win, with_timestamps: bool, nick_size: int) -> int:
     """Write the part before text (only the timestamp)"""
     if with_timestamps:
-        return PreMessageHelpers.write_time(win, False, msg.time)
+        return PreMessageHelpers.write_msg_time(win, msg, False)
     return 0
 
 
@@ -135,7 +255,7 @@ def write_pre_uimessage(msg: UIMessage, win: Win, with_timestamps: bool, nick_si
     color: Optional[Tuple]
     offset = 0
     if with_timestamps:
-        offset += PreMessageHelpers.write_time(win, False, msg.time)
+        offset += PreMessageHelpers.write_msg_time(win, msg, False)
 
     if not msg.level:  # not a message, nothing to do afterwards
         return offset
@@ -160,13 +280,13 @@ def write_pre_message(msg: Message, win: Win, with_timestamps: bool, nick_size:
     color: Optional[Tuple]
     offset = 0
     if with_timestamps:
-        offset += PreMessageHelpers.write_time(win, msg.history, msg.time)
+        offset += PreMessageHelpers.write_msg_time(win, msg, msg.history)
 
     if not msg.nickname:  # not a message, nothing to do afterwards
         return offset
 
-    nick = truncate_nick(msg.nickname, nick_size)
-    offset += poopt.wcswidth(nick)
+    nick, nick_width = msg.short_nick(nick_size)
+    offset += nick_width
     if msg.nick_color:
         color = msg.nick_color
     elif msg.user:
@@ -199,7 +319,7 @@ def write_pre_xmllog(msg: XMLLog, win: Win, with_timestamps: bool, nick_size: in
     """Write the part before the stanza (timestamp + IN/OUT)"""
     offset = 0
     if with_timestamps:
-        offset += 1 + PreMessageHelpers.write_time(win, False, msg.time)
+        offset += 1 + PreMessageHelpers.write_msg_time(win, msg, False)
     theme = get_theme()
     if msg.incoming:
         char = theme.CHAR_XML_IN
@@ -208,7 +328,7 @@ def write_pre_xmllog(msg: XMLLog, win: Win, with_timestamps: bool, nick_size: in
         char = theme.CHAR_XML_OUT
         color = theme.COLOR_XML_OUT
     nick = truncate_nick(char, nick_size)
-    offset += poopt.wcswidth(nick)
+    offset += theme_char_width(nick)
     PreMessageHelpers.write_nickname(win, char, color)
     win.addstr(' ')
     return offset
@@ -231,7 +351,7 @@ class PreMessageHelpers:
         with buffer.colored_text(color=color):
             buffer.addstr(theme.CHAR_ACK_RECEIVED)
         buffer.addstr(' ')
-        return poopt.wcswidth(theme.CHAR_ACK_RECEIVED) + 1
+        return theme_char_width(theme.CHAR_ACK_RECEIVED) + 1
 
     @staticmethod
     def write_nack(buffer: Win) -> int:
@@ -240,7 +360,7 @@ class PreMessageHelpers:
         with buffer.colored_text(color=color):
             buffer.addstr(theme.CHAR_NACK)
         buffer.addstr(' ')
-        return poopt.wcswidth(theme.CHAR_NACK) + 1
+        return theme_char_width(theme.CHAR_NACK) + 1
 
     @staticmethod
     def write_nickname(buffer: Win, nickname: str, color, highlight=False) -> None:
@@ -278,3 +398,20 @@ class PreMessageHelpers:
             buffer.addstr(' ')
             return poopt.wcswidth(time_str) + 1
         return 0
+
+    @staticmethod
+    def write_msg_time(buffer: Win, msg: BaseMessage, history: bool) -> int:
+        """
+        Write the date of a message, like write_time, using the timestamp
+        string kept by the message.
+        """
+        time = msg.time
+        if time:
+            long_format = history and time.date() != date.today()
+            time_str, width = msg.format_time(long_format)
+            color = get_theme().COLOR_TIME_STRING
+            with buffer.colored_text(color=color):
+                buffer.addstr(time_str)
+            buffer.addstr(' ')
+            return width + 1
+        return 0
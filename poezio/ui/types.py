@@ -2,19 +2,19 @@ from __future__ import annotations
 
 from datetime import datetime
 from math import ceil, log10
-from typing import Optional, Tuple, Dict, Any, Callable
+from typing import Optional, Tuple, Dict, Any, Callable, List, NamedTuple
 
 from slixmpp import JID
 
 from poezio import poopt
-from poezio.theming import dump_tuple, get_theme
-from poezio.ui.funcs import truncate_nick
+from poezio.theming import dump_tuple, get_theme, get_theme_generation
+from poezio.ui.funcs import truncate_nick, parse_runs, theme_char_width, Run
 from poezio.user import User
 
 
 class BaseMessage:
     """Base class for all ui-related messages"""
-    __slots__ = ('txt', 'time', 'identifier')
+    __slots__ = ('txt', 'time', 'identifier', '_runs', '_offset', '_time_str')
 
     txt: str
     identifier: str
@@ -27,12 +27,61 @@ class BaseMessage:
             self.time = time
         else:
             self.time = datetime.now()
+        self._runs: Optional[Tuple[str, List[Run]]] = None
+        self._offset: Optional[Tuple[Tuple, int]] = None
+        self._time_str: Optional[Tuple[Tuple, str, int]] = None
+
+    @property
+    def runs(self) -> List[Run]:
+        """
+        The formatting runs of the text (see parse_runs), computed once
+        for each value of txt.
+        """
+        cached = getattr(self, '_runs', None)
+        if cached is None or cached[0] is not self.txt:
+            cached = self._runs = (self.txt, parse_runs(self.txt))
+        return cached[1]
 
     def compute_offset(self, with_timestamps: bool, nick_size: int) -> int:
+        """
+        Compute the x-position at which the text of the message starts.
+        The result is kept as long as the prefix of the message does not
+        change (see _prefix_key).
+        """
+        key = self._prefix_key(with_timestamps, nick_size)
+        cached = getattr(self, '_offset', None)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        offset = self._compute_offset(with_timestamps, nick_size)
+        self._offset = (key, offset)
+        return offset
+
+    def _prefix_key(self, with_timestamps: bool, nick_size: int) -> Tuple:
+        """The values the prefix of the message depends on"""
+        return (with_timestamps, nick_size, get_theme_generation())
+
+    def _compute_offset(self, with_timestamps: bool, nick_size: int) -> int:
         """Compute the offset of the message"""
         theme = get_theme()
         return theme.SHORT_TIME_FORMAT_LENGTH + 1
 
+    def format_time(self, long_format: bool) -> Tuple[str, int]:
+        """
+        Return the timestamp of the message in the short or long format of
+        the theme, and its width, formatted once for each format.
+        """
+        key = (long_format, get_theme_generation(), self.time)
+        cached = getattr(self, '_time_str', None)
+        if cached is None or cached[0] != key:
+            theme = get_theme()
+            if long_format:
+                time_str = self.time.strftime(theme.LONG_TIME_FORMAT)
+            else:
+                time_str = self.time.strftime(theme.SHORT_TIME_FORMAT)
+            cached = self._time_str = (key, time_str,
+                                       poopt.wcswidth(time_str))
+        return cached[1], cached[2]
+
 
 class EndOfArchive(BaseMessage):
     """Marker added to a buffer when we reach the end of a MAM archive"""
@@ -57,7 +106,11 @@ class UIMessage(BaseMessage):
         colors = get_theme().INFO_COLORS
         self.color = colors.get(level.lower(), colors.get('default', None))
 
-    def compute_offset(self, with_timestamps: bool, nick_size: int) -> int:
+    def _prefix_key(self, with_timestamps: bool, nick_size: int) -> Tuple:
+        return (with_timestamps, nick_size, get_theme_generation(),
+                self.level)
+
+    def _compute_offset(self, with_timestamps: bool, nick_size: int) -> int:
         """Compute the x-position at which the message should be printed"""
         offset = 0
         theme = get_theme()
@@ -90,23 +143,62 @@ class MucOwnJoinMessage(InfoMessage, LoggableTrait):
     """Status message displayed on our room join"""
 
 
+class StanzaInfo(NamedTuple):
+    """The attributes of a stanza used to filter the XML tab"""
+    from_: str
+    to: str
+    id: str
+    type: str
+    # the qualified name of the element, {namespace}name
+    tag: str
+
+
 class XMLLog(BaseMessage):
-    """XML Log message"""
-    __slots__ = ('incoming')
+    """
+    XML Log message
+
+    The message is created with the raw serialized stanza as its text, and
+    the text is only replaced by its colorized version (see
+    poezio.core.xml_highlight) when the message is displayed.
+    """
+    __slots__ = ('incoming', 'raw', 'highlighted', 'info', 'capture_id')
     incoming: bool
+    # the serialized stanza, without any formatting
+    raw: str
+    highlighted: bool
+    info: Optional[StanzaInfo]
+    # the id of its record in the XML capture (see poezio.xml_capture)
+    capture_id: Optional[int]
 
     def __init__(
             self,
             txt: str,
             incoming: bool,
+            info: Optional[StanzaInfo] = None,
+            time: Optional[datetime] = None,
+            capture_id: Optional[int] = None,
     ):
         BaseMessage.__init__(
             self,
             txt=txt,
+            time=time,
         )
         self.incoming = incoming
+        self.raw = txt
+        self.highlighted = False
+        self.info = info
+        self.capture_id = capture_id
 
-    def compute_offset(self, with_timestamps: bool, nick_size: int) -> int:
+    def set_highlighted(self, txt: str) -> None:
+        """Replace the text with its colorized version"""
+        self.txt = txt
+        self.highlighted = True
+
+    def _prefix_key(self, with_timestamps: bool, nick_size: int) -> Tuple:
+        return (with_timestamps, nick_size, get_theme_generation(),
+                self.incoming)
+
+    def _compute_offset(self, with_timestamps: bool, nick_size: int) -> int:
         offset = 0
         theme = get_theme()
         if with_timestamps:
@@ -145,7 +237,7 @@ class StatusMessage(BaseMessage):
 class Message(BaseMessage, LoggableTrait):
     __slots__ = ('nick_color', 'nickname', 'user', 'delayed', 'history',
                  'highlight', 'me', 'old_message', 'revisions',
-                 'jid', 'ack')
+                 'jid', 'ack', '_nick')
     nick_color: Optional[Tuple]
     nickname: Optional[str]
     user: Optional[User]
@@ -200,12 +292,14 @@ class Message(BaseMessage, LoggableTrait):
         self.revisions = revisions
         self.jid = jid
         self.ack = ack
+        self._nick: Optional[Tuple[Tuple, str, int]] = None
 
     def _other_elems(self) -> str:
         "Helper for the repr_message function"
         acc = []
         fields = list(self.__slots__)
         fields.remove('old_message')
+        fields.remove('_nick')
         for field in fields:
             acc.append('%s=%s' % (field, repr(getattr(self, field))))
         return 'Message(%s, %s' % (', '.join(acc), 'old_message=')
@@ -230,7 +324,23 @@ class Message(BaseMessage, LoggableTrait):
             rev -= 1
         return ''.join(acc)
 
-    def compute_offset(self, with_timestamps: bool, nick_size: int) -> int:
+    def short_nick(self, nick_size: int) -> Tuple[str, int]:
+        """
+        Return the nickname truncated to nick_size, and its width.
+        """
+        key = (self.nickname, nick_size)
+        cached = getattr(self, '_nick', None)
+        if cached is None or cached[0] != key:
+            nick = truncate_nick(self.nickname, nick_size) or ''
+            cached = self._nick = (key, nick, poopt.wcswidth(nick))
+        return cached[1], cached[2]
+
+    def _prefix_key(self, with_timestamps: bool, nick_size: int) -> Tuple:
+        return (with_timestamps, nick_size, get_theme_generation(),
+                self.history, self.nickname, self.ack, self.me,
+                self.revisions)
+
+    def _compute_offset(self, with_timestamps: bool, nick_size: int) -> int:
         """Compute the x-position at which the message should be printed"""
         offset = 0
         theme = get_theme()
@@ -243,14 +353,12 @@ class Message(BaseMessage, LoggableTrait):
         if not self.nickname:  # not a message, nothing to do afterwards
             return offset
 
-        nick = truncate_nick(self.nickname, nick_size) or ''
-        offset += poopt.wcswidth(nick)
+        offset += self.short_nick(nick_size)[1]
         if self.ack:
-            theme = get_theme()
             if self.ack > 0:
-                offset += poopt.wcswidth(theme.CHAR_ACK_RECEIVED) + 1
+                offset += theme_char_width(theme.CHAR_ACK_RECEIVED) + 1
             else:
-                offset += poopt.wcswidth(theme.CHAR_NACK) + 1
+                offset += theme_char_width(theme.CHAR_NACK) + 1
         if self.me:
             offset += 3
         else:
@@ -10,9 +10,11 @@ A user is a MUC participant, not a roster contact (see contact.py)
 """
 
 import logging
+from bisect import bisect_left, bisect_right
 from datetime import timedelta, datetime
 from hashlib import md5
-from typing import Optional, Tuple
+from typing import (Dict, Iterator, List, Optional, Sequence, Tuple, Union,
+                    overload)
 
 from poezio import xhtml, colors
 from poezio.theming import get_theme
@@ -128,3 +130,155 @@ class User:
         if ROLE_DICT[self.role] == ROLE_DICT[b.role]:
             return self.nick.lower() <= b.nick.lower()
         return ROLE_DICT[self.role] >= ROLE_DICT[b.role]
+
+
+UserKey = Tuple[int, str]
+
+
+def user_key(user: User) -> UserKey:
+    """Sort key of a user, in the same order as the User comparisons"""
+    return (-ROLE_DICT[user.role], user.nick.lower())
+
+
+class UserList(Sequence[User]):
+    """
+    The occupants of a room, indexed by nick, kept sorted by role and nick
+    (the order of the user list), and by the last time they talked (the
+    order of the nick completion).
+
+    It can be used as a read-only list of users sorted by role and nick.
+    Users whose nick or role changed must be repositioned with
+    :meth:`update`, and users who talked with :meth:`touch`.
+    """
+    __slots__ = ('_users', '_keys', '_by_nick', '_entries', '_talked',
+                 '_talked_times')
+
+    def __init__(self) -> None:
+        self._users: List[User] = []
+        self._keys: List[UserKey] = []
+        self._by_nick: Dict[str, User] = {}
+        # id(user) -> (sort key, nick, last talked) when it was indexed
+        self._entries: Dict[int, Tuple[UserKey, str, Optional[datetime]]] = {}
+        # users who talked, sorted by last_talked
+        self._talked: List[User] = []
+        self._talked_times: List[datetime] = []
+
+    def add(self, user: User) -> None:
+        """Add a user, replacing the one with the same nick if any"""
+        previous = self._by_nick.get(user.nick)
+        if previous is not None:
+            self.remove(previous)
+        key = user_key(user)
+        index = bisect_left(self._keys, key)
+        self._keys.insert(index, key)
+        self._users.insert(index, user)
+        self._by_nick[user.nick] = user
+        talked = None
+        if user.last_talked != datetime(1, 1, 1):
+            talked = user.last_talked
+            self._add_talked(user, talked)
+        self._entries[id(user)] = (key, user.nick, talked)
+
+    append = add
+
+    def remove(self, user: User) -> None:
+        """Remove a user, even if its nick or role changed since it was
+        added"""
+        entry = self._entries.pop(id(user), None)
+        if entry is None:
+            raise ValueError('%r is not in the list' % user)
+        key, nick, talked = entry
+        index = bisect_left(self._keys, key)
+        while self._users[index] is not user:
+            index += 1
+        del self._keys[index]
+        del self._users[index]
+        if self._by_nick.get(nick) is user:
+            del self._by_nick[nick]
+        if talked is not None:
+            self._remove_talked(user, talked)
+
+    def update(self, user: User) -> None:
+        """Reposition a user after a nick or role change"""
+        self.remove(user)
+        self.add(user)
+
+    def touch(self, user: User) -> None:
+        """Reposition a user after a change of its last_talked time"""
+        entry = self._entries.get(id(user))
+        if entry is None:
+            return
+        key, nick, talked = entry
+        if talked == user.last_talked:
+            return
+        if talked is not None:
+            self._remove_talked(user, talked)
+        self._add_talked(user, user.last_talked)
+        self._entries[id(user)] = (key, nick, user.last_talked)
+
+    def get(self, nick: str) -> Optional[User]:
+        """Get the user with this nick, or None"""
+        return self._by_nick.get(nick)
+
+    def by_last_talked(self) -> List[User]:
+        """
+        Return the users, starting with the last ones who talked, then the
+        ones who never talked (sorted by role and nick)
+        """
+        users = self._talked[::-1]
+        entries = self._entries
+        users.extend(user for user in self._users
+                     if entries[id(user)][2] is None)
+        return users
+
+    def nicks(self) -> List[str]:
+        return [user.nick for user in self._users]
+
+    def clear(self) -> None:
+        self._users.clear()
+        self._keys.clear()
+        self._by_nick.clear()
+        self._entries.clear()
+        self._talked.clear()
+        self._talked_times.clear()
+
+    def sort(self) -> None:
+        """The users are always sorted, kept for compatibility"""
+
+    def _add_talked(self, user: User, time: datetime) -> None:
+        index = bisect_right(self._talked_times, time)
+        self._talked_times.insert(index, time)
+        self._talked.insert(index, user)
+
+    def _remove_talked(self, user: User, time: datetime) -> None:
+        index = bisect_left(self._talked_times, time)
+        while self._talked[index] is not user:
+            index += 1
+        del self._talked_times[index]
+        del self._talked[index]
+
+    @overload
+    def __getitem__(self, index: int) -> User:
+        ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[User]:
+        ...
+
+    def __getitem__(self, index: Union[int, slice]):
+        return self._users[index]
+
+    def __iter__(self) -> Iterator[User]:
+        return iter(self._users)
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def __bool__(self) -> bool:
+        return bool(self._users)
+
+    def __contains__(self, user: object) -> bool:
+        return id(user) in self._entries
+
+    def __repr__(self) -> str:
+        return 'UserList(%r)' % self._users
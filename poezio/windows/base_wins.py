@@ -14,11 +14,12 @@ import logging
 import string
 
 from contextlib import contextmanager
-from typing import Optional, Tuple, TYPE_CHECKING, cast
+from typing import List, Optional, Tuple, TYPE_CHECKING, cast
 
 from poezio.theming import to_curses_attr, read_tuple
 
 from poezio.ui.consts import FORMAT_CHAR
+from poezio.ui.funcs import Run, find_run
 
 log = logging.getLogger(__name__)
 
@@ -165,6 +166,24 @@ class Win:
             next_attr_char = text.find(FORMAT_CHAR)
         self.addstr(text)
 
+    def addstr_runs(self, text: str, runs: List[Run], start: int, end: int,
+                    y: Optional[int] = None, x: Optional[int] = None) -> None:
+        """
+        Write text[start:end] on the window, using the formatting runs
+        already parsed from the text (see parse_runs) instead of parsing
+        the format chars again.
+        """
+        if y is not None and x is not None:
+            self.move(y, x)
+        index = find_run(runs, start)
+        nb_runs = len(runs)
+        while index < nb_runs:
+            run_start, run_end, attr = runs[index]
+            if run_start >= end:
+                break
+            self.addstr(text[max(run_start, start):min(run_end, end)], attr)
+            index += 1
+
     def finish_line(self, color: Optional[Tuple] = None) -> None:
         """
         Write colored spaces until the end of line
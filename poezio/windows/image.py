@@ -5,37 +5,59 @@ Defines a window which contains either an image or a border.
 from __future__ import annotations
 
 import curses
+from functools import lru_cache
 from io import BytesIO
-
-try:
-    from PIL import Image
-    HAS_PIL = True
-except ImportError:
-    HAS_PIL = False
-
-try:
-    import gi
-    gi.require_version('Rsvg', '2.0')
-    from gi.repository import Rsvg
-    import cairo
-    HAS_RSVG = True
-except (ImportError, ValueError, AttributeError):
-    HAS_RSVG = False
+from types import ModuleType
 
 from poezio.windows.base_wins import Win
 from poezio.theming import get_theme, to_curses_attr
 from poezio.xhtml import _parse_css_color
 from poezio.config import config
 
-from typing import Tuple, Optional, Callable
+from typing import Any, Tuple, Optional, Callable, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from PIL import Image
 
 
 MAX_SIZE = 16
 
 
+@lru_cache(maxsize=None)
+def get_pil() -> Optional[ModuleType]:
+    """
+    Import PIL the first time an image is displayed, and return its Image
+    module (or None if it is not available).
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    return Image
+
+
+@lru_cache(maxsize=None)
+def get_rsvg() -> Optional[Tuple[Any, Any]]:
+    """
+    Import Rsvg and cairo the first time a SVG image is displayed (or
+    return None if they are not available).
+    """
+    try:
+        import gi
+        gi.require_version('Rsvg', '2.0')
+        from gi.repository import Rsvg
+        import cairo
+    except (ImportError, ValueError, AttributeError):
+        return None
+    return Rsvg, cairo
+
+
 def render_svg(svg: bytes) -> Optional[Image.Image]:
-    if not HAS_RSVG:
+    rsvg = get_rsvg()
+    Image = get_pil()
+    if rsvg is None or Image is None:
         return None
+    Rsvg, cairo = rsvg
     try:
         handle = Rsvg.Handle.new_from_data(svg)
         dimensions = handle.get_dimensions()
@@ -83,7 +105,8 @@ class ImageWin(Win):
 
     def refresh(self, data: Optional[bytes]) -> None:
         self._win.erase()
-        if data is not None and HAS_PIL:
+        Image = get_pil() if data is not None else None
+        if data is not None and Image is not None:
             image_file = BytesIO(data)
             try:
                 try:
@@ -127,7 +150,8 @@ class ImageWin(Win):
         return width, height
 
     def _display_avatar_half_blocks(self, width: int, height: int) -> None:
-        if self._image is None:
+        Image = get_pil()
+        if self._image is None or Image is None:
             return
         original_height = height
         original_width = width
@@ -150,7 +174,8 @@ class ImageWin(Win):
                 self.addstr('▄', to_curses_attr((bot_color, top_color)))
 
     def _display_avatar_full_blocks(self, width: int, height: int) -> None:
-        if self._image is None:
+        Image = get_pil()
+        if self._image is None or Image is None:
             return
         original_height = height
         original_width = width
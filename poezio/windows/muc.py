@@ -5,7 +5,7 @@ Windows specific to a MUC
 import logging
 import curses
 
-from typing import List, Tuple, Optional
+from typing import List, Optional, Sequence, Tuple
 
 from poezio.windows.base_wins import Win
 
@@ -19,7 +19,7 @@ log = logging.getLogger(__name__)
 CachedUser = Tuple[str, str, Optional[str], str, str]
 
 
-def userlist_to_cache(userlist: List[User]) -> List[CachedUser]:
+def userlist_to_cache(userlist: Sequence[User]) -> List[CachedUser]:
     result = []
     for user in userlist:
         result.append((user.nick, user.status, user.chatstate,
@@ -50,7 +50,7 @@ class UserList(Win):
         self.addstr(y, self.width - 2, '++',
                     to_curses_attr(get_theme().COLOR_MORE_INDICATOR))
 
-    def refresh_if_changed(self, users: List[User]) -> None:
+    def refresh_if_changed(self, users: Sequence[User]) -> None:
         old = self.cache
         new = userlist_to_cache(users[self.pos:self.pos + self.height])
         if len(old) != len(new):
@@ -63,7 +63,7 @@ class UserList(Win):
                 self.refresh(users)
                 return
 
-    def refresh(self, users: List[User]) -> None:
+    def refresh(self, users: Sequence[User]) -> None:
         log.debug('Refresh: %s', self.__class__.__name__)
         if config.getbool('hide_user_list'):
             return  # do not refresh if this win is hidden.
@@ -4,23 +4,26 @@ Can be locked, scrolled, has a separator, etc…
 """
 
 import logging
-from typing import Optional, List, Union
+from itertools import islice
+from typing import Dict, Iterable, Optional, List, Sequence, Tuple, Union
 
 from poezio.windows.base_wins import Win
-from poezio.text_buffer import TextBuffer
+from poezio.text_buffer import RingBuffer, TextBuffer
 
 from poezio.config import config
 from poezio.theming import to_curses_attr, get_theme
 from poezio.ui.types import Message, BaseMessage
-from poezio.ui.render import Line, build_lines, write_pre
+from poezio.ui.render import Line, build_lines, build_many_lines, write_pre
 
 log = logging.getLogger(__name__)
 
 
 class TextWin(Win):
-    __slots__ = ('lines_nb_limit', 'pos', 'built_lines', 'lock', 'lock_buffer',
+    __slots__ = ('lines_nb_limit', 'pos', '_built_lines', 'lock', 'lock_buffer',
                  'separator_after', 'highlights', 'hl_pos',
-                 'nb_of_highlights_after_separator')
+                 'nb_of_highlights_after_separator', '_room', '_stale',
+                 '_first_built', '_line_offset', '_line_numbers',
+                 '_separator_number')
 
     hl_pos: Optional[int]
 
@@ -32,7 +35,8 @@ class TextWin(Win):
         self.pos = 0
         # Each new message is built and kept here.
         # on resize, we rebuild all the messages
-        self.built_lines: List[Union[None, Line]] = []
+        self._built_lines: RingBuffer[Union[None, Line]] = RingBuffer(
+            limit=lines_nb_limit)
 
         self.lock = False
         self.lock_buffer: List[Union[None, Line]] = []
@@ -49,6 +53,195 @@ class TextWin(Win):
         # This is useful to make “go to next highlight“ work after a “move to separator”.
         self.nb_of_highlights_after_separator = 0
 
+        # The buffer the lines were last built from. When the width changes,
+        # the lines are only marked as stale, and rebuilt the next time they
+        # are needed. Only the last messages are built then, the older ones
+        # (before _first_built) are built when scrolling up.
+        self._room: Optional[TextBuffer] = None
+        self._stale = False
+        self._first_built: Optional[BaseMessage] = None
+
+        # Every built line gets a number when it is added, so that the
+        # index of a line is its number minus _line_offset. We keep the
+        # number of the first line of each built message (by id), and of
+        # the separator line, and adjust them when lines are inserted or
+        # removed: finding the line of a message, a highlight or the
+        # separator is then a dict lookup instead of a scan of the lines.
+        self._line_offset = 0
+        self._line_numbers: Dict[int, int] = {}
+        self._separator_number: Optional[int] = None
+
+    @property
+    def built_lines(self) -> RingBuffer[Union[None, Line]]:
+        if self._stale and self._room is not None:
+            self.rebuild_everything(self._room)
+        return self._built_lines
+
+    @built_lines.setter
+    def built_lines(self, lines: Iterable[Union[None, Line]]) -> None:
+        self._built_lines = RingBuffer(lines, limit=self.lines_nb_limit)
+        self._number_all_lines()
+
+    def message_line(self, message: BaseMessage) -> Optional[int]:
+        """
+        Return the index of the first built line of a message, or None if
+        it has no built line.
+        """
+        lines = self.built_lines
+        for _ in range(2):
+            number = self._line_numbers.get(id(message))
+            if number is None:
+                return None
+            index = number - self._line_offset
+            if 0 <= index < len(lines):
+                line = lines[index]
+                previous = lines[index - 1] if index > 0 else None
+                if line is not None and line.msg is message and (
+                        previous is None or previous.msg is not message):
+                    return index
+            log.debug('Line numbers out of sync, numbering them again')
+            self._number_all_lines()
+        return None
+
+    def _separator_index(self) -> Optional[int]:
+        """Return the index of the separator line, or None"""
+        lines = self.built_lines
+        number = self._separator_number
+        if number is None:
+            return None
+        index = number - self._line_offset
+        if 0 <= index < len(lines) and lines[index] is None:
+            return index
+        log.debug('Line numbers out of sync, numbering them again')
+        self._number_all_lines()
+        if self._separator_number is None:
+            return None
+        return self._separator_number - self._line_offset
+
+    def _number_all_lines(self) -> None:
+        self._line_offset = 0
+        self._line_numbers = {}
+        self._separator_number = None
+        self._number_lines(self._built_lines, 0)
+
+    def _number_lines(self, lines: Iterable[Union[None, Line]],
+                      index: int) -> None:
+        """Record the numbers of the lines located at the given index"""
+        numbers = self._line_numbers
+        number = self._line_offset + index
+        previous: Optional[BaseMessage] = None
+        for line in lines:
+            if line is None:
+                self._separator_number = number
+                previous = None
+            elif line.msg is not previous:
+                previous = line.msg
+                numbers[id(previous)] = number
+            number += 1
+
+    def _renumber(self, start: int, end: int, old_offset: int,
+                  delta: int) -> None:
+        """
+        Add delta to the numbers of the lines between start and end, which
+        were numbered from old_offset.
+        """
+        numbers = self._line_numbers
+        lines = islice(self._built_lines, start, end)
+        previous: Optional[BaseMessage] = None
+        for number, line in enumerate(lines, old_offset + start):
+            if line is None:
+                if self._separator_number == number:
+                    self._separator_number = number + delta
+                previous = None
+            elif line.msg is not previous:
+                previous = line.msg
+                if numbers.get(id(previous)) == number:
+                    numbers[id(previous)] = number + delta
+
+    def _lines_inserted(self, index: int,
+                        lines: Sequence[Union[None, Line]]) -> None:
+        """Update the line numbers after lines were inserted at index"""
+        count = len(lines)
+        size = len(self._built_lines)
+        if count == 0:
+            return
+        if index == 0:
+            self._line_offset -= count
+        elif index + count < size:
+            # Move whichever side of the insertion is the smallest
+            if index < size - index - count:
+                self._renumber(0, index, self._line_offset, -count)
+                self._line_offset -= count
+            else:
+                self._renumber(index + count, size,
+                               self._line_offset - count, count)
+        self._number_lines(lines, index)
+
+    def _lines_removed(self, index: int,
+                       lines: List[Union[None, Line]]) -> None:
+        """Update the line numbers after lines were removed at index"""
+        numbers = self._line_numbers
+        count = len(lines)
+        number = self._line_offset + index
+        for line in lines:
+            if line is None:
+                if self._separator_number == number:
+                    self._separator_number = None
+            elif numbers.get(id(line.msg)) == number:
+                del numbers[id(line.msg)]
+            number += 1
+        size = len(self._built_lines)
+        if index == 0:
+            self._line_offset += count
+        elif index < size:
+            if index < size - index:
+                self._renumber(0, index, self._line_offset, count)
+                self._line_offset += count
+            else:
+                self._renumber(index, size, self._line_offset + count,
+                               -count)
+
+    def _evict(self) -> int:
+        """
+        Remove the oldest lines above the limit, with their highlights, and
+        the remaining lines of a message whose first lines are removed.
+        Return the number of removed lines.
+        """
+        lines = self._built_lines
+        count = len(lines) - self.lines_nb_limit
+        if count <= 0:
+            return 0
+        removed = lines[:count]
+        lines.evict()
+        last = removed[-1]
+        while last is not None and lines:
+            line = lines[0]
+            if line is None or line.msg is not last.msg:
+                break
+            removed.append(lines.pop(0))
+            count += 1
+        separator_built = self._separator_number is not None
+        self._lines_removed(0, removed)
+        gone = {id(line) for line in removed if line is not None}
+        nb_highlights = 0
+        for line in self.highlights:
+            if id(line) not in gone:
+                break
+            nb_highlights += 1
+        if nb_highlights:
+            before_separator = (len(self.highlights) -
+                                self.nb_of_highlights_after_separator)
+            del self.highlights[:nb_highlights]
+            if nb_highlights > before_separator:
+                self.nb_of_highlights_after_separator -= (
+                    nb_highlights - before_separator)
+            if self.hl_pos is not None:
+                self.hl_pos = max(self.hl_pos - nb_highlights, -1)
+        if separator_built and self._separator_number is None:
+            # All the remaining highlights are after the evicted separator
+            self.nb_of_highlights_after_separator = len(self.highlights)
+        return count
+
     def toggle_lock(self) -> bool:
         if self.lock:
             self.release_lock()
@@ -60,13 +253,18 @@ class TextWin(Win):
         self.lock = True
 
     def release_lock(self) -> None:
+        index = len(self.built_lines)
         for line in self.lock_buffer:
             self.built_lines.append(line)
+        self._lines_inserted(index, self.lock_buffer)
         self.lock = False
 
     def scroll_up(self, dist: int = 14) -> bool:
         pos = self.pos
         self.pos += dist
+        missing = self.pos + 2 * self.height - len(self.built_lines)
+        if missing > 0 and self._first_built is not None:
+            self.build_older_lines(missing)
         if self.pos + self.height > len(self.built_lines):
             self.pos = len(self.built_lines) - self.height
             if self.pos < 0:
@@ -90,13 +288,18 @@ class TextWin(Win):
         Return the number of lines that are built for the given
         message.
         """
+        if self._stale:
+            # It will be built with the others
+            return 0
         lines = build_lines(
             message, self.width, timestamp=timestamp, nick_size=nick_size
         )
         if self.lock:
             self.lock_buffer.extend(lines)
         else:
+            index = len(self.built_lines)
             self.built_lines.extend(lines)
+            self._lines_inserted(index, lines)
         if not lines or not lines[0]:
             return 0
         if isinstance(message, Message) and message.highlight:
@@ -104,9 +307,10 @@ class TextWin(Win):
             self.nb_of_highlights_after_separator += 1
             log.debug("Number of highlights after separator is now %s",
                       self.nb_of_highlights_after_separator)
-        if clean:
-            while len(self.built_lines) > self.lines_nb_limit:
-                self.built_lines.pop(0)
+        if clean and self._evict():
+            # The oldest lines are gone, the older messages can not be
+            # built above them anymore.
+            self._first_built = None
         return len(lines)
 
     def refresh(self) -> None:
@@ -130,9 +334,8 @@ class TextWin(Win):
                 elif y == 0:
                     offset = msg.compute_offset(with_timestamps,
                                                 nick_size)
-                self.write_text(
-                    y, offset,
-                    line.prepend + line.msg.txt[line.start_pos:line.end_pos])
+                self.addstr_runs(msg.txt, msg.runs, line.start_pos,
+                                 line.end_pos, y, offset)
             else:
                 self.write_line_separator(y)
             if y != self.height - 1:
@@ -155,39 +358,220 @@ class TextWin(Win):
             old_width = None
         self._resize(height, width, y, x)
         if room and (self.width != old_width or force):
-            self.rebuild_everything(room)
+            # Rebuilt lazily, on the next refresh or access to the lines
+            self._room = room
+            self._stale = True
+        else:
+            self._fix_pos()
 
-        # reposition the scrolling after resize
-        # (see #2450)
-        buf_size = len(self.built_lines)
+    def _fix_pos(self) -> None:
+        """
+        Reposition the scrolling after resize (see #2450)
+        """
+        buf_size = len(self._built_lines)
         if buf_size - self.pos < self.height:
             self.pos = buf_size - self.height
             if self.pos < 0:
                 self.pos = 0
 
     def rebuild_everything(self, room: TextBuffer) -> None:
-        self.built_lines = []
+        """
+        Build the lines of the last messages of the room, enough to fill
+        the view (at its current scrolling position) and a margin above it.
+        The older messages are built when scrolling up.
+        """
+        self._room = room
+        self._stale = False
+        self._first_built = None
+        self._built_lines.clear()
+        nb_lines = self.pos + 3 * max(self.height, 1)
+        chunks, first_built = self._build_backwards(
+            reversed(room.messages), nb_lines)
+        lines, highlights, after_separator = self._assemble(chunks)
+        self._built_lines.extend(lines)
+        self._number_all_lines()
+        self.highlights = highlights
+        self.hl_pos = None
+        if after_separator is None:
+            after_separator = len(highlights)
+        self.nb_of_highlights_after_separator = after_separator
+        if self._evict():
+            first_built = None
+        self._first_built = first_built
+        self._fix_pos()
+
+    def build_older_lines(self, nb_lines: Optional[int] = None) -> None:
+        """
+        Build (at least) nb_lines lines from the messages older than the
+        ones already built, or all of them if nb_lines is None.
+        """
+        if self._stale and self._room is not None:
+            self.rebuild_everything(self._room)
+        room, first = self._room, self._first_built
+        if room is None or first is None:
+            return
+        self._first_built = None
+        available = self.lines_nb_limit - len(self._built_lines)
+        if available <= 0:
+            return
+        if nb_lines is None or nb_lines > available:
+            nb_lines = available
+        try:
+            index = room.messages.index(first)
+        except ValueError:
+            return
+        chunks, first_built = self._build_backwards(
+            reversed(room.messages[:index]), nb_lines)
+        separator_built = self._separator_number is not None
+        lines, highlights, after_separator = self._assemble(chunks)
+        self._built_lines.insert_many(0, lines)
+        self._lines_inserted(0, lines)
+        self.highlights[0:0] = highlights
+        if self.hl_pos is not None:
+            self.hl_pos += len(highlights)
+        if after_separator is not None:
+            self.nb_of_highlights_after_separator += after_separator
+        elif not separator_built:
+            self.nb_of_highlights_after_separator += len(highlights)
+        if len(lines) >= available:
+            self._evict()
+        else:
+            self._first_built = first_built
+
+    def _build_backwards(
+            self, messages: Iterable[BaseMessage], nb_lines: int
+    ) -> Tuple[List[Tuple[BaseMessage, Sequence[Union[None, Line]]]],
+               Optional[BaseMessage]]:
+        """
+        Build messages, from the newest to the oldest, until there are
+        nb_lines lines.
+
+        Returns the built messages and their lines (from the oldest to the
+        newest), and the oldest built message if some were left unbuilt.
+        """
         with_timestamps = config.getbool('show_timestamps')
         nick_size = config.getint('max_nick_length')
-        for message in room.messages:
-            self.build_new_message(
-                message,
-                clean=False,
-                timestamp=with_timestamps,
-                nick_size=nick_size)
+        chunks: List[Tuple[BaseMessage, Sequence[Union[None, Line]]]] = []
+        count = 0
+        iterator = iter(messages)
+        while True:
+            # Most messages take one line, build them by batches of the
+            # number of lines still needed
+            batch = list(islice(iterator, max(nb_lines - count, 1)))
+            if not batch:
+                first_built = None
+                break
+            built = build_many_lines(
+                batch, self.width, timestamp=with_timestamps,
+                nick_size=nick_size
+            )
+            for message, lines in zip(batch, built):
+                chunks.append((message, lines))
+                count += len(lines)
+            if count >= nb_lines:
+                first_built = chunks[-1][0]
+                if next(iterator, None) is None:
+                    first_built = None
+                break
+        chunks.reverse()
+        return chunks, first_built
+
+    def _assemble(
+            self, chunks: List[Tuple[BaseMessage, Sequence[Union[None, Line]]]]
+    ) -> Tuple[List[Union[None, Line]], List[Line], Optional[int]]:
+        """
+        Join the lines of built messages, with the separator, and return
+        them with the highlighted lines, and the number of highlights after
+        the separator (None if it is not among them).
+        """
+        lines: List[Union[None, Line]] = []
+        highlights: List[Line] = []
+        after_separator: Optional[int] = None
+        for message, built in chunks:
+            lines.extend(built)
+            if built and built[0] and isinstance(message, Message) \
+                    and message.highlight:
+                highlights.append(built[0])
+                if after_separator is not None:
+                    after_separator += 1
             if self.separator_after is message:
-                self.built_lines.append(None)
-        while len(self.built_lines) > self.lines_nb_limit:
-            self.built_lines.pop(0)
+                lines.append(None)
+                after_separator = 0
+        return lines, highlights, after_separator
+
+    def add_history_messages(self, messages: List[BaseMessage],
+                             room: TextBuffer, index: int) -> None:
+        """
+        Build the lines of messages that were just inserted in the room at
+        the given index, and splice them in the built lines, instead of
+        rebuilding everything.
+        """
+        if self._stale:
+            return
+        before = {id(message) for message in room.messages[:index]}
+        if self._first_built is not None and \
+                id(self._first_built) not in before:
+            # Inserted above the built lines, they will be built on scroll
+            return
+        with_timestamps = config.getbool('show_timestamps')
+        nick_size = config.getint('max_nick_length')
+        lines: List[Union[None, Line]] = []
+        highlights: List[Line] = []
+        all_built = build_many_lines(
+            messages, self.width, timestamp=with_timestamps,
+            nick_size=nick_size
+        )
+        for message, built in zip(messages, all_built):
+            if (built and built[0] and isinstance(message, Message)
+                    and message.highlight):
+                highlights.append(built[0])
+            lines.extend(built)
+        if not lines:
+            return
+
+        # The new lines go right before the first line of the messages
+        # located after the insertion point (the separator stays above
+        # them, as it would after a rebuild).
+        position = 0
+        if before:
+            position = len(self.built_lines)
+            for message in islice(room.messages, index + len(messages), None):
+                line_index = self.message_line(message)
+                if line_index is not None:
+                    position = line_index
+                    break
+
+        # Keep the current view in place if the lines are inserted below it
+        if self.pos and position >= len(self.built_lines) - self.pos:
+            self.pos += len(lines)
+        self.built_lines.insert_many(position, lines)
+        self._lines_inserted(position, lines)
+
+        if highlights:
+            hl_index = 0
+            for hl_index, line in enumerate(self.highlights):
+                if id(line.msg) not in before:
+                    break
+            else:
+                hl_index = len(self.highlights)
+            self.highlights[hl_index:hl_index] = highlights
+            if self.hl_pos is not None and self.hl_pos >= hl_index:
+                self.hl_pos += len(highlights)
+            if (self.separator_after is not None
+                    and id(self.separator_after) in before):
+                self.nb_of_highlights_after_separator += len(highlights)
+        self._evict()
 
     def remove_line_separator(self) -> None:
         """
         Remove the line separator
         """
         log.debug('remove_line_separator')
-        if None in self.built_lines:
-            self.built_lines.remove(None)
-            self.separator_after = None
+        index = self._separator_index()
+        if index is not None:
+            del self.built_lines[index]
+            self._lines_removed(index, [None])
+        self.separator_after = None
 
     def add_line_separator(self, room: TextBuffer = None) -> None:
         """
@@ -195,8 +579,9 @@ class TextWin(Win):
         room is a textbuffer that is needed to get the previous message
         (in case of resize)
         """
-        if None not in self.built_lines:
+        if self._separator_index() is None:
             self.built_lines.append(None)
+            self._lines_inserted(len(self.built_lines) - 1, [None])
             self.nb_of_highlights_after_separator = 0
             log.debug("Resetting number of highlights after separator")
             if room and room.messages:
@@ -210,8 +595,21 @@ class TextWin(Win):
 
     def __del__(self) -> None:
         log.debug('** TextWin: deleting %s built lines',
-                  (len(self.built_lines)))
-        del self.built_lines
+                  (len(self._built_lines)))
+        del self._built_lines
+
+    def _highlight_line(self, hl_pos: int) -> Optional[int]:
+        """Return the index of a highlight line, or None if it is gone"""
+        line = self.highlights[hl_pos]
+        index = self.message_line(line.msg)
+        if index is not None and self._built_lines[index] is line:
+            return index
+        return None
+
+    def _scroll_to_line(self, index: int) -> None:
+        self.pos = len(self.built_lines) - index - self.height
+        if self.pos < 0 or self.pos >= len(self.built_lines):
+            self.pos = 0
 
     def next_highlight(self) -> None:
         """
@@ -221,34 +619,22 @@ class TextWin(Win):
         highlights, scroll to the end of the buffer.
         """
         log.debug('Going to the next highlight…')
-        if (not self.highlights or self.hl_pos is None
-                or self.hl_pos >= len(self.highlights) - 1):
-            self.hl_pos = None
-            self.pos = 0
-            return
-        hl_size = len(self.highlights) - 1
-        if self.hl_pos is not None and self.hl_pos < hl_size:
+        self.build_older_lines()
+        while True:
+            if (not self.highlights or self.hl_pos is None
+                    or self.hl_pos >= len(self.highlights) - 1):
+                self.hl_pos = None
+                self.pos = 0
+                return
             self.hl_pos += 1
-        else:
-            self.hl_pos = hl_size
-        log.debug("self.hl_pos = %s", self.hl_pos)
-        hl = self.highlights[self.hl_pos]
-        pos = None
-        while not pos:
-            try:
-                pos = self.built_lines.index(hl)
-            except ValueError:
-                if isinstance(self.hl_pos, int):
-                    del self.highlights[self.hl_pos]
-                if not self.highlights:
-                    self.hl_pos = None
-                    self.pos = 0
-                    return
-                self.hl_pos = 0
-                hl = self.highlights[0]
-        self.pos = len(self.built_lines) - pos - self.height
-        if self.pos < 0 or self.pos >= len(self.built_lines):
-            self.pos = 0
+            log.debug("self.hl_pos = %s", self.hl_pos)
+            index = self._highlight_line(self.hl_pos)
+            if index is not None:
+                break
+            # The line is not there anymore (corrected message)
+            del self.highlights[self.hl_pos]
+            self.hl_pos -= 1
+        self._scroll_to_line(index)
 
     def previous_highlight(self) -> None:
         """
@@ -258,41 +644,33 @@ class TextWin(Win):
         highlights, scroll to the end of the buffer.
         """
         log.debug('Going to the previous highlight…')
-        if not self.highlights or self.hl_pos and self.hl_pos <= 0:
-            self.hl_pos = None
-            self.pos = 0
-            return
-        if self.hl_pos is None:
-            self.hl_pos = len(self.highlights) - 1
-        else:
-            self.hl_pos -= 1
-        log.debug("self.hl_pos = %s", self.hl_pos)
-        hl = self.highlights[self.hl_pos]
-        pos = None
-        while not pos:
-            try:
-                pos = self.built_lines.index(hl)
-            except ValueError:
-                if self.hl_pos is not None:
-                    del self.highlights[self.hl_pos]
-                if not self.highlights:
-                    self.hl_pos = None
-                    self.pos = 0
-                    return
-                self.hl_pos = 0
-                hl = self.highlights[0]
-        self.pos = len(self.built_lines) - pos - self.height
-        if self.pos < 0 or self.pos >= len(self.built_lines):
-            self.pos = 0
+        self.build_older_lines()
+        while True:
+            if not self.highlights or self.hl_pos and self.hl_pos <= 0:
+                self.hl_pos = None
+                self.pos = 0
+                return
+            if self.hl_pos is None:
+                self.hl_pos = len(self.highlights) - 1
+            else:
+                self.hl_pos -= 1
+            log.debug("self.hl_pos = %s", self.hl_pos)
+            index = self._highlight_line(self.hl_pos)
+            if index is not None:
+                break
+            # The line is not there anymore (corrected message)
+            del self.highlights[self.hl_pos]
+        self._scroll_to_line(index)
 
     def scroll_to_separator(self) -> None:
         """
         Scroll to the first message after the separator.  If no
         separator is present, scroll to the first message of the window
         """
-        if None in self.built_lines:
-            self.pos = len(self.built_lines) - self.built_lines.index(
-                None) - self.height + 1
+        self.build_older_lines()
+        separator = self._separator_index()
+        if separator is not None:
+            self.pos = len(self.built_lines) - separator - self.height + 1
             if self.pos < 0:
                 self.pos = 0
         else:
@@ -302,8 +680,9 @@ class TextWin(Win):
         # Make “next highlight” work afterwards. This makes it easy to
         # review all the highlights since the separator was placed, in
         # the correct order.
-        self.hl_pos = len(
-            self.highlights) - self.nb_of_highlights_after_separator - 1
+        self.hl_pos = max(
+            len(self.highlights) - self.nb_of_highlights_after_separator - 1,
+            -1)
         log.debug("self.hl_pos = %s", self.hl_pos)
 
     def modify_message(self, old_id, message) -> None:
@@ -313,24 +692,60 @@ class TextWin(Win):
         """
         with_timestamps = config.getbool('show_timestamps')
         nick_size = config.getint('max_nick_length')
-        for i in range(len(self.built_lines) - 1, -1, -1):
-            current = self.built_lines[i]
-            if current is not None and current.msg.identifier == old_id:
-                index = i
-                while (
-                        index >= 0
-                        and current is not None
-                        and current.msg.identifier == old_id
-                        ):
-                    self.built_lines.pop(index)
-                    index -= 1
-                    if index >= 0:
-                        current = self.built_lines[index]
-                index += 1
-                lines = build_lines(
-                    message, self.width, timestamp=with_timestamps, nick_size=nick_size
-                )
-                for line in lines:
-                    self.built_lines.insert(index, line)
-                    index += 1
+        lines = self.built_lines
+        # The message is either modified in place (acks), or a correction
+        # of the one that was built
+        index = self.message_line(message)
+        old_message = getattr(message, 'old_message', None)
+        if index is None and old_message is not None:
+            index = self.message_line(old_message)
+        if index is None:
+            for i in range(len(lines) - 1, -1, -1):
+                current = lines[i]
+                if current is not None and current.msg.identifier == old_id:
+                    index = self.message_line(current.msg)
+                    break
+        if index is None:
+            return
+        first = lines[index]
+        assert first is not None
+        old = first.msg
+        end = index + 1
+        while end < len(lines):
+            line = lines[end]
+            if line is None or line.msg is not old:
                 break
+            end += 1
+        removed = lines[index:end]
+        for _ in range(end - index):
+            del lines[index]
+        self._lines_removed(index, removed)
+        new_lines = build_lines(
+            message, self.width, timestamp=with_timestamps, nick_size=nick_size
+        )
+        lines.insert_many(index, new_lines)
+        self._lines_inserted(index, new_lines)
+        new_highlight = None
+        if new_lines and new_lines[0] is not None and \
+                isinstance(message, Message) and message.highlight:
+            new_highlight = new_lines[0]
+        self._replace_highlight(removed[0], new_highlight)
+
+    def _replace_highlight(self, old: Optional[Line],
+                           new: Optional[Line]) -> None:
+        """Replace (or remove) the highlight of a rebuilt message"""
+        # Corrections and acks are usually about the last messages
+        for hl_index in range(len(self.highlights) - 1, -1, -1):
+            if self.highlights[hl_index] is old:
+                break
+        else:
+            return
+        if new is not None:
+            self.highlights[hl_index] = new
+            return
+        if hl_index >= len(self.highlights) - \
+                self.nb_of_highlights_after_separator:
+            self.nb_of_highlights_after_separator -= 1
+        del self.highlights[hl_index]
+        if self.hl_pos is not None and self.hl_pos >= hl_index:
+            self.hl_pos -= 1
@@ -0,0 +1,242 @@
+"""
+On-disk capture of the stanzas of the XML tab, used when xml_capture is
+set, to keep hours of traffic without keeping it in memory.
+
+The stanzas are appended to a file, as records made of a header (length of
+the stanza, time, direction) followed by the serialized stanza in UTF-8.
+When the file reaches half of xml_capture_size, it is renamed to
+``<name>.1`` (replacing the previous one) and a new file is started, so
+that the capture never uses more than xml_capture_size, and the oldest
+traffic is dropped.
+
+Only the offsets of the records are kept in memory; the files are
+memory-mapped to read the records when the XML tab needs them, and
+/dump copies the stanzas from there.
+"""
+
+import logging
+import mmap
+import os
+import struct
+from array import array
+from datetime import datetime
+from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator, List, Optional, Tuple
+
+from poezio import xdg
+from poezio.config import config
+
+log = logging.getLogger(__name__)
+
+# length of the stanza, time, incoming
+HEADER = struct.Struct('<IdB')
+
+# (time, incoming, serialized stanza) of a record
+Record = Tuple[float, bool, bytes]
+
+
+def get_capture_path() -> Path:
+    """The file used to capture the stanzas"""
+    path = config.getstr('xml_capture_file')
+    if path:
+        return Path(os.path.expandvars(os.path.expanduser(path)))
+    return xdg.CACHE_HOME / 'xml_capture'
+
+
+class _Segment:
+    """One of the capture files, and the offsets of its records"""
+    __slots__ = ('path', 'first', 'offsets', 'size', '_map', '_map_size')
+
+    def __init__(self, path: Path, first: int) -> None:
+        self.path = path
+        # id of the first record of the file
+        self.first = first
+        self.offsets = array('Q')
+        self.size = 0
+        self._map: Optional[mmap.mmap] = None
+        self._map_size = 0
+
+    def scan(self) -> None:
+        """Find the records of an existing file"""
+        size = self.path.stat().st_size
+        pos = 0
+        if size:
+            with self.path.open('rb') as fd, \
+                    mmap.mmap(fd.fileno(), size,
+                              access=mmap.ACCESS_READ) as data:
+                while pos + HEADER.size <= size:
+                    length = HEADER.unpack_from(data, pos)[0]
+                    end = pos + HEADER.size + length
+                    if end > size:
+                        break
+                    self.offsets.append(pos)
+                    pos = end
+        if pos < size:
+            log.debug('Truncating the incomplete record at the end of %s',
+                      self.path)
+            os.truncate(self.path, pos)
+        self.size = pos
+
+    def view(self) -> mmap.mmap:
+        """Map the file, as long as it is"""
+        if self._map is None or self._map_size != self.size:
+            self.close()
+            with self.path.open('rb') as fd:
+                self._map = mmap.mmap(fd.fileno(), self.size,
+                                      access=mmap.ACCESS_READ)
+            self._map_size = self.size
+        return self._map
+
+    def read(self, index: int) -> Record:
+        data = self.view()
+        pos = self.offsets[index]
+        length, time, incoming = HEADER.unpack_from(data, pos)
+        start = pos + HEADER.size
+        return time, bool(incoming), data[start:start + length]
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+
+class XMLCapture:
+    """
+    The capture files, and the records they contain, identified by
+    increasing numbers.
+    """
+    path: Path
+    max_size: int
+
+    def __init__(self, path: Path, max_size: int) -> None:
+        self.path = path
+        self.max_size = max_size
+        self._segments: List[_Segment] = []
+        self._fd: Optional[BinaryIO] = None
+        self.open()
+
+    @property
+    def _previous_path(self) -> Path:
+        return self.path.with_name(self.path.name + '.1')
+
+    def open(self) -> None:
+        """Open the capture, with the records already in the files"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        first = 0
+        for path in (self._previous_path, self.path):
+            if path.exists():
+                segment = _Segment(path, first)
+                segment.scan()
+                first += len(segment.offsets)
+                self._segments.append(segment)
+        if not self._segments or self._segments[-1].path != self.path:
+            self._segments.append(_Segment(self.path, first))
+        self._fd = self.path.open('ab')
+
+    def close(self) -> None:
+        """Close the files"""
+        for segment in self._segments:
+            segment.close()
+        if self._fd is not None:
+            self._fd.close()
+            self._fd = None
+
+    @property
+    def first_id(self) -> int:
+        """The id of the oldest record"""
+        return self._segments[0].first
+
+    @property
+    def next_id(self) -> int:
+        """The id of the next record"""
+        current = self._segments[-1]
+        return current.first + len(current.offsets)
+
+    def __len__(self) -> int:
+        return self.next_id - self.first_id
+
+    def append(self, data: bytes, incoming: bool, time: float) -> int:
+        """
+        Write a stanza at the end of the capture.
+
+        :returns: the id of its record
+        """
+        assert self._fd is not None
+        current = self._segments[-1]
+        size = HEADER.size + len(data)
+        if current.size and current.size + size > self.max_size // 2:
+            self._rotate()
+            current = self._segments[-1]
+        self._fd.write(HEADER.pack(len(data), time, incoming))
+        self._fd.write(data)
+        self._fd.flush()
+        current.offsets.append(current.size)
+        current.size += size
+        return current.first + len(current.offsets) - 1
+
+    def _rotate(self) -> None:
+        """Keep the current file as the previous one, and start a new one"""
+        assert self._fd is not None
+        self._fd.close()
+        for segment in self._segments:
+            segment.close()
+        current = self._segments[-1]
+        os.replace(current.path, self._previous_path)
+        current.path = self._previous_path
+        self._segments = [
+            current,
+            _Segment(self.path, current.first + len(current.offsets))
+        ]
+        self._fd = self.path.open('wb')
+        log.debug('Rotated the XML capture %s', self.path)
+
+    def _locate(self, record_id: int) -> Optional[Tuple[_Segment, int]]:
+        for segment in reversed(self._segments):
+            if record_id >= segment.first:
+                index = record_id - segment.first
+                if index < len(segment.offsets):
+                    return segment, index
+                return None
+        return None
+
+    def read(self, record_id: int) -> Optional[Record]:
+        """Read a record, or None if it was dropped"""
+        location = self._locate(record_id)
+        if location is None:
+            return None
+        segment, index = location
+        return segment.read(index)
+
+    def read_range(self, start: int,
+                   end: int) -> Iterator[Tuple[int, Record]]:
+        """Read the records between two ids (end excluded), as
+        (id, record) tuples."""
+        for record_id in range(max(start, self.first_id),
+                               min(end, self.next_id)):
+            record = self.read(record_id)
+            if record is not None:
+                yield record_id, record
+
+    def dump(self, fd: BinaryIO,
+             record_ids: Optional[Iterable[int]] = None) -> int:
+        """
+        Write some records (or all of them) to a file, one per line,
+        prefixed with their time and direction.
+
+        :returns: the number of records written
+        """
+        if record_ids is None:
+            record_ids = range(self.first_id, self.next_id)
+        count = 0
+        for record_id in record_ids:
+            record = self.read(record_id)
+            if record is None:
+                continue
+            time, incoming, data = record
+            fd.write(('%s %s ' % (
+                datetime.fromtimestamp(time).strftime('%H:%M:%S'),
+                'IN' if incoming else 'OUT')).encode())
+            fd.write(data)
+            fd.write(b'\n')
+            count += 1
+        return count
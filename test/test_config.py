@@ -111,4 +111,12 @@ class TestTabNames(object):
         assert config_obj.get_by_tabname('test2', JID('toto@toto.com'), fallback_server=False) == 'true'
         assert config_obj.get_by_tabname('test_int', JID('toto@toto.com'), fallback=False) == ''
 
-
+    def test_get_tabname_cache(self, config_obj):
+        jid = JID('cache@toto.com')
+        assert config_obj.get_by_tabname('test3', jid, default=False) is False
+        config_obj.set('test3', 'true', section='@toto.com')
+        assert config_obj.get_by_tabname('test3', jid, default=False) is True
+        config_obj.set_and_save('test3', 'false', section='cache@toto.com')
+        assert config_obj.get_by_tabname('test3', jid, default=False) is False
+        config_obj.remove_and_save('test3', section='cache@toto.com')
+        assert config_obj.get_by_tabname('test3', jid, default=False) is True
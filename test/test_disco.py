@@ -0,0 +1,89 @@
+"""
+Test the DiscoCache
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from slixmpp.exceptions import IqTimeout
+
+from poezio.core import disco
+from poezio.core.disco import DiscoCache
+
+
+class ConfigShim:
+    def __init__(self, ttl):
+        self.ttl = ttl
+
+    def getfloat(self, name, *args, **kwargs):
+        return self.ttl
+
+
+class FakeDisco:
+    def __init__(self):
+        self.queries = []
+        self.fail = False
+
+    async def get_info(self, jid, timeout=None):
+        jid = str(jid)
+        self.queries.append(jid)
+        await asyncio.sleep(0)
+        if self.fail:
+            raise IqTimeout(None)
+        features = {'urn:xmpp:mam:2'} if jid.startswith('room') else set()
+        return {'disco_info': SimpleNamespace(
+            get_features=lambda: features,
+            get_identities=lambda: {('conference', 'text', None, None)},
+        )}
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.setattr(disco, 'config', ConfigShim(60))
+    xmpp = SimpleNamespace(plugin={'xep_0030': FakeDisco()})
+    return DiscoCache(SimpleNamespace(xmpp=xmpp))
+
+
+def test_disco_cache(cache, monkeypatch):
+    queries = cache.core.xmpp.plugin['xep_0030'].queries
+    now = [100.0]
+    monkeypatch.setattr(disco, 'monotonic', lambda: now[0])
+
+    async def run():
+        # concurrent requests share the query
+        results = await asyncio.gather(
+            cache.has_feature('room@muc', 'urn:xmpp:mam:2'),
+            cache.has_feature('room@muc', 'urn:xmpp:mam:2'),
+            cache.has_feature('user@server', 'urn:xmpp:mam:2'),
+        )
+        assert results == [True, True, False]
+        assert queries == ['room@muc', 'user@server']
+        info = await cache.get_info('room@muc')
+        assert info.identities == {('conference', 'text', None, None)}
+        assert queries == ['room@muc', 'user@server']
+        assert (cache.hits, cache.misses) == (2, 2)
+
+        # expiration
+        now[0] += 61
+        await cache.get_features('room@muc')
+        assert queries[-1] == 'room@muc' and len(queries) == 3
+
+        # invalidation, including while a query is in progress
+        cache.invalidate('room@muc')
+        pending = asyncio.ensure_future(cache.get_features('user@server'))
+        await asyncio.sleep(0)
+        cache.invalidate()
+        await pending
+        await cache.get_features('room@muc')
+        await cache.get_features('user@server')
+        assert len(queries) == 6
+        assert cache.stats() == '2 hits, 6 misses, 2 entities cached'
+
+        # errors are not cached
+        cache.core.xmpp.plugin['xep_0030'].fail = True
+        for _ in range(2):
+            with pytest.raises(IqTimeout):
+                await cache.get_info('other@server')
+        assert len(queries) == 8
+
+    asyncio.run(run())
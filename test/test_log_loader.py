@@ -0,0 +1,107 @@
+"""
+Test the LogLoader and the MAMSyncScheduler
+"""
+import asyncio
+from types import SimpleNamespace
+
+# log_loader can only be imported through the tabs
+from poezio import tabs, log_loader
+from poezio.log_loader import MAMSyncScheduler
+
+
+class ConfigShim:
+    def __init__(self, concurrency):
+        self.concurrency = concurrency
+
+    def getint(self, name, *args, **kwargs):
+        return self.concurrency
+
+
+class FakeFiller:
+    def __init__(self, scheduler, name, priority=-1):
+        self.tab = SimpleNamespace(jid=name, priority=priority)
+        self.scheduler = scheduler
+        self.started = False
+
+    def start(self):
+        self.started = True
+
+    def end(self):
+        self.scheduler.finished(self)
+
+
+def test_mam_sync_scheduler(monkeypatch):
+    monkeypatch.setattr(log_loader, 'config', ConfigShim(2))
+    infos = []
+    core = SimpleNamespace(
+        tabs=SimpleNamespace(current_tab=None),
+        information=lambda msg, typ: infos.append(msg),
+    )
+    scheduler = MAMSyncScheduler(core)
+    fillers = {}
+    for name, priority in (('a', -1), ('b', -1), ('c', 0.8), ('d', -1),
+                           ('e', 2), ('f', 1)):
+        fillers[name] = FakeFiller(scheduler, name, priority)
+        scheduler.submit(fillers[name])
+    core.tabs.current_tab = fillers['d'].tab
+
+    def started():
+        return sorted(name for name, filler in fillers.items()
+                      if filler.started)
+
+    assert started() == ['a', 'b']
+    assert scheduler.progress() == '0/6 done, 2 running, 4 waiting'
+    # the current tab first, then by tab state
+    fillers['b'].end()
+    assert started() == ['a', 'b', 'd']
+    fillers['b'].end()
+    assert scheduler.finished_count == 1
+    fillers['a'].end()
+    assert started() == ['a', 'b', 'd', 'e']
+    fillers['d'].end()
+    assert started() == ['a', 'b', 'd', 'e', 'f']
+    # cancelled before being started
+    fillers['c'].end()
+    assert not fillers['c'].started
+    fillers['e'].end()
+    assert infos == []
+    fillers['f'].end()
+    assert scheduler.progress() == '6/6 done, 0 running, 0 waiting'
+    assert len(infos) == 1
+    assert infos[0].startswith('History of 6 conversations synced in ')
+
+    # a new batch
+    filler = FakeFiller(scheduler, 'g')
+    scheduler.submit(filler)
+    assert filler.started
+    assert scheduler.progress() == '0/1 done, 1 running, 0 waiting'
+
+
+def test_insert_pages():
+    inserted = []
+
+    def refresh_window():
+        inserted.append('draw')
+        tab.closed = len(inserted) == 4
+
+    tab = SimpleNamespace(
+        closed=False,
+        _text_buffer=SimpleNamespace(add_history_messages=inserted.append),
+        core=SimpleNamespace(refresh_window=refresh_window),
+    )
+    loader = log_loader.LogLoader(None, tab)
+    fetched = []
+
+    async def pages():
+        try:
+            for page in (['c', 'd'], ['a', 'b'], ['y', 'z']):
+                fetched.append(page)
+                yield page
+        finally:
+            fetched.append('closed')
+
+    count = asyncio.run(loader.insert_pages(pages()))
+    assert count == 4
+    assert inserted == [['c', 'd'], 'draw', ['a', 'b'], 'draw']
+    # the page after the tab was closed is not requested
+    assert fetched == [['c', 'd'], ['a', 'b'], 'closed']
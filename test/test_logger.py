@@ -1,7 +1,9 @@
 """
 Test the functions in the `logger` module
 """
+import asyncio
 import datetime
+import sqlite3
 from pathlib import Path
 from random import sample
 from shutil import rmtree
@@ -18,10 +20,21 @@ import pytest
 class ConfigShim:
     def __init__(self, value):
         self.value = value
+        self.options = {
+            'log_flush_interval': 0.0,
+            'log_flush_size': 65536,
+            'log_fsync': False,
+            'log_backend': 'text',
+        }
 
     def get_by_tabname(self, name, *args, **kwargs):
         return self.value
 
+    def getfloat(self, name, *args, **kwargs):
+        return self.options[name]
+
+    getint = getbool = getstr = getfloat
+
 
 logger.config = ConfigShim(True)
 
@@ -109,3 +122,331 @@ def test_log_and_parse_messages():
             {'time': msg1['date'], 'history': True, 'txt': 'coucou', 'nickname': 'toto', 'type': 'message'},
         {'time': msg2['date'], 'history': True, 'txt': 'coucou\ncoucou', 'nickname': 'toto', 'type': 'message'},
     ]
+
+
+def test_iterate_messages_reverse_index(log_dir):
+    instance = logger.Logger()
+    instance.log_dir = log_dir
+    jid = 'toto@example.com'
+    base = datetime.datetime(2020, 1, 1, 12, 0, 0)
+    for i in range(120):
+        msg = Message('message %d\nline' % i, 'toto',
+                      time=base + datetime.timedelta(minutes=i))
+        instance.log_message(jid, msg)
+
+    messages = list(instance.iterate_messages_reverse(jid))
+    assert [msg['txt'] for msg in messages[:2]] == [
+        'message 119\nline', 'message 118\nline'
+    ]
+    assert len(messages) == 120
+
+    # the index is now loaded and kept up to date by log_raw
+    instance.log_message(jid, Message('last', 'toto'))
+    before = get_utc_time(base + datetime.timedelta(minutes=50)).replace(
+        tzinfo=datetime.timezone.utc)
+    messages = list(instance.iterate_messages_reverse(jid, before=before))
+    assert messages[0]['txt'] == 'message 49\nline'
+    assert len(messages) == 50
+    assert len(instance.get_index(jid)) == 121
+
+    # reload it from disk, and catch up with a message logged meanwhile
+    instance.close(jid)
+    other = logger.Logger()
+    other.log_dir = log_dir
+    other.log_message(jid, Message('after', 'toto'))
+    messages = list(other.iterate_messages_reverse(jid))
+    assert [msg['txt'] for msg in messages[:2]] == ['after', 'last']
+    assert len(messages) == 122
+
+
+def test_log_message_write_behind(log_dir, monkeypatch):
+    monkeypatch.setitem(logger.config.options, 'log_flush_interval', 0.01)
+    monkeypatch.setitem(logger.config.options, 'log_flush_size', 80)
+    instance = logger.Logger()
+    instance.log_dir = log_dir
+    jid = 'toto@example.com'
+
+    async def log_messages():
+        instance.log_message(jid, Message('content', 'toto'))
+        assert read_file(instance, jid) == ''
+        assert instance.queued_size > 0
+        await asyncio.sleep(0.05)
+        assert instance.queued_size == 0
+        assert instance.flush_count == 1
+        assert len(parse_log_lines(read_file(instance, jid).split('\n'))) == 1
+
+        # Too much data queued
+        for i in range(3):
+            instance.log_message(jid, Message('content %d' % i, 'toto'))
+        assert instance.flush_count == 2
+        assert len(parse_log_lines(read_file(instance, jid).split('\n'))) == 3
+
+        instance.close(jid)
+        assert len(parse_log_lines(read_file(instance, jid).split('\n'))) == 4
+
+    asyncio.run(log_messages())
+
+
+def test_search_index(log_dir):
+    instance = logger.Logger()
+    instance.log_dir = log_dir
+    jid = 'toto@example.com'
+    base = datetime.datetime(2020, 1, 1, 12, 0, 0)
+    for i in range(100):
+        msg = Message('message %d\n%s' % (i, 'odd' if i % 2 else 'even'),
+                      'toto' if i % 3 else 'titi',
+                      time=base + datetime.timedelta(minutes=i))
+        instance.log_message(jid, msg)
+    instance.log_raw(jid, build_log_message('', 'odd info'))
+
+    messages = instance.search(jid, ['Message', '42'])
+    assert [msg['txt'] for msg in messages] == ['message 42\neven']
+    messages = instance.search(jid, ['ODD'], limit=5)
+    assert [msg['txt'] for msg in messages] == [
+        'message %d\nodd' % i for i in (99, 97, 95, 93, 91)
+    ]
+    messages = instance.search(jid, ['odd'], nick='TITI')
+    assert len(messages) == 17
+    assert all(msg['nickname'] == 'titi' for msg in messages)
+    messages = instance.search(
+        jid, ['even'],
+        after=base + datetime.timedelta(minutes=10),
+        before=base + datetime.timedelta(minutes=20))
+    assert [msg['txt'] for msg in messages] == [
+        'message %d\neven' % i for i in (18, 16, 14, 12, 10)
+    ]
+    assert instance.search(jid, ['message', 'nothing']) == []
+
+    # the index is now loaded and kept up to date by log_raw
+    instance.log_message(jid, Message('nothing odd', 'toto'))
+    assert instance._search_indexes[jid].count == 102
+    messages = instance.search(jid, ['nothing'])
+    assert [msg['txt'] for msg in messages] == ['nothing odd']
+
+    # reload it from disk, and catch up with a message logged meanwhile
+    instance.close(jid)
+    other = logger.Logger()
+    other.log_dir = log_dir
+    later = datetime.datetime.now() + datetime.timedelta(minutes=1)
+    other.log_message('tata@example.com/res',
+                      Message('nothing', 'tata', time=later))
+    other.log_message(jid, Message('nothing else', 'toto',
+                                   time=later + datetime.timedelta(minutes=1)))
+    messages = other.search(jid, ['nothing'])
+    assert [msg['txt'] for msg in messages] == ['nothing else', 'nothing odd']
+    messages = asyncio.run(other.search_all(['nothing']))
+    assert [(jid, msg['txt']) for jid, msg in messages] == [
+        ('toto@example.com', 'nothing else'),
+        ('tata@example.com/res', 'nothing'),
+        ('toto@example.com', 'nothing odd'),
+    ]
+
+
+def test_index_cache(log_dir, monkeypatch):
+    monkeypatch.setattr(logger, 'INDEX_CACHE_SIZE', 2)
+    instance = logger.Logger()
+    instance.log_dir = log_dir
+    jids = ['room%d@example.com' % i for i in range(3)]
+    for jid in jids:
+        for i in range(3):
+            instance.log_message(jid, Message('message %d' % i, 'toto'))
+        assert len(instance.get_index(jid)) == 3
+    assert list(instance._indexes) == jids[1:]
+    instance.get_index(jids[1])
+    assert list(instance._indexes) == [jids[2], jids[1]]
+
+    # an evicted index is saved, and checked against the log when reloaded
+    instance.close(jids[1])
+    instance.close(jids[2])
+    assert (log_dir / logger.INDEX_DIR / jids[0]).exists()
+    path = instance.get_file_path(jids[0])
+    path.write_text('\n' + path.read_text())
+    messages = list(instance.iterate_messages_reverse(jids[0]))
+    assert [msg['txt'] for msg in messages] == [
+        'message %d' % i for i in (2, 1, 0)
+    ]
+
+
+def test_search_index_cache(log_dir, monkeypatch):
+    monkeypatch.setattr(logger, 'SEARCH_INDEX_CACHE_SIZE', 2)
+    instance = logger.Logger()
+    instance.log_dir = log_dir
+    jids = ['room%d@example.com' % i for i in range(4)]
+    for jid in jids:
+        instance.log_message(jid, Message('hello from %s' % jid, 'toto'))
+    # an index in an unknown format is rebuilt
+    (log_dir / logger.SEARCH_INDEX_DIR).mkdir()
+    (log_dir / logger.SEARCH_INDEX_DIR / jids[0]).write_text('0 0 hello\n')
+
+    for jid in jids:
+        messages = instance.search(jid, ['hello'])
+        assert [msg['txt'] for msg in messages] == ['hello from %s' % jid]
+    assert list(instance._search_indexes) == jids[2:]
+
+    # search_all does not keep the indexes of the logs not in use
+    other = logger.Logger()
+    other.log_dir = log_dir
+    other.get_index(jids[0])
+    messages = asyncio.run(other.search_all(['hello']))
+    assert len(messages) == 4
+    assert list(other._indexes) == [jids[0]]
+    assert list(other._search_indexes) == [jids[0]]
+
+
+def test_search_all_progress(log_dir, monkeypatch):
+    monkeypatch.setattr(logger, 'SEARCH_INDEX_BATCH', 10)
+    instance = logger.Logger()
+    instance.log_dir = log_dir
+    jids = ['room%d@example.com' % i for i in range(3)]
+    for jid in jids:
+        for i in range(20):
+            instance.log_message(jid, Message('hello %d' % i, 'toto'))
+    progress = []
+    ticks = []
+
+    async def tick():
+        while True:
+            ticks.append(len(progress))
+            await asyncio.sleep(0)
+
+    async def search():
+        ticker = asyncio.create_task(tick())
+        messages = await instance.search_all(
+            ['hello', '12'], progress=lambda *args: progress.append(args))
+        ticker.cancel()
+        return messages
+
+    messages = asyncio.run(search())
+    assert len(messages) == 3
+    assert progress == [(1, 3), (2, 3), (3, 3)]
+    # the other tasks ran while the first index was built
+    assert ticks.count(0) > 2
+
+
+def test_sqlite_backend(log_dir, monkeypatch):
+    jid = 'toto@example.com'
+    base = datetime.datetime(2020, 1, 1, 12, 0, 0)
+    instance = logger.Logger()
+    instance.log_dir = log_dir
+    for i in range(60):
+        msg = Message('message %d' % i, 'toto',
+                      time=base + datetime.timedelta(minutes=i))
+        instance.log_message(jid, msg)
+    instance.close(jid)
+
+    monkeypatch.setitem(logger.config.options, 'log_backend', 'sqlite')
+    instance = logger.Logger()
+    instance.log_dir = log_dir
+    # the text logs are imported on first use
+    messages = list(instance.iterate_messages_reverse(jid, batch_size=7))
+    assert len(messages) == 60
+    assert messages[0]['txt'] == 'message 59'
+    assert messages[0]['time'] == base + datetime.timedelta(minutes=59)
+    assert messages[0]['nickname'] == 'toto'
+
+    for i in range(60, 65):
+        msg = Message('message %d' % i, 'toto', identifier='id%d' % i,
+                      time=base + datetime.timedelta(minutes=i))
+        instance.log_message(jid, msg)
+    # the messages from the server archive are deduplicated by id
+    history = [
+        Message('message %d' % i, 'toto', identifier='id%d' % i,
+                time=base + datetime.timedelta(minutes=i))
+        for i in range(63, 70)
+    ]
+    instance.log_history(jid, history)
+    assert instance.last_message(jid)['txt'] == 'message 69'
+    messages = list(instance.iterate_messages_reverse(
+        jid, before=base + datetime.timedelta(minutes=30)))
+    assert len(messages) == 30
+    assert messages[0]['txt'] == 'message 29'
+    assert len(list(instance.iterate_messages_reverse(jid))) == 70
+    assert (log_dir / 'logs.db').exists()
+    assert read_file(instance, jid).count('\n') == 60
+
+    messages = instance.search(jid, ['Message', '64'])
+    assert [msg['txt'] for msg in messages] == ['message 64']
+    assert instance.search(jid, ['messag']) == []
+    messages = asyncio.run(instance.search_all(['message'], limit=2))
+    assert [(jid, msg['txt']) for jid, msg in messages] == [
+        (jid, 'message 69'), (jid, 'message 68'),
+    ]
+
+
+def test_sqlite_search_all(log_dir, monkeypatch):
+    jids = ['room%d@example.com' % i for i in range(3)]
+    instance = logger.Logger()
+    instance.log_dir = log_dir
+    for jid in jids:
+        instance.log_message(jid, Message('hello from %s' % jid, 'toto'))
+        instance.close(jid)
+
+    monkeypatch.setitem(logger.config.options, 'log_backend', 'sqlite')
+    instance = logger.Logger()
+    instance.log_dir = log_dir
+    store = instance.get_store()
+    # only what is imported is searched synchronously
+    assert store.search(None, ['hello']) == []
+    progress = []
+    messages = asyncio.run(instance.search_all(
+        ['hello'], progress=lambda *args: progress.append(args)))
+    assert sorted(jid for jid, _ in messages) == jids
+    assert progress == [(1, 3), (2, 3), (3, 3)]
+
+
+def test_sqlite_import_and_flush(log_dir, monkeypatch):
+    from poezio import log_sqlite
+    jid = 'toto@example.com'
+    base = datetime.datetime(2020, 1, 1, 12, 0, 0)
+    instance = logger.Logger()
+    instance.log_dir = log_dir
+    for i in range(30):
+        msg = Message('message %d\nsecond line' % i, 'toto',
+                      time=base + datetime.timedelta(minutes=i))
+        instance.log_message(jid, msg)
+    instance.close(jid)
+
+    monkeypatch.setitem(logger.config.options, 'log_backend', 'sqlite')
+    monkeypatch.setitem(logger.config.options, 'log_flush_interval', 0.01)
+    monkeypatch.setattr(log_sqlite, 'IMPORT_CHUNK_SIZE', 100)
+    instance = logger.Logger()
+    instance.log_dir = log_dir
+    store = instance.get_store()
+
+    async def import_and_log():
+        chunks = 0
+
+        async def count_chunks():
+            nonlocal chunks
+            while jid not in store._imported:
+                chunks += 1
+                await asyncio.sleep(0)
+
+        await asyncio.gather(instance.import_text_logs(jid), count_chunks())
+        # the import let the other tasks run between its chunks
+        assert chunks > 10
+        for i in range(30, 35):
+            msg = Message('message %d' % i, 'toto',
+                          time=base + datetime.timedelta(minutes=i))
+            instance.log_message(jid, msg)
+        # queued, and stored in a single transaction by the flush
+        assert len(instance._pending_rows[jid]) == 5
+        await asyncio.sleep(0.05)
+        assert instance.flush_count == 1
+        assert instance._pending_rows == {}
+
+    asyncio.run(import_and_log())
+    messages = list(instance.iterate_messages_reverse(jid))
+    assert len(messages) == 35
+    # the messages were not split between the chunks
+    assert messages[-1]['txt'] == 'message 0\nsecond line'
+    assert messages[5]['txt'] == 'message 29\nsecond line'
+    assert store.fts
+    messages = instance.search(jid, ['line', '12'])
+    assert [msg['txt'] for msg in messages] == ['message 12\nsecond line']
+
+    # the database of the previous log_dir is closed
+    instance.log_dir = log_dir / 'other'
+    assert instance.get_store() is not store
+    with pytest.raises(sqlite3.ProgrammingError):
+        store.last_message(jid)
@@ -0,0 +1,141 @@
+"""
+Test the batching of the presences received in a joined MucTab
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from slixmpp import JID
+
+from poezio.core import handlers
+from poezio.core.handlers import HandlerCore
+from poezio.tabs import muctab
+from poezio.tabs.muctab import MucTab
+from poezio.user import User, UserList
+
+
+ROOM = JID('room@muc.example')
+
+
+class ConfigShim:
+    def getfloat(self, name, *args, **kwargs):
+        return 0.0
+
+    def getstr(self, name, *args, **kwargs):
+        return ''
+
+    def get_by_tabname(self, name, *args, **kwargs):
+        return name == 'group_join_part'
+
+
+def presence(nick, typ='available'):
+    return {
+        'type': typ,
+        'from': JID('%s/%s' % (ROOM, nick)),
+        'muc': {'status_codes': set()},
+    }
+
+
+class FakeTabs:
+    def __init__(self, tab):
+        self.tab = tab
+        self.current_tab = None
+
+    def by_name_and_class(self, name, cls):
+        if name == ROOM.bare and isinstance(self.tab, cls):
+            return self.tab
+        return None
+
+
+@pytest.fixture
+def tab(monkeypatch):
+    tab = MucTab.__new__(MucTab)
+    tab._jid = ROOM
+    tab.own_nick = 'me'
+    tab.joined = True
+    tab._state = 'normal'
+    tab.presence_buffer = []
+    tab.presence_queue = []
+    tab._presence_handle = None
+    tab._join_part_batch = None
+    tab.users = UserList()
+    tab.messages = []
+    tab.core = SimpleNamespace(tabs=FakeTabs(tab), xmpp=None,
+                               disable_private_tabs=lambda *a, **kw: None)
+
+    def handle_presence_joined(stanza, status_codes):
+        nick = stanza['from'].resource
+        if stanza['type'] == 'unavailable':
+            tab.users.remove(tab.users.get(nick))
+            tab.add_join_part_message('%s left' % nick, nick, joined=False)
+        else:
+            tab.users.add(User(nick, 'none', '', '', 'participant', None,
+                               'red'))
+            tab.add_join_part_message('%s joined' % nick, nick, joined=True)
+
+    monkeypatch.setattr(tab, 'handle_presence_joined', handle_presence_joined)
+    def add_message(msg):
+        # strip the color codes
+        tab.messages.append(msg.txt.split('}')[-1])
+
+    monkeypatch.setattr(tab, 'add_message', add_message)
+    monkeypatch.setattr(tab, 'refresh_after_presence', lambda: None)
+    monkeypatch.setattr(tab, 'disable_self_ping_event', lambda: None)
+    monkeypatch.setattr(muctab.muc, 'leave_groupchat', lambda *a, **kw: None)
+    monkeypatch.setattr(muctab, 'config', ConfigShim())
+    monkeypatch.setattr(handlers, 'config', ConfigShim())
+    return tab
+
+
+def test_message_after_presence(tab):
+    found = []
+
+    async def handle_message(message):
+        found.append(tab.get_user_by_name('alice'))
+        tab.messages.append('message')
+        return True
+
+    tab.handle_message = handle_message
+    message = {'from': JID('%s/alice' % ROOM), 'type': 'groupchat'}
+
+    async def receive():
+        tab.handle_presence(presence('alice'))
+        assert tab.presence_queue
+        await HandlerCore(tab.core).on_groupchat_message(message)
+
+    asyncio.run(receive())
+    assert found[0] is not None and found[0].nick == 'alice'
+    assert tab.messages == ['alice joined', 'message']
+    assert not tab.presence_queue
+
+
+@pytest.mark.parametrize('joined', [True, False])
+def test_part_while_queued(tab, joined):
+    async def receive():
+        tab.handle_presence(presence('alice'))
+        handle = tab._presence_handle
+        assert handle is not None
+        tab.joined = joined
+        tab.leave_room('')
+        assert handle.cancelled()
+        await asyncio.sleep(0)
+
+    asyncio.run(receive())
+    assert tab.presence_queue == []
+    assert tab.presence_buffer == []
+    assert tab._presence_handle is None
+    assert tab.get_user_by_name('alice') is None
+    assert not any('alice' in msg for msg in tab.messages)
+
+
+def test_join_part_order(tab):
+    async def receive():
+        for stanza in (presence('alice'), presence('bob'),
+                       presence('alice', 'unavailable'), presence('alice')):
+            tab.handle_presence(stanza)
+        await asyncio.sleep(0)
+
+    asyncio.run(receive())
+    assert len(tab.messages) == 3
+    assert '2 users joined the room: alice, bob' in tab.messages[0]
+    assert tab.messages[1:] == ['alice left', 'alice joined']
@@ -0,0 +1,84 @@
+"""
+Test the discovery of the plugins by the PluginManager
+"""
+from types import ModuleType, SimpleNamespace
+
+from pytest import fixture
+
+from poezio import plugin_manager
+from poezio.plugin_manager import PluginManager
+
+
+class ConfigShim:
+    def __init__(self, plugins_dir):
+        self.plugins_dir = plugins_dir
+
+    def getstr(self, option, *args, **kwargs):
+        if option == 'plugins_dir':
+            return self.plugins_dir
+        return ''
+
+
+class DummyPlugin:
+    dependencies = set()
+    refs = {}
+
+    def __init__(self, name, api, core, conf_dir):
+        self.name = name
+
+
+class DummyEntryPoint:
+    def __init__(self, name):
+        self.name = name
+        self.loaded = 0
+
+    def load(self):
+        self.loaded += 1
+        module = ModuleType(self.name)
+        module.__file__ = '/site-packages/%s.py' % self.name
+        module.Plugin = DummyPlugin
+        return module
+
+
+@fixture
+def manager(tmp_path, monkeypatch):
+    monkeypatch.setattr(plugin_manager, 'config',
+                        ConfigShim(str(tmp_path / 'plugins')))
+    scans = []
+    entries = {name: DummyEntryPoint(name) for name in ('foo', 'bar')}
+
+    def scan_entry_points():
+        scans.append(None)
+        return entries
+
+    monkeypatch.setattr(plugin_manager, 'scan_entry_points',
+                        scan_entry_points)
+    informations = []
+    core = SimpleNamespace(
+        information=lambda msg, typ: informations.append((msg, typ)))
+    manager = PluginManager(core)
+    manager.scans = scans
+    manager.informations = informations
+    manager.entries = entries
+    return manager
+
+
+def test_load_entry_points(manager):
+    assert manager.scans == []
+    manager.load('foo', notify=False)
+    manager.load('bar', notify=False)
+    manager.load('nope', notify=False)
+    assert set(manager.plugins) == {'foo', 'bar'}
+    assert manager.entries['foo'].loaded == 1
+    assert manager.informations == [('Could not find plugin: nope', 'Error')]
+    # Only one scan for all the plugins
+    assert len(manager.scans) == 1
+
+
+def test_completion_load(manager):
+    (manager.plugins_dir / 'local.py').write_text('')
+    the_input = SimpleNamespace(
+        new_completion=None, get_argument_position=lambda quoted: 1)
+    completion = manager.completion_load(the_input)
+    assert {'bar', 'foo', 'local'} <= set(completion.comp_list)
+    assert len(manager.scans) == 1
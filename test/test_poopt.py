@@ -2,7 +2,7 @@
 Test of the poopt module
 """
 
-from poezio.poopt import cut_text
+from poezio.poopt import cut_text, cut_texts
 
 def test_cut_text():
 
@@ -14,3 +14,25 @@ def test_cut_text():
 
     text = 'vivent les réfrigérateurs'
     assert cut_text(text, 6) == [(0, 6), (6, 10), (11, 17), (17, 23), (23, 25)]
+
+
+def test_cut_texts():
+    texts = [
+        '12345678901234567890',
+        'a\nb\nc\nd',
+        'vivent les réfrigérateurs',
+        '',
+    ]
+    widths = [5, 10, 6, 4]
+    positions, counts = cut_texts(texts, widths)
+    assert list(counts) == [4, 4, 5, 1]
+    pos = 0
+    for text, width, count in zip(texts, widths, counts):
+        lines = [(positions[i], positions[i + 1])
+                 for i in range(pos, pos + 2 * count, 2)]
+        assert lines == cut_text(text, width)
+        pos += 2 * count
+
+    positions, counts = cut_texts(['abcd', 'e'], 2)
+    assert list(positions) == [0, 2, 2, 4, 0, 1]
+    assert list(counts) == [2, 1]
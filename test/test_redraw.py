@@ -0,0 +1,75 @@
+"""
+Test the RedrawScheduler
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from poezio.core import redraw
+from poezio.core.redraw import RedrawScheduler, TAB, TAB_WIN, INPUT
+
+
+class ConfigShim:
+    def __init__(self, interval):
+        self.interval = interval
+
+    def getfloat(self, name, *args, **kwargs):
+        return self.interval
+
+
+class FakeTab:
+    def __init__(self):
+        self.calls = []
+        self.state = 'normal'
+        self.input = SimpleNamespace(refresh=lambda: self.calls.append('input'))
+
+    def refresh(self):
+        self.calls.append('tab')
+
+    def refresh_tab_win(self):
+        self.calls.append('tab_win')
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    monkeypatch.setattr(redraw.curses, 'doupdate', lambda: None)
+    monkeypatch.setattr(redraw.curses, 'curs_set', lambda value: 1)
+    tab = FakeTab()
+    core = SimpleNamespace(
+        tabs=SimpleNamespace(current_tab=tab),
+        information_win_size=0,
+    )
+    return RedrawScheduler(core)
+
+
+def test_redraw_without_loop(scheduler, monkeypatch):
+    monkeypatch.setattr(redraw, 'config', ConfigShim(0.02))
+    scheduler.request(TAB_WIN, INPUT)
+    assert scheduler.core.tabs.current_tab.calls == ['tab_win', 'input']
+    assert scheduler.redraw_count == 1
+
+
+def test_redraw_coalesce(scheduler, monkeypatch):
+    monkeypatch.setattr(redraw, 'config', ConfigShim(0.01))
+    tab = scheduler.core.tabs.current_tab
+
+    async def requests():
+        for _ in range(50):
+            scheduler.request(TAB)
+            scheduler.request(TAB_WIN, INPUT)
+        assert tab.calls == []
+        await asyncio.sleep(0.05)
+        assert tab.calls == ['tab']
+        assert tab.state == 'current'
+
+        # The keyboard input path does not wait for the next frame
+        scheduler.request(INPUT)
+        scheduler.flush()
+        assert tab.calls == ['tab', 'input']
+        await asyncio.sleep(0.05)
+        assert tab.calls == ['tab', 'input']
+
+    asyncio.run(requests())
+    assert scheduler.request_count == 101
+    assert scheduler.redraw_count == 2
@@ -0,0 +1,36 @@
+"""
+Test the startup profiler
+"""
+import sys
+
+from poezio.startup_profile import StartupProfiler
+
+
+def test_startup_profile(tmp_path):
+    path = tmp_path / 'profile.txt'
+    written = []
+    profiler = StartupProfiler()
+    with profiler.phase('not enabled'):
+        pass
+    assert profiler.phases == []
+
+    profiler.enable(path)
+    with profiler.phase('imports'):
+        sys.modules.pop('json.tool', None)
+        import json.tool
+    assert 'json.tool' in profiler.imports
+    total, own = profiler.imports['json.tool']
+    assert 0 <= own <= total
+
+    # The report waits for the phases in progress
+    profiler.start_phase('roster fetch')
+    profiler.finish(written.append)
+    assert not path.exists()
+    profiler.end_phase('roster fetch')
+    assert written == [path]
+    assert [name for name, _ in profiler.phases] == ['imports', 'roster fetch']
+    report = path.read_text()
+    assert 'roster fetch' in report
+    assert 'json.tool' in report
+    assert profiler._timer is None
+    assert not profiler.enabled
@@ -1,13 +1,18 @@
 """
 Tests for the TextBuffer class
 """
+from datetime import datetime, timedelta
+
 from pytest import fixture
 
+from poezio import text_buffer
 from poezio.text_buffer import (
     TextBuffer,
     HistoryGap,
+    RingBuffer,
 )
 
+from poezio.ui.render import LineCache
 from poezio.ui.types import (
     Message,
     BaseMessage,
@@ -198,3 +203,310 @@ def test_add_history_empty(buf2048):
     buf2048.add_message(msg1)
     buf2048.add_history_messages([msg2, msg3, msg4])
     assert buf2048.messages == [msg2, msg3, msg4, msg1]
+
+
+def test_ring_buffer_evict():
+    ring = RingBuffer(range(10), limit=4)
+    assert ring.evict() == 6
+    assert ring == [6, 7, 8, 9]
+    assert ring.evict() == 0
+
+
+def test_ring_buffer_sequence():
+    ring = RingBuffer(range(10))
+    assert ring[0] == 0
+    assert ring[-1] == 9
+    assert ring[-3:] == [7, 8, 9]
+    assert ring[-5:-2] == [5, 6, 7]
+    assert ring[1:3] == [1, 2]
+    assert ring[:-4:-1] == [9, 8, 7]
+    assert ring[5:2] == []
+    assert list(reversed(ring)) == list(range(9, -1, -1))
+    ring.insert(2, 'a')
+    assert ring[:4] == [0, 1, 'a', 2]
+    assert ring.index('a') == 2
+    ring.remove('a')
+    assert 'a' not in ring
+    ring.insert_many(3, ['b', 'c'])
+    assert ring[:6] == [0, 1, 2, 'b', 'c', 3]
+    ring.insert_many(0, ['d'])
+    assert ring[0] == 'd'
+
+
+def test_message_nb_limit_history():
+    buf = TextBuffer(5)
+    for i in range(5):
+        buf.add_message(BaseMessage("%s" % i))
+    history = [BaseMessage('h1'), BaseMessage('h2')]
+    buf.add_history_messages(history)
+    assert len(buf.messages) == 7
+    assert buf.messages[:2] == history
+    buf.add_message(BaseMessage('new'))
+    assert len(buf.messages) == 5
+    assert buf.messages[-1].txt == 'new'
+
+
+def test_message_nb_limit_line_cache(monkeypatch):
+    cache = LineCache()
+    monkeypatch.setattr(text_buffer, 'line_cache', cache)
+    buf = TextBuffer(5)
+    for i in range(5):
+        buf.add_message(BaseMessage("%s" % i))
+        cache.get(buf.messages[-1], 20)
+    assert len(cache) == 5
+    buf.add_message(BaseMessage('new'))
+    buf.add_message(BaseMessage('newer'))
+    # The evicted messages are not kept alive by their lines
+    assert len(cache) == 3
+    buf.clear_line_cache()
+    assert len(cache) == 0
+
+
+def test_find_message_index():
+    buf = TextBuffer(5)
+    base = datetime(2020, 1, 1, 12, 0)
+    assert buf.find_message_index(base) == -1
+    for minute in (0, 10, 5, 20):
+        buf.add_message(BaseMessage(
+            '%d' % minute, time=base + timedelta(minutes=minute)))
+    assert buf.find_message_index(base - timedelta(minutes=1)) == -1
+    assert buf.find_message_index(base + timedelta(minutes=7)) == 0
+    # The message from 12:05 was received after the one from 12:10
+    assert buf.find_message_index(base + timedelta(minutes=10)) == 2
+    assert buf.find_message_index(base + timedelta(hours=1)) == 3
+
+    # The index is kept up to date
+    for minute in (30, 40, 50):
+        buf.add_message(BaseMessage(
+            '%d' % minute, time=base + timedelta(minutes=minute)))
+    assert [msg.txt for msg in buf.messages] == ['5', '20', '30', '40', '50']
+    assert buf.find_message_index(base + timedelta(minutes=45)) == 3
+    buf.add_history_messages(
+        [BaseMessage('0', time=base + timedelta(minutes=0))])
+    assert buf.find_message_index(base + timedelta(minutes=25)) == 2
+
+
+@fixture(scope='function')
+def text_win(monkeypatch):
+    from poezio.windows import base_wins, text_win
+    from poezio.config import DEFAULT_CONFIG
+    monkeypatch.setattr(base_wins, 'TAB_WIN', True)
+    monkeypatch.setattr(text_win.config, 'default', DEFAULT_CONFIG)
+    win = text_win.TextWin(2048)
+    win.width = 20
+    win.height = 5
+    return win
+
+
+def test_add_history_messages_window(buf2048, text_win):
+    buf2048.add_window(text_win)
+    msgs = [
+        Message('1', 'q'),
+        Message('a message long enough to be wrapped on several lines', 's'),
+        MucOwnLeaveMessage('leave'),
+        MucOwnJoinMessage('join'),
+        Message('3', 'd'),
+        Message('4', 'f', highlight=True),
+    ]
+    for msg in msgs:
+        buf2048.add_message(msg)
+    text_win.add_line_separator(buf2048)
+    buf2048.add_message(Message('after separator', 'g'))
+    text_win.pos = 2
+
+    gap = buf2048.find_last_gap_muc()
+    buf2048.add_history_messages([
+        Message('history', 'h', highlight=True),
+        Message('another message long enough to be wrapped', 'i'),
+    ], gap=gap)
+    buf2048.add_history_messages([Message('oldest', 'j', highlight=True)])
+    lines = list(text_win.built_lines)
+    assert text_win.pos == 2
+    assert [hl.msg.txt for hl in text_win.highlights] == [
+        'oldest', 'history', '4'
+    ]
+
+    text_win.rebuild_everything(buf2048)
+    text_win.build_older_lines()
+    assert [(l.msg, l.start_pos, l.end_pos) if l else None for l in lines] == \
+        [(l.msg, l.start_pos, l.end_pos) if l else None
+         for l in text_win.built_lines]
+
+
+def test_lazy_rebuild(buf2048, text_win, monkeypatch):
+    def fake_resize(self, height, width, y, x):
+        self.height, self.width = height, width
+    monkeypatch.setattr(type(text_win), '_resize', fake_resize)
+    text_win.width = 40
+    buf2048.add_window(text_win)
+    for i in range(100):
+        buf2048.add_message(Message('message %d' % i, 'nick'))
+    assert len(text_win.built_lines) == 100
+
+    # Nothing is built until the lines are needed
+    text_win.resize(5, 50, 0, 0, buf2048)
+    assert text_win._stale
+    buf2048.add_message(Message('message 100', 'nick'))
+    assert text_win._stale
+
+    # Then only the last ones are
+    assert len(text_win.built_lines) == 15
+    assert text_win.built_lines[-1].msg.txt == 'message 100'
+    text_win.scroll_up(10)
+    assert text_win.pos == 10
+    assert len(text_win.built_lines) == 20
+    assert text_win.built_lines[0].msg.txt == 'message 81'
+
+    text_win.build_older_lines()
+    assert [line.msg.txt for line in text_win.built_lines] == \
+        ['message %d' % i for i in range(101)]
+
+
+def first_lines(text_win):
+    lines = {}
+    for index, line in enumerate(text_win.built_lines):
+        if line is not None:
+            lines.setdefault(line.msg, index)
+    return lines
+
+
+def test_message_line(buf2048, text_win):
+    text_win.width = 40
+    buf2048.add_window(text_win)
+    messages = [Message('message %d' % i, 'nick') for i in range(30)]
+    messages[10] = Message('a longer message ' * 3, 'nick')
+    for message in messages[5:]:
+        buf2048.add_message(message)
+    text_win.rebuild_everything(buf2048)
+    assert text_win.message_line(messages[29]) == \
+        len(text_win.built_lines) - 1
+    assert text_win.message_line(messages[5]) is None
+
+    text_win.build_older_lines()
+    assert text_win.message_line(messages[5]) == 0
+    assert text_win.message_line(messages[11]) == 8
+
+    # Lines added above and below, and inserted
+    text_win.add_line_separator(buf2048)
+    buf2048.add_message(Message('last', 'nick'))
+    buf2048.add_history_messages(messages[:5])
+    lines = first_lines(text_win)
+    assert len(lines) == 31
+    for message, index in lines.items():
+        assert text_win.message_line(message) == index
+
+
+def test_line_numbers_bookkeeping(text_win):
+    from random import Random
+    from poezio.windows.text_win import TextWin
+    text_win.width = 40
+    buf = TextBuffer(2048)
+    buf.add_window(text_win)
+    text_win.lines_nb_limit = text_win._built_lines.limit = 60
+    rand = Random(42)
+
+    def check():
+        lines = list(text_win.built_lines)
+        if None in lines:
+            assert text_win._separator_index() == lines.index(None)
+        else:
+            assert text_win._separator_index() is None
+        for message, index in first_lines(text_win).items():
+            assert text_win.message_line(message) == index
+        assert not [hl for hl in text_win.highlights if hl not in lines]
+
+    numbered = []
+    original = TextWin._number_all_lines
+
+    def number_all_lines(self):
+        numbered.append(True)
+        original(self)
+
+    TextWin._number_all_lines = number_all_lines
+    try:
+        for i in range(300):
+            action = rand.random()
+            if action < 0.6:
+                buf.add_message(Message(
+                    'message %d ' % i * rand.randint(1, 4), 'nick',
+                    highlight=rand.random() < 0.2, identifier=str(i)))
+            elif action < 0.75:
+                text_win.remove_line_separator()
+                text_win.add_line_separator(buf)
+            elif action < 0.85:
+                buf.add_history_messages(
+                    [Message('history %d' % i, 'nick', highlight=True)],
+                )
+            elif action < 0.95 and buf.messages:
+                message = buf.messages[rand.randrange(len(buf.messages))]
+                if isinstance(message, Message):
+                    message.ack = 1
+                    text_win.modify_message(message.identifier, message)
+            else:
+                text_win.next_highlight()
+                text_win.previous_highlight()
+            check()
+    finally:
+        TextWin._number_all_lines = original
+    # Nothing was ever numbered again from scratch
+    assert numbered == []
+
+
+def test_evict_partial_message(text_win):
+    buf = TextBuffer(2048)
+    buf.add_window(text_win)
+    text_win.lines_nb_limit = text_win._built_lines.limit = 12
+    for i in range(6):
+        buf.add_message(Message('message %d is wrapped on lines' % i, 'n'))
+    # The first lines of a message are never evicted alone
+    first = text_win.built_lines[0]
+    assert first.start_pos == 0
+    assert len(text_win.built_lines) < 12
+
+    buf.add_history_messages([Message('history', 'n')])
+    assert text_win.built_lines[0].msg.txt == 'history'
+    for message, index in first_lines(text_win).items():
+        assert text_win.message_line(message) == index
+        assert text_win.built_lines[index].start_pos == 0
+
+
+def test_evict_highlights(text_win):
+    buf = TextBuffer(2048)
+    buf.add_window(text_win)
+    text_win.lines_nb_limit = text_win._built_lines.limit = 50
+    buf.add_message(Message('before', 'n'))
+    text_win.add_line_separator(buf)
+    for i in range(200):
+        buf.add_message(Message('msg %d' % i, 'n', highlight=i % 5 == 0))
+    assert text_win._separator_index() is None
+    highlights = len(text_win.highlights)
+    assert text_win.nb_of_highlights_after_separator == highlights
+
+    text_win.scroll_to_separator()
+    assert text_win.hl_pos == -1
+    for i in range(highlights):
+        text_win.next_highlight()
+        assert text_win.hl_pos == i
+    text_win.next_highlight()
+    assert text_win.hl_pos is None
+
+
+def test_highlights_stale_window(buf2048, text_win, monkeypatch):
+    def fake_resize(self, height, width, y, x):
+        self.height, self.width = height, width
+    monkeypatch.setattr(type(text_win), '_resize', fake_resize)
+    buf2048.add_window(text_win)
+    for i in range(50):
+        buf2048.add_message(Message('msg %d' % i, 'n', highlight=i % 5 == 0))
+    text_win.previous_highlight()
+    assert text_win.hl_pos == 9
+
+    text_win.resize(5, 30, 0, 0, buf2048)
+    assert text_win._stale
+    text_win.previous_highlight()
+    assert not text_win._stale
+    assert text_win.hl_pos == 9
+    text_win.previous_highlight()
+    assert text_win.hl_pos == 8
+    text_win.next_highlight()
+    assert text_win.hl_pos == 9
@@ -1,6 +1,11 @@
+import curses
+
+from poezio.ui import funcs
 from poezio.ui.funcs import (
     find_first_format_char,
+    find_run,
     parse_attrs,
+    parse_runs,
     truncate_nick,
 )
 
@@ -44,3 +49,30 @@ def test_parse_attrs_previous():
     text = "coucou"
     previous = ['u']
     assert parse_attrs(text, previous=previous) == previous
+
+
+def test_parse_runs(monkeypatch):
+    # color pairs, as curses.color_pair() would return them
+    monkeypatch.setattr(funcs, 'to_curses_attr', lambda color: color[0] << 8)
+    text = 'a\x19bbold\x194}color\x192,-1}other\x19otext'
+    runs = parse_runs(text)
+    assert [text[start:end] for start, end, _ in runs] == \
+        ['a', 'bold', 'color', 'other', 'text']
+    assert [attr for _, _, attr in runs] == [
+        0,
+        curses.A_BOLD,
+        curses.A_BOLD | 4 << 8,
+        curses.A_BOLD | 2 << 8,
+        0,
+    ]
+    assert find_run(runs, 0) == 0
+    assert find_run(runs, 2) == 1
+    assert find_run(runs, 5) == 1
+    assert find_run(runs, 7) == 2
+    assert find_run(runs, len(text)) == len(runs)
+
+
+def test_parse_runs_no_format():
+    assert parse_runs('toto') == [(0, 4, 0)]
+    assert parse_runs('') == []
+    assert parse_runs('toto\x19') == [(0, 4, 0)]
@@ -2,7 +2,10 @@ import pytest
 from contextlib import contextmanager
 from datetime import datetime
 from poezio.theming import get_theme
-from poezio.ui.render import build_lines, Line, write_pre
+from poezio.ui.render import (
+    build_lines, build_many_lines, Line, LineCache, write_pre,
+)
+from poezio.ui import render
 from poezio.ui.types import BaseMessage, Message, StatusMessage, XMLLog
 
 def test_simple_build_basemsg():
@@ -38,6 +41,56 @@ def test_simple_render_status():
     assert msg.txt == "Coucou titi"
 
 
+def test_build_lines_cache(monkeypatch):
+    cache = LineCache(size=3)
+    monkeypatch.setattr(render, 'line_cache', cache)
+    msg = Message(txt='coucou ' * 20, nickname='toto')
+    lines = build_lines(msg, 50, True, 10)
+    assert len(lines) > 1
+    assert cache.misses == 1
+
+    again = build_lines(msg, 50, True, 10)
+    assert [(l.start_pos, l.end_pos) for l in again] == \
+        [(l.start_pos, l.end_pos) for l in lines]
+    assert cache.hits == 1
+    build_lines(msg, 100, True, 10)
+    build_lines(msg, 50, True, 10)
+    assert (cache.hits, cache.misses) == (2, 2)
+
+    # The text changed, the lines are built again
+    msg.txt = 'coucou'
+    assert len(build_lines(msg, 50, True, 10)) == 1
+    assert cache.misses == 3
+
+    other = Message(txt='other', nickname='titi')
+    build_lines(other, 50, True, 10)
+    build_lines(other, 60, True, 10)
+    assert len(cache) == 3
+    cache.invalidate(other)
+    assert len(cache) == 1
+
+
+def test_build_many_lines(monkeypatch):
+    monkeypatch.setattr(render, 'line_cache', LineCache())
+    msgs = [
+        Message(txt='coucou ' * 20, nickname='toto'),
+        None,
+        Message(txt='', nickname='toto'),
+        XMLLog(txt='<message/>', incoming=True),
+        BaseMessage(txt='info ' * 30),
+    ]
+    built = build_many_lines(msgs, 50, True, 10)
+    render.line_cache.clear()
+    expected = [build_lines(msg, 50, True, 10) for msg in msgs]
+    assert [[(l.start_pos, l.end_pos) if l else l for l in lines]
+            for lines in built] == \
+        [[(l.start_pos, l.end_pos) if l else l for l in lines]
+         for lines in expected]
+    # Everything is in the cache now
+    built = build_many_lines(msgs, 50, True, 10)
+    assert render.line_cache.hits == 3
+
+
 class FakeBuffer:
     def __init__(self):
         self.text = ''
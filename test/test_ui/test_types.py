@@ -1,6 +1,7 @@
 import pytest
 from datetime import datetime
 
+from poezio import theming
 from poezio.ui.types import BaseMessage, Message, XMLLog
 
 
@@ -124,3 +125,43 @@ def test_basemessage_offset():
     )
     example = '10:10:10 '
     assert msg.compute_offset(True, 10) == len(example)
+
+
+def test_message_offset_memoized(monkeypatch):
+    msg = Message(
+        txt="coucou",
+        nickname="toto",
+    )
+    calls = []
+    compute = Message._compute_offset
+
+    def counting(self, *args):
+        calls.append(args)
+        return compute(self, *args)
+
+    monkeypatch.setattr(Message, '_compute_offset', counting)
+    assert msg.compute_offset(True, 10) == len("10:10:10 toto> ")
+    assert msg.compute_offset(True, 10) == len("10:10:10 toto> ")
+    assert len(calls) == 1
+
+    # Anything the prefix depends on invalidates the offset
+    msg.ack = 1
+    assert msg.compute_offset(True, 10) == len("10:10:10 V toto> ")
+    assert msg.compute_offset(False, 2) == len("V to…> ")
+    monkeypatch.setattr(theming, 'theme_generation',
+                        theming.theme_generation + 1)
+    assert msg.compute_offset(False, 2) == len("V to…> ")
+    assert len(calls) == 4
+
+
+def test_message_prefix_strings():
+    msg = Message(
+        txt="coucou",
+        nickname="totototo",
+        time=datetime(2019, 9, 1, 10, 10, 10),
+    )
+    assert msg.format_time(False) == ('10:10:10', 8)
+    assert msg.format_time(True) == ('2019-09-01 10:10:10', 19)
+    assert msg.short_nick(4) == ('toto…', 5)
+    msg.nickname = 'titi'
+    assert msg.short_nick(4) == ('titi', 4)
@@ -5,7 +5,7 @@ Tests for the User class
 import pytest
 from datetime import datetime
 from slixmpp import JID
-from poezio.user import User
+from poezio.user import User, UserList
 
 
 @pytest.fixture
@@ -42,3 +42,46 @@ def test_change_nick(user1):
 def test_change_color(user1):
     user1.change_color('blue')
     assert user1.color == (21, -1)
+
+
+def new_user(nick, role='participant'):
+    return User(nick, 'none', '', '', role, JID('foo@muc/' + nick), 'red')
+
+
+def test_user_list_order():
+    users = UserList()
+    for nick, role in (('b', 'participant'), ('C', 'participant'),
+                       ('a', 'visitor'), ('z', 'moderator')):
+        users.add(new_user(nick, role))
+    assert users.nicks() == ['z', 'b', 'C', 'a']
+    assert sorted(users) == list(users)
+
+    user = users.get('a')
+    user.update('none', '', '', 'moderator')
+    users.update(user)
+    assert users.nicks() == ['a', 'z', 'b', 'C']
+
+    user = users.get('C')
+    user.change_nick('0')
+    users.update(user)
+    assert users.nicks() == ['a', 'z', '0', 'b']
+    assert users.get('C') is None
+    assert users.get('0') is user
+
+    users.remove(users.get('z'))
+    assert users.nicks() == ['a', '0', 'b']
+    assert len(users) == 3
+
+
+def test_user_list_last_talked():
+    users = UserList()
+    for nick in ('a', 'b', 'c', 'd'):
+        users.add(new_user(nick))
+    for nick, minute in (('c', 1), ('a', 2), ('c', 3)):
+        user = users.get(nick)
+        user.set_last_talked(datetime(2020, 1, 1, 0, minute))
+        users.touch(user)
+    assert [user.nick for user in users.by_last_talked()] == \
+        ['c', 'a', 'b', 'd']
+    users.remove(users.get('c'))
+    assert [user.nick for user in users.by_last_talked()] == ['a', 'b', 'd']
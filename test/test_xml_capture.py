@@ -0,0 +1,74 @@
+"""
+Test the on-disk capture of the XML tab
+"""
+import io
+
+from poezio.xml_capture import HEADER, XMLCapture
+
+STANZA = '<message id="%d"><body>café</body></message>'
+
+
+def fill(capture, start, end):
+    return [
+        capture.append((STANZA % i).encode('utf-8'), i % 2 == 0, 3600.0 * i)
+        for i in range(start, end)
+    ]
+
+
+def test_capture(tmp_path):
+    path = tmp_path / 'capture'
+    capture = XMLCapture(path, 1024 * 1024)
+    assert fill(capture, 0, 10) == list(range(10))
+    assert len(capture) == 10
+    assert capture.read(3) == (3 * 3600.0, False,
+                               (STANZA % 3).encode('utf-8'))
+    assert capture.read(10) is None
+    assert [record_id for record_id, _ in capture.read_range(-5, 3)] == \
+        [0, 1, 2]
+    capture.close()
+
+    # The records are found again, and an incomplete one is dropped
+    with path.open('ab') as fd:
+        fd.write(HEADER.pack(100, 0.0, 1) + b'<message')
+    capture = XMLCapture(path, 1024 * 1024)
+    assert capture.next_id == 10
+    assert capture.append(b'<iq/>', True, 0.0) == 10
+    assert capture.read(10) == (0.0, True, b'<iq/>')
+    assert capture.read(9)[2] == (STANZA % 9).encode('utf-8')
+    capture.close()
+
+
+def test_capture_rotation(tmp_path):
+    path = tmp_path / 'capture'
+    size = HEADER.size + len((STANZA % 0).encode('utf-8'))
+    # Five records per file
+    capture = XMLCapture(path, 10 * size + 1)
+    fill(capture, 0, 12)
+    assert (tmp_path / 'capture.1').exists()
+    assert path.stat().st_size + (tmp_path / 'capture.1').stat().st_size \
+        <= 10 * size + 1
+    assert (capture.first_id, capture.next_id) == (5, 12)
+    assert capture.read(4) is None
+    assert capture.read(5)[2] == (STANZA % 5).encode('utf-8')
+    assert [record_id for record_id, _ in capture.read_range(0, 20)] == \
+        list(range(5, 12))
+    capture.close()
+
+    capture = XMLCapture(path, 10 * size + 1)
+    assert len(capture) == 7
+    assert capture.read(0)[2] == (STANZA % 5).encode('utf-8')
+    capture.close()
+
+
+def test_capture_dump(tmp_path):
+    capture = XMLCapture(tmp_path / 'capture', 1024 * 1024)
+    fill(capture, 0, 3)
+    fd = io.BytesIO()
+    assert capture.dump(fd, [2, 0, 7]) == 2
+    lines = fd.getvalue().decode('utf-8').splitlines()
+    assert [line.split(' ', 1)[1] for line in lines] == [
+        'IN ' + STANZA % 2, 'IN ' + STANZA % 0]
+    fd = io.BytesIO()
+    assert capture.dump(fd) == 3
+    assert fd.getvalue().count(b'\n') == 3
+    capture.close()
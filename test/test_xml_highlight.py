@@ -0,0 +1,120 @@
+"""
+Test the XMLHighlighter
+"""
+import asyncio
+
+import pytest
+
+from poezio.core import xml_highlight
+from poezio.core.xml_highlight import XMLHighlighter, colorize
+from poezio.ui.types import XMLLog
+from poezio.xhtml import clean_text
+
+STANZA = '<message to="toto@example.com" id="1"><body>coucou</body></message>'
+
+
+class ConfigShim:
+    def __init__(self, thread):
+        self.thread = thread
+
+    def getbool(self, name, *args, **kwargs):
+        return self.thread
+
+
+@pytest.fixture
+def highlighter(monkeypatch):
+    monkeypatch.setattr(xml_highlight, 'config', ConfigShim(False))
+    return XMLHighlighter(size=2)
+
+
+def test_colorize(monkeypatch):
+    from poezio import xhtml
+    # enable_css_parsing
+    monkeypatch.setattr(xhtml, 'config', ConfigShim(True))
+    colored = colorize(STANZA)
+    assert clean_text(colored) == STANZA
+    if xml_highlight.get_pygments():
+        assert colored != STANZA
+    assert colorize('  ') == '  '
+
+
+def test_highlight_cached(highlighter):
+    msg = XMLLog(txt=STANZA, incoming=True)
+    assert msg.raw is msg.txt
+    assert not msg.highlighted
+    done = []
+    highlighter.highlight([msg], done.extend)
+    assert done == [msg]
+    assert msg.highlighted
+    assert msg.raw == STANZA
+    assert clean_text(msg.txt) == STANZA
+
+    # Already colorized
+    highlighter.highlight([msg], done.extend)
+    assert done == [msg]
+
+    other = XMLLog(txt=STANZA, incoming=False)
+    highlighter.highlight([other], done.extend)
+    assert done == [msg, other]
+    assert other.txt == msg.txt
+    assert (highlighter.hits, highlighter.misses) == (1, 1)
+
+    # The cache is bounded
+    for i in range(3):
+        highlighter.highlight([XMLLog(txt='<iq id="%s"/>' % i, incoming=True)],
+                              done.extend)
+    highlighter.highlight([XMLLog(txt=STANZA, incoming=True)], done.extend)
+    assert highlighter.misses == 5
+
+
+def test_highlight_thread(highlighter, monkeypatch):
+    monkeypatch.setattr(xml_highlight, 'config', ConfigShim(True))
+    msgs = [XMLLog(txt=STANZA, incoming=True),
+            XMLLog(txt='<iq id="2"/>', incoming=False)]
+    done = []
+
+    async def run():
+        highlighter.highlight(msgs, done.extend)
+        if xml_highlight.get_pygments():
+            assert done == []
+            # Pending messages are not submitted twice
+            highlighter.highlight(msgs, done.extend)
+            for _ in range(100):
+                if done:
+                    break
+                await asyncio.sleep(0.01)
+        assert done == msgs
+
+    asyncio.run(run())
+    assert all(msg.highlighted for msg in msgs)
+    assert clean_text(msgs[1].txt) == '<iq id="2"/>'
+
+
+def test_highlight_rebuild_lines(highlighter, monkeypatch):
+    from poezio.text_buffer import TextBuffer
+    from poezio.windows import base_wins, text_win
+    from poezio.config import DEFAULT_CONFIG
+    monkeypatch.setattr(base_wins, 'TAB_WIN', True)
+    monkeypatch.setattr(text_win.config, 'default', DEFAULT_CONFIG)
+    win = text_win.TextWin(2048)
+    win.width = 30
+    win.height = 10
+    buf = TextBuffer()
+    buf.add_window(win)
+    msgs = [XMLLog(txt=STANZA, incoming=True) for _ in range(3)]
+    for msg in msgs:
+        buf.add_message(msg)
+    nb_lines = len(win.built_lines)
+    raw_lines = [msgs[1].txt[line.start_pos:line.end_pos]
+                 for line in win.built_lines if line.msg is msgs[1]]
+
+    def rebuild(messages):
+        for msg in messages:
+            win.modify_message(None, msg)
+
+    highlighter.highlight([msgs[1]], rebuild)
+    assert len(win.built_lines) == nb_lines
+    lines = [line for line in win.built_lines if line.msg is msgs[1]]
+    assert [clean_text(msgs[1].txt[line.start_pos:line.end_pos])
+            for line in lines] == raw_lines
+    assert [line.msg for line in win.built_lines][::len(lines)] == msgs
@@ -0,0 +1,167 @@
+"""
+Test the stanza filters of the XMLTab
+"""
+import io
+from types import SimpleNamespace
+
+from pytest import fixture
+
+from slixmpp import JID, Message
+from slixmpp.xmlstream import matcher
+
+from poezio.tabs import xmltab
+from poezio.tabs.xmltab import MatchJID, XMLTab, stanza_info
+from poezio.text_buffer import TextBuffer
+from poezio.ui.types import XMLLog
+from poezio.xml_capture import XMLCapture
+
+
+class DummyTextWin:
+    built_lines = []
+    pos = 0
+    height = 10
+
+    def rebuild_everything(self, buffer):
+        pass
+
+
+class DummyXMLTab(XMLTab):
+    def __init__(self):
+        self.filters = []
+        self._parsed = xmltab.OrderedDict()
+        self.core = SimpleNamespace(tabs=SimpleNamespace(current_tab=None))
+        self.core_buffer = TextBuffer(2048)
+        self.filtered_buffer = TextBuffer(2048)
+        self.text_win = DummyTextWin()
+        self.filter_type = ''
+        self.filter = ''
+        self.capture = None
+        self.capture_start = 0
+
+    def _parse(self, msg):
+        self.parsed.append(msg)
+        return XMLTab._parse(self, msg)
+
+
+def make_stanza(mfrom, mto, mid, body='coucou'):
+    msg = Message()
+    msg['from'] = mfrom
+    msg['to'] = mto
+    msg['id'] = mid
+    msg['type'] = 'chat'
+    msg['body'] = body
+    return msg
+
+
+def test_stanza_info():
+    stanza = make_stanza('Toto@example.com/res', 'tata@example.com', 'a1')
+    info = stanza_info(stanza.xml)
+    assert info.from_ == 'toto@example.com/res'
+    assert info.to == 'tata@example.com'
+    assert info.id == 'a1'
+    assert info.type == 'chat'
+    assert info.tag == '{jabber:client}message'
+
+
+def test_match_info():
+    stanza = make_stanza('toto@example.com/res', 'tata@example.com', 'a1')
+    info = stanza_info(stanza.xml)
+    for jid, dest in (('toto@example.com', ''),
+                      ('toto@example.com/res', 'from'),
+                      ('toto@example.com/other', ''),
+                      ('tata@example.com', 'to'),
+                      ('tata@example.com', 'from')):
+        jid_matcher = MatchJID(JID(jid), dest)
+        assert jid_matcher.match_info(info) == jid_matcher.match(stanza)
+
+
+@fixture
+def no_windows(monkeypatch):
+    monkeypatch.setattr(TextBuffer, 'add_window', lambda self, win: None)
+    monkeypatch.setattr(TextBuffer, 'del_window', lambda self, win: None)
+
+
+def test_filters(no_windows):
+    tab = DummyXMLTab()
+    tab.parsed = []
+    stanzas = [
+        make_stanza('toto@example.com/a', 'me@example.com', str(i))
+        for i in range(5)
+    ] + [make_stanza('tata@example.com', 'me@example.com', '3')]
+    # Messages without their attributes are parsed when needed
+    messages = [XMLLog(txt=str(stanza), incoming=True) for stanza in stanzas]
+    messages[2].info = stanza_info(stanzas[2].xml)
+    tab.core_buffer.messages = messages[:]
+
+    tab.update_filters(MatchJID(JID('toto@example.com')))
+    assert tab.filtered_buffer.messages == messages[:5]
+    assert len(tab.parsed) == 5
+    assert all(msg.info is not None for msg in messages)
+
+    # Only the messages matching the previous filters are tested, and the
+    # parsed stanzas are reused
+    tab.update_filters(matcher.MatcherId('3'))
+    assert tab.filtered_buffer.messages == [messages[3]]
+    tab.update_filters(
+        matcher.MatchXPath('{jabber:client}message/{jabber:client}body'))
+    assert tab.filtered_buffer.messages == [messages[3]]
+    assert len(tab.parsed) == 6
+    assert len(tab._parsed) == 5
+    assert tab.filter_type == 'JID,ID,XPath'
+
+    # New stanzas are matched without being parsed
+    new = make_stanza('toto@example.com/b', 'me@example.com', '3')
+    other = make_stanza('toto@example.com/b', 'me@example.com', '4')
+    tab.add_stanza(new, incoming=True)
+    tab.add_stanza(other, incoming=True)
+    tab.add_stanza(' ', incoming=False)
+    assert len(tab.core_buffer.messages) == 9
+    assert [msg.raw for msg in tab.filtered_buffer.messages] == [
+        str(stanzas[3]), str(new)]
+    assert len(tab.parsed) == 6
+
+
+def test_capture(tmp_path, no_windows):
+    capture = XMLCapture(tmp_path / 'capture', 1024 * 1024)
+    # Captured before the tab was opened
+    old = [
+        make_stanza('toto@example.com' if i % 2 else 'tata@example.com',
+                    'me@example.com', str(i)) for i in range(5)
+    ]
+    for stanza in old:
+        capture.append(str(stanza).encode('utf-8'), True, 0.0)
+    tab = DummyXMLTab()
+    tab.parsed = []
+    tab.capture = capture
+    new = make_stanza('me@example.com', 'toto@example.com', '5')
+    tab.add_stanza(new, incoming=False)
+    assert tab.core_buffer.messages[0].capture_id == 5
+
+    # The older stanzas are read from the capture when scrolling up
+    loaded = tab.load_captured(3)
+    assert [msg.capture_id for msg in loaded] == [2, 3, 4]
+    assert [msg.raw for msg in loaded] == [str(stanza) for stanza in old[2:]]
+    tab.update_filters(MatchJID(JID('toto@example.com')))
+    assert len(tab.filtered_buffer.messages) == 2
+    loaded = tab.load_captured(3)
+    assert [msg.capture_id for msg in loaded] == [0, 1]
+    assert [msg.capture_id for msg in tab.filtered_buffer.messages] == \
+        [1, 3, 5]
+    assert tab.load_captured(3) == []
+
+    # /dump copies the captured stanzas
+    fd = io.BytesIO()
+    tab.dump_capture(fd)
+    assert len(fd.getvalue().splitlines()) == 3
+    tab.filters = []
+    fd = io.BytesIO()
+    tab.dump_capture(fd)
+    lines = fd.getvalue().decode('utf-8').splitlines()
+    assert [line.split(' ', 2)[1:] for line in lines] == \
+        [['IN', str(stanza)] for stanza in old] + [['OUT', str(new)]]
+
+    # The records cleared with /clear are not read again
+    tab.core_buffer.messages = []
+    tab.capture_start = capture.next_id
+    assert tab.load_captured(3) == []
+    capture.close()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for TextBuffer/TextWin message ingestion.
+
+Measures the mean cost of add_message() for consecutive batches of
+messages, so that the per-message cost can be checked to stay flat once
+the max_messages_in_memory/max_lines_in_memory limits are reached.
+
+Usage: python3 tools/benchmarks/text_buffer.py [limit] [messages]
+"""
+
+import os
+import sys
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from poezio.config import config, DEFAULT_CONFIG
+from poezio.text_buffer import TextBuffer
+from poezio.ui.types import Message
+from poezio.windows import base_wins
+from poezio.windows.text_win import TextWin
+
+
+def main():
+    limit = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    total = int(sys.argv[2]) if len(sys.argv) > 2 else 5 * limit
+    batch = max(total // 10, 1)
+
+    config.default = DEFAULT_CONFIG
+    base_wins.TAB_WIN = True  # No curses window is needed here
+    buf = TextBuffer(limit)
+    win = TextWin(limit)
+    win.width = 120
+    buf.add_window(win)
+
+    print('limit: %d messages, %d messages per batch' % (limit, batch))
+    for start in range(0, total, batch):
+        msgs = [
+            Message('message number %d' % i, nickname='nick%d' % (i % 50))
+            for i in range(start, start + batch)
+        ]
+        before = perf_counter()
+        for msg in msgs:
+            buf.add_message(msg)
+        elapsed = perf_counter() - before
+        print('%8d messages in buffer: %6.2f µs/message' %
+              (len(buf.messages), elapsed / batch * 1e6))
+
+
+if __name__ == '__main__':
+    main()